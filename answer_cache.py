@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of generated answers for the chat server.
+
+Two tiers are consulted in order:
+
+  exact     an LRU keyed by the normalised query text and a ``scope`` (the
+            retrieval settings, e.g. top-k and filters); a hit skips
+            embedding, search and generation entirely.
+  semantic  a cached answer is reused when the new query's embedding has a
+            cosine similarity of at least ``threshold`` with a cached query's
+            *and* retrieval returned the same chunk ids, so paraphrases that
+            would be answered from identical context share one LLM call.
+
+Entries expire after ``ttl`` seconds and the least recently used ones are
+dropped beyond ``max_entries``. Every entry belongs to the index build it was
+answered from; when the build hash changes the whole cache is cleared.
+"""
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_PUNCT = re.compile(r'[\s?!.]+$')
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation."""
+    return _TRAILING_PUNCT.sub('', ' '.join(query.lower().split()))
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    chunks: List[Dict[str, Any]]
+    chunk_ids: Tuple[Any, ...]
+    embedding: Optional[np.ndarray]
+    expires: float
+
+
+class AnswerCache:
+    """Exact + semantic answer cache with TTL, LRU bound and build invalidation."""
+
+    def __init__(
+        self,
+        max_entries: int = 512,
+        ttl: float = 3600.0,
+        threshold: float = 0.95,
+        log_every: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.threshold = threshold
+        self.log_every = log_every
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, Hashable], CachedAnswer]' = OrderedDict()
+        self._build: Optional[str] = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def get_exact(self, query: str, scope: Hashable, build_hash: Optional[str]) -> Optional[CachedAnswer]:
+        """Look up the exact tier. Does not count a miss; ``get_semantic`` does."""
+        key = (normalize_query(query), scope)
+        with self._lock:
+            self._check_build(build_hash)
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+        self._maybe_log()
+        return entry
+
+    def get_semantic(
+        self,
+        embedding: np.ndarray,
+        chunk_ids: Sequence[Any],
+        scope: Hashable,
+        build_hash: Optional[str],
+    ) -> Optional[CachedAnswer]:
+        """Look up the semantic tier for a query that missed the exact tier."""
+        query_vec = _unit(embedding)
+        chunk_ids = tuple(chunk_ids)
+        entry = None
+        with self._lock:
+            self._check_build(build_hash)
+            self._expire()
+            candidates = [(key, e) for key, e in self._entries.items()
+                          if key[1] == scope and e.chunk_ids == chunk_ids and e.embedding is not None]
+            if candidates:
+                sims = np.stack([e.embedding for _, e in candidates]) @ query_vec
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    key, entry = candidates[best]
+                    self._entries.move_to_end(key)
+                    logger.debug("Semantic answer cache hit: similarity=%.4f", sims[best])
+            if entry is None:
+                self.misses += 1
+            else:
+                self.semantic_hits += 1
+        self._maybe_log()
+        return entry
+
+    def put(
+        self,
+        query: str,
+        scope: Hashable,
+        answer: str,
+        chunks: List[Dict[str, Any]],
+        chunk_ids: Sequence[Any],
+        embedding: Optional[np.ndarray],
+        build_hash: Optional[str],
+    ) -> None:
+        key = (normalize_query(query), scope)
+        entry = CachedAnswer(
+            answer=answer,
+            chunks=chunks,
+            chunk_ids=tuple(chunk_ids),
+            embedding=_unit(embedding) if embedding is not None else None,
+            expires=self._clock() + self.ttl,
+        )
+        with self._lock:
+            self._check_build(build_hash)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, float]:
+        hits = self.exact_hits + self.semantic_hits
+        lookups = hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'exact_hits': self.exact_hits,
+            'semantic_hits': self.semantic_hits,
+            'misses': self.misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def log_stats(self) -> None:
+        st = self.stats()
+        logger.info("Answer cache: exact=%d semantic=%d misses=%d hit_rate=%.1f%% entries=%d",
+                    st['exact_hits'], st['semantic_hits'], st['misses'],
+                    100.0 * st['hit_rate'], st['entries'])
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _maybe_log(self) -> None:
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            self.log_stats()
+
+    def _check_build(self, build_hash: Optional[str]) -> None:
+        # Called with the lock held, as is _expire.
+        if build_hash == self._build:
+            return
+        if self._entries:
+            logger.info("Index build changed (%s -> %s); clearing %d cached answers",
+                        self._build, build_hash, len(self._entries))
+            self._entries.clear()
+            self.invalidations += 1
+        self._build = build_hash
+
+    def _expire(self) -> None:
+        now = self._clock()
+        stale = [key for key, e in self._entries.items() if e.expires <= now]
+        for key in stale:
+            del self._entries[key]
+        self.expirations += len(stale)
+
+
+def _unit(vec: np.ndarray) -> np.ndarray:
+    vec = np.asarray(vec, dtype='float32').reshape(-1)
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
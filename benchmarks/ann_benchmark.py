@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Recall / latency benchmark for the FAISS index types in build_index.py.
+
+Vectors come from an existing index directory (``vectors.bin`` or a flat
+``faiss_index.bin``) or from a synthetic clustered dataset. Every index type
+is built with the same automatic parameters ``build_index.py`` would use and
+compared against exact flat search:
+
+    python benchmarks/ann_benchmark.py --index-dir index
+    python benchmarks/ann_benchmark.py --synthetic 100000 --dim 384 --k 10
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from build_index import INDEX_TYPES, build_ann_index, index_spec  # noqa: E402
+from index_versions import resolve_index_dir  # noqa: E402
+
+
+def load_vectors(index_dir: Path) -> np.ndarray:
+    index_dir = resolve_index_dir(index_dir)
+    path = index_dir / 'vectors.bin'
+    if not path.is_file():
+        path = index_dir / 'faiss_index.bin'
+    index = faiss.read_index(str(path), faiss.IO_FLAG_ONDISK_SAME_DIR)
+    if isinstance(index, faiss.IndexIDMap2):
+        index = index.index
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def synthetic_vectors(n: int, dim: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Gaussian blobs, L2-normalised like sentence-transformer output."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    labels = rng.integers(0, clusters, size=n)
+    x = centers[labels] + 0.35 * rng.standard_normal((n, dim)).astype('float32')
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def make_queries(base: np.ndarray, n: int, seed: int = 1) -> np.ndarray:
+    """Perturbed copies of database vectors, so queries resemble real ones."""
+    rng = np.random.default_rng(seed)
+    q = base[rng.integers(0, len(base), size=n)]
+    q = q + 0.05 * rng.standard_normal(q.shape).astype('float32')
+    return np.ascontiguousarray(q / np.linalg.norm(q, axis=1, keepdims=True), dtype='float32')
+
+
+def run(vectors: np.ndarray, queries: np.ndarray, types: List[str], k: int) -> List[Dict[str, Any]]:
+    ids = np.arange(len(vectors), dtype='int64')
+    flat = build_ann_index(index_spec('flat', vectors.shape[1], len(vectors)), vectors, ids)
+    _, truth = flat.search(queries, k)
+
+    results = []
+    for index_type in types:
+        spec = index_spec(index_type, vectors.shape[1], len(vectors))
+        start = time.perf_counter()
+        index = build_ann_index(spec, vectors, ids)
+        build_s = time.perf_counter() - start
+
+        # Measure single-query latency on one thread, as the chat server sees it.
+        threads = faiss.omp_get_max_threads()
+        faiss.omp_set_num_threads(1)
+        latencies = np.empty(len(queries))
+        found = np.empty((len(queries), k), dtype='int64')
+        for i in range(len(queries)):
+            t0 = time.perf_counter()
+            _, found[i:i + 1] = index.search(queries[i:i + 1], k)
+            latencies[i] = time.perf_counter() - t0
+        faiss.omp_set_num_threads(threads)
+
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(len(queries))])
+        results.append({
+            'index_type': spec['index_type'],
+            'factory': spec['factory'],
+            'search_params': spec['search_params'],
+            'build_s': round(build_s, 3),
+            f'recall@{k}': round(float(recall), 4),
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1e3, 4),
+            'p99_ms': round(float(np.percentile(latencies, 99)) * 1e3, 4),
+        })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', type=Path, help="Take vectors from an existing index")
+    parser.add_argument('--synthetic', type=int, default=20_000, help="Synthetic vector count")
+    parser.add_argument('--dim', type=int, default=384, help="Synthetic vector dimension")
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--types', default=','.join(INDEX_TYPES))
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+
+    vectors = load_vectors(args.index_dir) if args.index_dir else \
+        synthetic_vectors(args.synthetic, args.dim)
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    queries = make_queries(vectors, args.queries)
+    results = run(vectors, queries, args.types.split(','), args.k)
+
+    print(f"{len(vectors)} vectors, dim={vectors.shape[1]}, {len(queries)} queries, k={args.k}")
+    print(f"{'type':<7} {'factory':<26} {'recall':>7} {'p50 ms':>8} {'p99 ms':>8} {'build s':>8}")
+    for r in results:
+        print(f"{r['index_type']:<7} {r['factory']:<26} {r[f'recall@{args.k}']:>7.3f} "
+              f"{r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['build_s']:>8.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
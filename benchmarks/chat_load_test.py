@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Concurrent-session load test for the chat handler.
+
+Builds a synthetic corpus with the stub embedder, starts the mock LLM with
+``--llm-slots`` generation slots (the backend's own concurrency limit) and
+drives ``GradioInterface.process`` -- the coroutine the Gradio queue runs
+for each question -- from N sessions at once on one event loop. Each
+session keeps its own history and asks ``--requests`` questions back to
+back. For every level in ``--concurrency`` it reports questions/s, latency
+and time-to-first-token percentiles, and the speed-up over one session:
+
+    python benchmarks/chat_load_test.py
+    python benchmarks/chat_load_test.py --llm-latency-ms 500 --llm-slots 16 --json chat.json
+
+Throughput should grow with the number of sessions until it reaches the
+LLM backend's limit (about ``llm_slots / reply seconds``) and stay there;
+beyond it, extra sessions only add queueing time. Gradio's own queue
+(``UI_CONCURRENCY``) is not part of the measurement.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from mock_llm import MockLLMServer  # noqa: E402
+from stub_embedder import HashEmbedder  # noqa: E402
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+
+def build_corpus_index(work: Path, args: argparse.Namespace) -> List[str]:
+    """Index a synthetic corpus into ``work/index``; return its training questions."""
+    import build_index
+    questions = generate_corpus(work / 'corpus', args.sections, seed=args.seed)
+    build_index.main(['--input-dir', str(work / 'corpus'),
+                      '--processed-dir', str(work / 'processed'),
+                      '--index-dir', str(work / 'index'), '--embed-cache-size', '0',
+                      '--parser', 'markdown-it', '--log-level', 'warning'],
+                     embedder=HashEmbedder(args.dim))
+    return questions
+
+
+def _ms(values: List[float], pct: int) -> float:
+    return round(float(np.percentile(values, pct)) * 1e3, 1)
+
+
+async def run_sessions(ui: Any, queries: List[str], sessions: int, requests: int,
+                       top_k: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    ttfts: List[float] = []
+    history_lengths: List[int] = []
+
+    async def session(sid: int) -> None:
+        history: List[Dict[str, Any]] = []
+        for i in range(requests):
+            query = queries[(sid * requests + i) % len(queries)]
+            start = time.perf_counter()
+            first = None
+            async for response, _, _, history in ui.process(query, top_k, "", history):
+                if first is None and response:
+                    first = time.perf_counter() - start
+                if response.startswith("Error"):
+                    raise RuntimeError(response)
+            latencies.append(time.perf_counter() - start)
+            ttfts.append(first if first is not None else latencies[-1])
+        history_lengths.append(len(history))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(s) for s in range(sessions)))
+    elapsed = time.perf_counter() - start
+    return {
+        'sessions': sessions,
+        'questions': len(latencies),
+        'qps': round(len(latencies) / elapsed, 2),
+        'p50_ms': _ms(latencies, 50),
+        'p95_ms': _ms(latencies, 95),
+        'ttft_p50_ms': _ms(ttfts, 50),
+        'ttft_p95_ms': _ms(ttfts, 95),
+        'max_history': max(history_lengths),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', type=int, default=1000, help="Synthetic corpus size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dim', type=int, default=384, help="Stub embedding dimension")
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                        help="Comma-separated numbers of concurrent sessions")
+    parser.add_argument('--requests', type=int, default=8, help="Questions per session")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--llm-latency-ms', type=float, default=200.0)
+    parser.add_argument('--llm-ms-per-token', type=float, default=2.0)
+    parser.add_argument('--llm-tokens', type=int, default=40)
+    parser.add_argument('--llm-slots', type=int, default=8,
+                        help="Replies the mock LLM generates at once")
+    parser.add_argument('--llm-concurrency', type=int,
+                        help="RAGSystem LLM stage limit, as LLM_CONCURRENCY (default: --llm-slots)")
+    parser.add_argument('--retrieval-concurrency', type=int, default=32,
+                        help="RAGSystem retrieval stage limit, as RETRIEVAL_CONCURRENCY")
+    parser.add_argument('--history-size', type=int, default=20, help="As CHAT_HISTORY_SIZE")
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    llm_concurrency = args.llm_concurrency or args.llm_slots
+
+    logging.getLogger().setLevel(logging.WARNING)
+    from rag_chat import (EmbeddingModel, GradioInterface, IndexStore, LocalLLMClient,
+                          RAGSystem, RetrievalService)
+    with tempfile.TemporaryDirectory(prefix='chat-load-') as tmp, \
+            MockLLMServer(latency_ms=args.llm_latency_ms, ms_per_token=args.llm_ms_per_token,
+                          tokens=args.llm_tokens, max_concurrency=args.llm_slots) as llm_server:
+        questions = build_corpus_index(Path(tmp), args)
+        rng = random.Random(args.seed)
+        queries = [rng.choice(questions) for _ in range(max(levels) * args.requests)]
+
+        store = IndexStore(Path(tmp) / 'index')
+        embed_model = EmbeddingModel('stub', model=HashEmbedder(args.dim))
+        retrieval = RetrievalService(embed_model, store)
+        llm = LocalLLMClient(llm_server.url, 'mock', pool_size=max(max(levels), llm_concurrency))
+        rag = RAGSystem(Path(tmp) / 'index', embed_model, retrieval, llm, answer_cache=None,
+                        retrieval_concurrency=args.retrieval_concurrency,
+                        llm_concurrency=llm_concurrency)
+        ui = GradioInterface(rag, history_size=args.history_size)
+
+        reply_s = (args.llm_latency_ms + args.llm_ms_per_token * args.llm_tokens) / 1e3
+        ceiling = min(args.llm_slots, llm_concurrency) / reply_s
+        results: Dict[str, Any] = {
+            'sections': args.sections, 'requests_per_session': args.requests,
+            'llm_slots': args.llm_slots, 'llm_concurrency': llm_concurrency,
+            'retrieval_concurrency': args.retrieval_concurrency,
+            'llm_reply_ms': round(reply_s * 1e3, 1), 'qps_ceiling': round(ceiling, 2),
+            'levels': [],
+        }
+
+        async def run_all() -> None:
+            await run_sessions(ui, queries, 1, 2, args.top_k)  # warm-up
+            for sessions in levels:
+                row = await run_sessions(ui, queries, sessions, args.requests, args.top_k)
+                row['speedup'] = round(row['qps'] / results['levels'][0]['qps'], 2) \
+                    if results['levels'] else 1.0
+                results['levels'].append(row)
+                print(f"{sessions:>4} sessions  {row['qps']:>7.2f} q/s ({row['speedup']:>5.2f}x)  "
+                      f"p50 {row['p50_ms']:>8.1f} ms  p95 {row['p95_ms']:>8.1f} ms  "
+                      f"ttft p50 {row['ttft_p50_ms']:>8.1f} ms")
+            await llm.aclose()
+
+        print(f"LLM reply {results['llm_reply_ms']} ms, {args.llm_slots} slots: "
+              f"ceiling about {results['qps_ceiling']} q/s")
+        asyncio.run(run_all())
+        retrieval.close()
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
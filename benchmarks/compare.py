@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Compare two run_suite.py result files.
+
+Prints every metric side by side with the relative change, matched by
+corpus size, and exits with status 1 if any metric got worse by more than
+``--threshold`` percent (throughput down, or latency / memory up):
+
+    python benchmarks/compare.py before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+# (section, metric, higher_is_better)
+METRICS: Tuple[Tuple[str, str, bool], ...] = (
+    ('build', 'docs_per_s', True),
+    ('build', 'chunks_per_s', True),
+    ('build', 'peak_rss_mb', False),
+    ('build', 'children_peak_rss_mb', False),
+    ('query', 'p50_ms', False),
+    ('query', 'p95_ms', False),
+    ('query', 'p99_ms', False),
+    ('query', 'serial_qps', True),
+    ('query', 'qps', True),
+)
+
+
+def load(path: Path) -> Dict[int, Dict[str, Any]]:
+    data = json.loads(path.read_text(encoding='utf-8'))
+    return {run['sections']: run for run in data['runs']}
+
+
+def compare(base: Dict[int, Dict[str, Any]], new: Dict[int, Dict[str, Any]],
+            threshold: float) -> List[Dict[str, Any]]:
+    rows = []
+    for size in sorted(base.keys() & new.keys()):
+        for section, metric, higher_is_better in METRICS:
+            old = base[size].get(section, {}).get(metric)
+            cur = new[size].get(section, {}).get(metric)
+            if old is None or cur is None:
+                continue
+            change = (cur - old) / old * 100 if old else 0.0
+            worse = -change if higher_is_better else change
+            rows.append({'sections': size, 'metric': f'{section}.{metric}', 'before': old,
+                         'after': cur, 'change_pct': round(change, 1),
+                         'regression': worse > threshold})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('before', type=Path)
+    parser.add_argument('after', type=Path)
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="Percent change that counts as a regression")
+    args = parser.parse_args()
+
+    base, new = load(args.before), load(args.after)
+    missing = sorted(base.keys() ^ new.keys())
+    if missing:
+        print(f"Sizes only in one file (skipped): {missing}")
+    rows = compare(base, new, args.threshold)
+    print(f"{'sections':>9} {'metric':<28} {'before':>10} {'after':>10} {'change':>8}")
+    for r in rows:
+        flag = '  REGRESSION' if r['regression'] else ''
+        print(f"{r['sections']:>9} {r['metric']:<28} {r['before']:>10} {r['after']:>10} "
+              f"{r['change_pct']:>+7.1f}%{flag}")
+    regressions = sum(r['regression'] for r in rows)
+    if regressions:
+        print(f"{regressions} regression(s) above {args.threshold:g}%")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
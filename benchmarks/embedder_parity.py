@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Parity and speed of the ONNX embedding backends against PyTorch.
+
+Chunks a corpus the way build_index.py does (``output/*.md`` by default,
+plus an optional synthetic corpus), embeds the chunks with the
+SentenceTransformer reference and with each ONNX variant (``onnx``: fp32,
+``onnx-int8``: dynamically quantized weights), and reports per variant the
+cosine similarity to the reference vectors (min, p1, mean), how many of
+each chunk's top-k neighbours stay the same, and texts/s:
+
+    python benchmarks/embedder_parity.py
+    python benchmarks/embedder_parity.py --synthetic 2000 --variants onnx-int8 --json parity.json
+
+Exits with status 1 if a variant's minimum cosine similarity falls below
+``--min-cosine`` (fp32) or ``--min-cosine-int8``.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from build_index import ChunkExtractor, MarkdownFilterRunner  # noqa: E402
+from embedders import DEFAULT_MODEL, DEFAULT_ONNX_DIR, load_embedder  # noqa: E402
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+VARIANTS = ('onnx', 'onnx-int8')
+
+
+def corpus_texts(files: List[Path], model: str, limit: int) -> List[str]:
+    """Chunk texts of ``files`` as build_index.py's defaults produce them."""
+    runner = MarkdownFilterRunner(ROOT / 'md2jsonld.py', parser='markdown-it')
+    extractor = ChunkExtractor(max_tokens=256, overlap=32, tokenizer=model)
+    texts: List[str] = []
+    for md in files:
+        texts.extend(c['text'] for c in extractor.extract(runner.convert(md)))
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def timed_encode(embedder: Any, texts: List[str]) -> Dict[str, Any]:
+    embedder.encode(texts[:8], convert_to_numpy=True)  # warm-up
+    start = time.perf_counter()
+    vectors = np.asarray(embedder.encode(texts, convert_to_numpy=True), dtype='float32')
+    secs = time.perf_counter() - start
+    return {'vectors': vectors, 'seconds': round(secs, 3),
+            'texts_per_s': round(len(texts) / secs, 1) if secs else None}
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, queries: int, k: int) -> float:
+    """Mean fraction of each query chunk's top-k neighbours both vector sets agree on."""
+    def top_k(vectors: np.ndarray) -> np.ndarray:
+        sims = vectors[:queries] @ vectors.T
+        np.fill_diagonal(sims, -np.inf)  # a chunk is not its own neighbour
+        return np.argsort(-sims, axis=1)[:, :k]
+    ref, cand = top_k(_unit(reference)), top_k(_unit(candidate))
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref, cand)]))
+
+
+def compare(reference: np.ndarray, candidate: np.ndarray, queries: int, k: int) -> Dict[str, Any]:
+    cosine = np.sum(_unit(reference) * _unit(candidate), axis=1)
+    return {
+        'cosine_min': round(float(cosine.min()), 6),
+        'cosine_p1': round(float(np.percentile(cosine, 1)), 6),
+        'cosine_mean': round(float(cosine.mean()), 6),
+        'max_abs_diff': round(float(np.abs(reference - candidate).max()), 6),
+        f'top{k}_overlap': round(neighbour_overlap(reference, candidate, queries, k), 4),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', type=Path,
+                        help="Markdown files to chunk (default: output/*.md)")
+    parser.add_argument('--synthetic', type=int, default=0, metavar='SECTIONS',
+                        help="Also chunk a synthetic corpus of this many sections")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=2000, help="Maximum chunks to embed")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--variants', default=','.join(VARIANTS),
+                        help=f"Comma-separated ONNX variants to check ({', '.join(VARIANTS)})")
+    parser.add_argument('--threads', type=int, default=os.cpu_count(),
+                        help="CPU threads for every backend")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--onnx-dir', type=Path, default=DEFAULT_ONNX_DIR)
+    parser.add_argument('--queries', type=int, default=200,
+                        help="Chunks whose nearest neighbours are compared")
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--min-cosine', type=float, default=0.999,
+                        help="Lowest acceptable cosine similarity for fp32 ONNX")
+    parser.add_argument('--min-cosine-int8', type=float, default=0.97,
+                        help="Lowest acceptable cosine similarity for int8 ONNX")
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    unknown = set(variants) - set(VARIANTS)
+    if unknown:
+        parser.error(f"unknown variants: {', '.join(sorted(unknown))}")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    files = args.files or sorted((ROOT / 'output').glob('*.md'))
+    with tempfile.TemporaryDirectory(prefix='embedder-parity-') as tmp:
+        if args.synthetic:
+            generate_corpus(Path(tmp), args.synthetic, seed=args.seed)
+            files += sorted(Path(tmp).glob('*.md'))
+        texts = corpus_texts(files, args.model, args.limit)
+    if len(texts) <= args.top_k:
+        parser.error(f"only {len(texts)} chunks; need more than --top-k")
+    queries = min(args.queries, len(texts))
+    print(f"{len(texts)} chunks, {args.threads} threads")
+
+    reference = timed_encode(load_embedder(args.model, 'torch', threads=args.threads), texts)
+    results: Dict[str, Any] = {
+        'chunks': len(texts), 'threads': args.threads, 'batch_size': args.batch_size,
+        'torch': {k: v for k, v in reference.items() if k != 'vectors'}, 'variants': {},
+    }
+    print(f"{'torch':<10} {reference['texts_per_s']:>9} texts/s")
+    failed = []
+    for variant in variants:
+        quantize = variant.endswith('-int8')
+        embedder = load_embedder(args.model, 'onnx', quantize=quantize, threads=args.threads,
+                                 batch_size=args.batch_size, cache_dir=args.onnx_dir)
+        run = timed_encode(embedder, texts)
+        row = {k: v for k, v in run.items() if k != 'vectors'}
+        row.update(compare(reference['vectors'], run['vectors'], queries, args.top_k))
+        row['speedup'] = round(reference['seconds'] / run['seconds'], 2) if run['seconds'] else None
+        bound = args.min_cosine_int8 if quantize else args.min_cosine
+        row['passed'] = row['cosine_min'] >= bound
+        results['variants'][variant] = row
+        print(f"{variant:<10} {row['texts_per_s']:>9} texts/s ({row['speedup']}x)  "
+              f"cosine min {row['cosine_min']:.6f} p1 {row['cosine_p1']:.6f} "
+              f"mean {row['cosine_mean']:.6f}  top{args.top_k} overlap "
+              f"{row[f'top{args.top_k}_overlap']:.3f}{'' if row['passed'] else f'  BELOW {bound}'}")
+        if not row['passed']:
+            failed.append(variant)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
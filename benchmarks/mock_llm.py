@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Mock OpenAI-compatible chat completion server for benchmarks.
+
+Serves ``POST /v1/chat/completions`` (plain JSON, or server-sent events with
+``"stream": true``) and ``GET /v1/models``. The reply is a fixed number of
+words from the prompt, produced after ``--latency-ms`` plus
+``--ms-per-token`` per word, so LLM cost can be modelled or switched off.
+``--max-concurrency`` makes it generate at most that many replies at once
+(later requests wait), like a backend with a fixed number of slots.
+Point ``LOCAL_LLM_URL`` at it to run the chat server without a model:
+
+    python benchmarks/mock_llm.py --port 8099 --latency-ms 200
+    LOCAL_LLM_URL=http://127.0.0.1:8099/v1 python3 rag_chat.py
+"""
+import argparse
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class MockLLMServer:
+    """Threaded mock server; use as a context manager or call start()/stop()."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency_ms: float = 0.0,
+                 ms_per_token: float = 0.0, tokens: int = 40, max_concurrency: int = 0):
+        self.latency = latency_ms / 1000.0
+        self.per_token = ms_per_token / 1000.0
+        self.tokens = tokens
+        self.max_concurrency = max_concurrency
+        self.requests = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='mock-llm',
+                                        daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self) -> 'MockLLMServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'MockLLMServer':
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def reply(self, messages: List[Dict[str, str]]) -> List[str]:
+        """The reply's words: the start of the last message, padded to ``tokens``."""
+        words = (messages[-1].get('content', '') if messages else '').split() or ['ok']
+        return [words[i % len(words)] for i in range(self.tokens)]
+
+    def slot(self) -> Any:
+        """Held while a reply is generated; blocks at ``max_concurrency``."""
+        return self._slots if self._slots is not None else contextlib.nullcontext()
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True  # headers and body are separate writes
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path.rstrip('/').endswith('/models'):
+                    self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model'}]})
+                else:
+                    self._send_json(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self) -> None:
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                with server._lock:
+                    server.requests += 1
+                words = server.reply(body.get('messages', []))
+                with server.slot():
+                    self._generate(body, words)
+
+            def _generate(self, body: Dict[str, Any], words: List[str]) -> None:
+                time.sleep(server.latency)
+                if body.get('stream'):
+                    self._stream(body, words)
+                    return
+                time.sleep(server.per_token * len(words))
+                self._send_json(200, {
+                    'id': 'chatcmpl-mock', 'object': 'chat.completion',
+                    'model': body.get('model', 'mock'),
+                    'choices': [{'index': 0, 'finish_reason': 'stop',
+                                 'message': {'role': 'assistant', 'content': ' '.join(words)}}],
+                    'usage': {'completion_tokens': len(words)},
+                })
+
+            def _stream(self, body: Dict[str, Any], words: List[str]) -> None:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for i, word in enumerate(words):
+                    time.sleep(server.per_token)
+                    chunk = {'id': 'chatcmpl-mock', 'object': 'chat.completion.chunk',
+                             'model': body.get('model', 'mock'),
+                             'choices': [{'index': 0, 'delta': {'content': (' ' if i else '') + word}}]}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="Delay before the first token")
+    parser.add_argument('--ms-per-token', type=float, default=0.0)
+    parser.add_argument('--tokens', type=int, default=40, help="Words per reply")
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help="Replies generated at once (0: unlimited)")
+    args = parser.parse_args()
+    server = MockLLMServer(args.host, args.port, args.latency_ms, args.ms_per_token, args.tokens,
+                           args.max_concurrency)
+    print(f"Mock LLM listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Conformance and speed check of the markdown-it fast path against pandoc.
+
+Converts every file with ``md2jsonld_fast`` (``build_index.py --parser
+markdown-it``) and with pandoc plus the md2jsonld filter (the default), and
+compares the JSON-LD. Each file is reported as a match, a mismatch (with
+the first differing field) or unsupported: the fast path declined it, so
+a build falls back to pandoc for that file. Both paths are timed per file:
+
+    python benchmarks/parser_conformance.py output/*.md
+    python benchmarks/parser_conformance.py --synthetic 2000 --json parsers.json
+
+Exits with status 1 if any file converts differently.
+"""
+import argparse
+import json
+import logging
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from build_index import MarkdownFilterRunner  # noqa: E402
+import md2jsonld_fast  # noqa: E402
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def first_difference(expected: Any, actual: Any, path: str = '') -> Optional[str]:
+    """Path and values of the first place two JSON values differ, or None."""
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in list(expected) + [k for k in actual if k not in expected]:
+            diff = first_difference(expected.get(key), actual.get(key), f'{path}.{key}')
+            if diff:
+                return diff
+        return None
+    if isinstance(expected, list) and isinstance(actual, list):
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            diff = first_difference(a, b, f'{path}[{i}]')
+            if diff:
+                return diff
+        if len(expected) != len(actual):
+            return f'{path}: {len(expected)} items, got {len(actual)}'
+        return None
+    if expected != actual:
+        return f'{path}: expected {str(expected)[:80]!r}, got {str(actual)[:80]!r}'
+    return None
+
+
+def _median_seconds(fn: Callable[[], Any], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def check_file(runner: MarkdownFilterRunner, md: Path, repeat: int) -> Dict[str, Any]:
+    text = md.read_text(encoding='utf-8')
+    expected = runner.convert(md)
+    pandoc_s = _median_seconds(lambda: runner.convert(md), repeat)
+    result: Dict[str, Any] = {'file': md.name, 'bytes': len(text.encode('utf-8')),
+                              'pandoc_ms': round(pandoc_s * 1e3, 2)}
+    try:
+        actual = md2jsonld_fast.convert(text, md.name)
+    except md2jsonld_fast.UnsupportedMarkdown as e:
+        result.update(status='unsupported', reason=str(e))
+        return result
+    diff = first_difference(expected, actual)
+    # Timed like the build: read the file, then convert
+    fast_s = _median_seconds(lambda: md2jsonld_fast.convert(md.read_text(encoding='utf-8'),
+                                                            md.name), repeat)
+    result.update(status='mismatch' if diff else 'match', difference=diff,
+                  fast_ms=round(fast_s * 1e3, 2))
+    return result
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    converted = [r for r in results if 'fast_ms' in r]
+    pandoc_ms = sum(r['pandoc_ms'] for r in converted)
+    fast_ms = sum(r['fast_ms'] for r in converted)
+    mb = sum(r['bytes'] for r in converted) / 1e6
+    return {
+        'files': len(results),
+        **{status: sum(r['status'] == status for r in results)
+           for status in ('match', 'mismatch', 'unsupported')},
+        'pandoc_ms': round(pandoc_ms, 1),
+        'fast_ms': round(fast_ms, 1),
+        'pandoc_mb_per_s': round(mb / (pandoc_ms / 1e3), 2) if pandoc_ms else None,
+        'fast_mb_per_s': round(mb / (fast_ms / 1e3), 2) if fast_ms else None,
+        'speedup': round(pandoc_ms / fast_ms, 1) if fast_ms else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', type=Path,
+                        help="Markdown files to check (default: output/*.md)")
+    parser.add_argument('--synthetic', type=int, default=0, metavar='SECTIONS',
+                        help="Also check a synthetic corpus of this many sections")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="Timed conversions per file and parser (median is reported)")
+    parser.add_argument('--json', type=Path, help="Also write per-file results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    files = args.files or sorted((ROOT / 'output').glob('*.md'))
+    with tempfile.TemporaryDirectory(prefix='parser-conformance-') as tmp:
+        if args.synthetic:
+            generate_corpus(Path(tmp), args.synthetic, seed=args.seed)
+            files += sorted(Path(tmp).glob('*.md'))
+        runner = MarkdownFilterRunner(ROOT / 'md2jsonld.py')
+        results = []
+        for md in files:
+            result = check_file(runner, md, args.repeat)
+            results.append(result)
+            if result['status'] == 'mismatch':
+                print(f"MISMATCH     {md}: {result['difference']}")
+            elif result['status'] == 'unsupported':
+                print(f"unsupported  {md}: {result['reason']}")
+
+    summary = summarize(results)
+    print(f"{summary['files']} files: {summary['match']} match, {summary['mismatch']} mismatch, "
+          f"{summary['unsupported']} unsupported (pandoc fallback)")
+    if summary['speedup']:
+        print(f"pandoc      {summary['pandoc_ms']:>10.1f} ms  {summary['pandoc_mb_per_s']:>7.2f} MB/s")
+        print(f"markdown-it {summary['fast_ms']:>10.1f} ms  {summary['fast_mb_per_s']:>7.2f} MB/s  "
+              f"({summary['speedup']}x)")
+    if args.json:
+        args.json.write_text(json.dumps({'summary': summary, 'files': results}, indent=2),
+                             encoding='utf-8')
+    if summary['mismatch']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Answer-quality / latency trade-off of cross-encoder re-ranking.
+
+Every ``trainingQuestions`` entry in the processed JSON-LD files is used as
+a query whose relevant chunks are the sections of its own document. For
+each final context size k the benchmark reports, with and without
+re-ranking ``--candidates`` retrieved chunks:
+
+  hit@k       share of questions with a relevant chunk in the context
+  mrr         mean reciprocal rank of the first relevant chunk (within k)
+  ctx_tokens  mean context size in (whitespace) tokens, a proxy for LLM cost
+  p50/p99 ms  retrieval (+ re-ranking) latency per question
+
+Re-ranking is measured cold and again warm, when the score cache already
+holds every (question, chunk) pair.
+
+    python benchmarks/rerank_benchmark.py --index-dir index --processed-dir processed
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rag_chat import (  # noqa: E402
+    CrossEncoderReranker, EmbeddingModel, IndexStore, RetrievalService
+)
+
+
+def training_questions(processed_dir: Path) -> List[Tuple[str, str]]:
+    """``(question, doc_id)`` pairs from the Document nodes of ``*.jsonld``."""
+    pairs = []
+    for path in sorted(processed_dir.glob('*.jsonld')):
+        graph = json.loads(path.read_text(encoding='utf-8')).get('@graph', [])
+        doc = next((n for n in graph if n.get('@type') == 'Document'), {})
+        for q in doc.get('trainingQuestions') or []:
+            pairs.append((q, doc.get('@id', '')))
+    return pairs
+
+
+def score(runs: List[Tuple[List[Dict[str, Any]], str, float]], k: int) -> Dict[str, float]:
+    hits, rr, tokens = [], [], []
+    for chunks, doc_id, _ in runs:
+        top = chunks[:k]
+        first = next((i for i, c in enumerate(top, start=1) if c.get('doc_id') == doc_id), None)
+        hits.append(first is not None)
+        rr.append(1.0 / first if first else 0.0)
+        tokens.append(sum(len(c['text'].split()) for c in top))
+    lat = np.array([t for _, _, t in runs]) * 1e3
+    return {
+        f'hit@{k}': round(float(np.mean(hits)), 3),
+        'mrr': round(float(np.mean(rr)), 3),
+        'ctx_tokens': round(float(np.mean(tokens)), 1),
+        'p50_ms': round(float(np.percentile(lat, 50)), 2),
+        'p99_ms': round(float(np.percentile(lat, 99)), 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', type=Path, default=Path('index'))
+    parser.add_argument('--processed-dir', type=Path, default=Path('processed'))
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--rerank-model', default='cross-encoder/ms-marco-MiniLM-L-6-v2')
+    parser.add_argument('--mode', choices=('dense', 'sparse', 'hybrid'))
+    parser.add_argument('--candidates', type=int, default=20)
+    parser.add_argument('--ks', default='1,2,3,5')
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+
+    questions = training_questions(args.processed_dir)
+    if not questions:
+        sys.exit(f"No trainingQuestions found in {args.processed_dir}/*.jsonld")
+    ks = [int(k) for k in args.ks.split(',')]
+    retrieval = RetrievalService(EmbeddingModel(args.model), IndexStore(args.index_dir),
+                                 mode=args.mode)
+    reranker = CrossEncoderReranker(args.rerank_model)
+    retrieval.retrieve(questions[0][0], 1)
+    reranker.rerank('warm-up', [{'id': -1, 'text': 'warm-up'}], 1)  # load weights up front
+
+    def timed(fn) -> Tuple[List[Dict[str, Any]], float]:
+        t0 = time.perf_counter()
+        out = fn()
+        return out, time.perf_counter() - t0
+
+    runs: Dict[str, List[Tuple[List[Dict[str, Any]], str, float]]] = {
+        'retrieval': [], 'rerank_cold': [], 'rerank_warm': []}
+    for q, doc_id in questions:
+        chunks, t = timed(lambda: retrieval.retrieve(q, max(ks)))
+        runs['retrieval'].append((chunks, doc_id, t))
+    for label in ('rerank_cold', 'rerank_warm'):
+        for q, doc_id in questions:
+            chunks, t = timed(lambda: reranker.rerank(
+                q, retrieval.retrieve(q, max(args.candidates, max(ks))), max(ks)))
+            runs[label].append((chunks, doc_id, t))
+
+    results = {label: {str(k): score(r, k) for k in ks} for label, r in runs.items()}
+    results['questions'] = len(questions)
+    results['candidates'] = args.candidates
+
+    print(f"{len(questions)} questions, {args.candidates} re-rank candidates")
+    print(f"{'config':<12} {'k':>2} {'hit@k':>6} {'mrr':>6} {'ctx tok':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for label in runs:
+        for k in ks:
+            r = results[label][str(k)]
+            print(f"{label:<12} {k:>2} {r[f'hit@{k}']:>6.3f} {r['mrr']:>6.3f} "
+                  f"{r['ctx_tokens']:>8.1f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Concurrent-user load test for RetrievalService micro-batching.
+
+Simulates ``--users`` threads that each issue ``--requests`` retrievals back
+to back (embedding + search, as the chat server does per question) and
+reports throughput and latency with micro-batching off and on. The offline
+``retrieve_batch`` path is measured too. Queries are the section titles of
+the index unless ``--queries`` names a file with one query per line.
+
+Both modes are also run with a metadata filter (``--filter``, default: the
+most common category), and every concurrent filtered result is checked
+against the same query run alone; the script exits with status 1 if any
+differ.
+
+    python benchmarks/retrieval_load_test.py --index-dir index --users 50
+    python benchmarks/retrieval_load_test.py --filter category=security
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from rag_chat import EmbeddingModel, IndexStore, RetrievalService  # noqa: E402
+
+
+def _hit_ids(hits: List[Dict[str, Any]]) -> List[Any]:
+    return [h.get('id') for h in hits]
+
+
+def run_users(service: RetrievalService, queries: List[str], users: int,
+              requests: int, top_k: int,
+              filters: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    latencies: List[float] = []
+    answers: Dict[str, List[List[Any]]] = {}
+    lock = threading.Lock()
+    barrier = threading.Barrier(users + 1)
+
+    def user(uid: int) -> None:
+        local = []
+        seen = []
+        barrier.wait()
+        for i in range(requests):
+            q = queries[(uid * requests + i) % len(queries)]
+            t0 = time.perf_counter()
+            hits = service.retrieve(q, top_k, filters=filters)
+            local.append(time.perf_counter() - t0)
+            seen.append((q, _hit_ids(hits)))
+        with lock:
+            latencies.extend(local)
+            for q, ids in seen:
+                answers.setdefault(q, []).append(ids)
+
+    threads = [threading.Thread(target=user, args=(u,)) for u in range(users)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    lat = np.array(latencies)
+    result = {
+        'qps': round(len(lat) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(lat, 50)) * 1e3, 2),
+        'p99_ms': round(float(np.percentile(lat, 99)) * 1e3, 2),
+        'batching': service.batch_stats(),
+    }
+    if filters:
+        # Concurrent filtered searches must return what the query returns alone
+        expected = {q: _hit_ids(service.retrieve(q, top_k, filters=filters)) for q in answers}
+        result['mismatches'] = sum(ids != expected[q] for q, runs in answers.items()
+                                   for ids in runs)
+    return result
+
+
+def default_filter(store: IndexStore) -> Optional[Dict[str, Any]]:
+    """The most common category, as a filter."""
+    counts = Counter(m.get('category') for m in store.metadata)
+    counts.pop(None, None)
+    counts.pop('', None)
+    return {'category': counts.most_common(1)[0][0]} if counts else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', type=Path, default=Path('index'))
+    parser.add_argument('--model', default='all-MiniLM-L6-v2')
+    parser.add_argument('--mode', choices=('dense', 'sparse', 'hybrid'))
+    parser.add_argument('--queries', type=Path, help="File with one query per line")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20, help="Requests per user")
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--wait-ms', type=float, default=2.0)
+    parser.add_argument('--filter', metavar='FIELD=VALUE',
+                        help="Filter for the filtered runs (default: most common category)")
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+    if args.filter and '=' not in args.filter:
+        parser.error("--filter must be FIELD=VALUE")
+
+    store = IndexStore(args.index_dir)
+    embed_model = EmbeddingModel(args.model)
+    if args.queries:
+        queries = [q for q in args.queries.read_text(encoding='utf-8').splitlines() if q.strip()]
+    else:
+        queries = sorted({m.get('section_title', '') for m in store.metadata} - {''})
+    embed_model.encode(queries[:1])  # load weights outside the measurement
+
+    filters = dict([args.filter.split('=', 1)]) if args.filter else default_filter(store)
+    results: Dict[str, Any] = {'users': args.users, 'requests_per_user': args.requests,
+                               'top_k': args.top_k, 'filter': filters}
+    for label, batch_size in (('unbatched', 0), ('micro_batched', args.batch_size)):
+        service = RetrievalService(embed_model, store, mode=args.mode,
+                                   batch_size=batch_size, batch_wait_ms=args.wait_ms)
+        results[label] = run_users(service, queries, args.users, args.requests, args.top_k)
+        if filters:
+            results[f'{label}_filtered'] = run_users(service, queries, args.users,
+                                                     args.requests, args.top_k, filters)
+        service.close()
+
+    service = RetrievalService(embed_model, store, mode=args.mode)
+    total = args.users * args.requests
+    batch = [queries[i % len(queries)] for i in range(total)]
+    start = time.perf_counter()
+    for i in range(0, total, args.batch_size):
+        service.retrieve_batch(batch[i:i + args.batch_size], args.top_k)
+    results['retrieve_batch'] = {'qps': round(total / (time.perf_counter() - start), 1)}
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+    if any(r.get('mismatches') for r in results.values() if isinstance(r, dict)):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
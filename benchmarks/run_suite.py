@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Reproducible end-to-end build and query benchmark.
+
+For each corpus size a synthetic corpus (synthetic_corpus.py) is indexed
+through ``build_index.main`` with the deterministic HashEmbedder
+(stub_embedder.py), then queried through ``RAGSystem.generate_response``
+against the mock LLM server (mock_llm.py). Nothing is downloaded, so runs
+on the same machine are comparable across commits:
+
+    python benchmarks/run_suite.py --sizes 10,1000,10000 --json before.json
+    git checkout my-branch
+    python benchmarks/run_suite.py --sizes 10,1000,10000 --json after.json
+    python benchmarks/compare.py before.json after.json
+
+Build numbers (docs/s, chunks/s, peak RSS) come from a fresh child process
+per size; peak RSS is reported for that process and, separately, for its
+largest subprocess (pandoc, ``--workers`` processes). Query numbers are
+serial latency percentiles and the throughput of ``--concurrency`` threads.
+The stub embedder makes model cost negligible: the numbers cover parsing,
+chunking, indexing, retrieval and prompt assembly, not the embedding model.
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from mock_llm import MockLLMServer  # noqa: E402
+from stub_embedder import HashEmbedder  # noqa: E402
+from synthetic_corpus import generate_corpus  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+RESULTS_VERSION = 1
+
+
+def _rss_mb(ru_maxrss: int) -> float:
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    return round(ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _build_child(argv: List[str], dim: int, out: Any) -> None:
+    import build_index
+    start = time.perf_counter()
+    try:
+        build_index.main(argv, embedder=HashEmbedder(dim))
+        error = None
+    except Exception as e:  # reported to the parent instead of a bare exit code
+        error = f'{type(e).__name__}: {e}'
+    out.put({
+        'seconds': time.perf_counter() - start,
+        'error': error,
+        'peak_rss_mb': _rss_mb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss),
+        'children_peak_rss_mb': _rss_mb(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss),
+    })
+
+
+def bench_build(corpus: Path, work: Path, args: argparse.Namespace) -> Dict[str, Any]:
+    """Index ``corpus`` into ``work/index`` in a fresh process."""
+    from index_versions import resolve_index_dir
+    index_dir = work / 'index'
+    argv = ['--input-dir', str(corpus), '--processed-dir', str(work / 'processed'),
+            '--index-dir', str(index_dir), '--embed-cache-size', '0',
+            '--workers', str(args.workers), '--index-type', args.index_type,
+            '--log-level', 'warning'] + args.build_arg
+    ctx = mp.get_context('spawn')
+    out = ctx.Queue()
+    proc = ctx.Process(target=_build_child, args=(argv, args.dim, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    if result['error'] or proc.exitcode:
+        raise RuntimeError(f"Build failed: {result['error'] or f'exit code {proc.exitcode}'}")
+    info = json.loads((resolve_index_dir(index_dir) / 'info.json').read_text(encoding='utf-8'))
+    docs = len(list(corpus.glob('*.md')))
+    secs = result['seconds']
+    return {
+        'documents': docs,
+        'chunks': info['chunks'],
+        'seconds': round(secs, 3),
+        'docs_per_s': round(docs / secs, 2),
+        'chunks_per_s': round(info['chunks'] / secs, 1),
+        'peak_rss_mb': result['peak_rss_mb'],
+        'children_peak_rss_mb': result['children_peak_rss_mb'],
+    }
+
+
+def _percentiles(latencies: List[float]) -> Dict[str, float]:
+    lat = np.array(latencies) * 1e3
+    return {f'p{p}_ms': round(float(np.percentile(lat, p)), 2) for p in (50, 95, 99)}
+
+
+def bench_query(index_dir: Path, queries: List[str], llm_url: str,
+                args: argparse.Namespace) -> Dict[str, Any]:
+    """Serial latency and concurrent throughput of ``generate_response``."""
+    from rag_chat import EmbeddingModel, IndexStore, LocalLLMClient, RAGSystem, RetrievalService
+    store = IndexStore(index_dir)
+    embed_model = EmbeddingModel('stub', model=HashEmbedder(args.dim))
+    retrieval = RetrievalService(embed_model, store, mode=args.mode, batch_size=args.batch_size)
+    llm = LocalLLMClient(llm_url, 'mock', pool_size=max(10, args.concurrency))
+    rag = RAGSystem(index_dir, embed_model, retrieval, llm, answer_cache=None)
+    try:
+        for q in queries[:args.warmup]:
+            rag.generate_response(q, args.top_k)
+
+        serial = []
+        for q in queries:
+            t0 = time.perf_counter()
+            rag.generate_response(q, args.top_k)
+            serial.append(time.perf_counter() - t0)
+
+        # Each thread takes every ``concurrency``-th query, all starting together
+        barrier = threading.Barrier(args.concurrency + 1)
+        errors: List[BaseException] = []
+
+        def user(uid: int) -> None:
+            barrier.wait()
+            try:
+                for q in queries[uid::args.concurrency]:
+                    rag.generate_response(q, args.top_k)
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=user, args=(u,)) for u in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        barrier.wait()
+        start = time.perf_counter()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise RuntimeError(f"Concurrent queries failed: {errors[0]!r}")
+    finally:
+        retrieval.close()
+    return {
+        'queries': len(queries),
+        'mode': retrieval.mode,
+        **_percentiles(serial),
+        'serial_qps': round(len(serial) / sum(serial), 1),
+        'concurrency': args.concurrency,
+        'qps': round(len(queries) / elapsed, 1),
+    }
+
+
+def run_meta(args: argparse.Namespace) -> Dict[str, Any]:
+    def git(*cmd: str) -> str:
+        try:
+            return subprocess.run(['git', *cmd], cwd=ROOT, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return ''
+    import faiss
+    return {
+        'results_version': RESULTS_VERSION,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': git('rev-parse', 'HEAD'),
+        'git_dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'faiss': getattr(faiss, '__version__', ''),
+        'args': {k: (str(v) if isinstance(v, Path) else v) for k, v in vars(args).items()},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000,10000',
+                        help="Comma-separated corpus sizes in sections (10 to 100000)")
+    parser.add_argument('--sections-per-doc', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dim', type=int, default=384, help="Stub embedding dimension")
+    parser.add_argument('--workers', type=int, default=1, help="build_index.py --workers")
+    parser.add_argument('--index-type', default='flat', help="build_index.py --index-type")
+    parser.add_argument('--build-arg', action='append', default=[],
+                        help="Extra build_index.py argument (repeatable), e.g. --build-arg=--two-pass")
+    parser.add_argument('--queries', type=int, default=200, help="Queries per size")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--mode', choices=('dense', 'sparse', 'hybrid'))
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help="Retrieval micro-batch size, as RETRIEVAL_BATCH_SIZE")
+    parser.add_argument('--llm-latency-ms', type=float, default=0.0)
+    parser.add_argument('--llm-ms-per-token', type=float, default=0.0)
+    parser.add_argument('--skip-query', action='store_true', help="Only measure the build")
+    parser.add_argument('--work-dir', type=Path,
+                        help="Keep corpora and indexes here instead of a temporary directory")
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results: Dict[str, Any] = {'meta': run_meta(args), 'runs': []}
+    work_root = args.work_dir or Path(tempfile.mkdtemp(prefix='rag-bench-'))
+    llm = MockLLMServer(latency_ms=args.llm_latency_ms, ms_per_token=args.llm_ms_per_token)
+    with llm:
+        for size in sizes:
+            work = work_root / f'sections-{size}'
+            shutil.rmtree(work, ignore_errors=True)
+            corpus = work / 'corpus'
+            questions = generate_corpus(corpus, size, args.sections_per_doc, args.seed)
+            run: Dict[str, Any] = {'sections': size}
+            print(f"[{size} sections] building ...", file=sys.stderr)
+            run['build'] = bench_build(corpus, work, args)
+            if not args.skip_query:
+                print(f"[{size} sections] querying ...", file=sys.stderr)
+                rng = random.Random(args.seed)
+                queries = [rng.choice(questions) for _ in range(args.queries)]
+                run['query'] = bench_query(work / 'index', queries, llm.url, args)
+            results['runs'].append(run)
+    if not args.work_dir:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2), encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Query latency benchmark for the BM25 sparse index.
+
+Uses the ``sparse/`` postings of an existing index directory, or builds them
+for a synthetic corpus of network-flavoured chunks first:
+
+    python benchmarks/sparse_benchmark.py --index-dir index
+    python benchmarks/sparse_benchmark.py --synthetic 50000
+"""
+import argparse
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from index_versions import resolve_index_dir  # noqa: E402
+from sparse_index import SparseIndex, tokenize, write_sparse_index  # noqa: E402
+
+WORDS = ('interface protocol evpn vxlan bgp ospf isis route policy neighbor session '
+         'gnmi telemetry subscription junos config commit rollback vlan trunk access '
+         'security zone firewall filter term prefix-list community export import vrf '
+         'type-5 type-2 multihoming esi lacp mtu underlay overlay spine leaf fabric').split()
+
+
+def synthetic_rows(n: int, vocab_size: int = 20_000, seed: int = 0):
+    """Chunks whose words follow a Zipf distribution, as natural text does."""
+    rng = np.random.default_rng(seed)
+    vocab = np.array(WORDS + [f'w{i}' for i in range(vocab_size - len(WORDS))])
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    rows = []
+    for i in range(n):
+        words = list(rng.choice(vocab, size=60, p=weights))
+        words += [f'xe-{rng.integers(0, 8)}/0/{rng.integers(0, 48)}',
+                  f'vni {rng.integers(1000, 20000)}', f'RFC {rng.integers(1000, 9000)}']
+        rows.append({'id': i, 'section_title': f'Section {i}', 'text': ' '.join(words)})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--index-dir', type=Path, help="Use an existing index's sparse/ postings")
+    parser.add_argument('--synthetic', type=int, default=50_000, help="Synthetic chunk count")
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--json', type=Path, help="Also write results to this file")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.index_dir:
+        index_dir = resolve_index_dir(args.index_dir)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        index_dir = Path(tmp.name)
+        start = time.perf_counter()
+        write_sparse_index(index_dir, synthetic_rows(args.synthetic))
+        print(f"built {args.synthetic} chunks in {time.perf_counter() - start:.2f}s")
+    index = SparseIndex(index_dir)
+
+    rng = np.random.default_rng(1)
+    terms = list(index.vocab)
+    queries = [' '.join(rng.choice(terms, size=rng.integers(2, 7))) for _ in range(args.queries)]
+    latencies = np.empty(len(queries))
+    for i, q in enumerate(queries):
+        t0 = time.perf_counter()
+        index.search(q, args.k)
+        latencies[i] = time.perf_counter() - t0
+
+    result = {
+        'chunks': len(index),
+        'terms': len(index.vocab),
+        'postings': int(index.meta['postings']),
+        'queries': len(queries),
+        'k': args.k,
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1e3, 4),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1e3, 4),
+        'mean_query_terms': round(float(np.mean([len(set(tokenize(q))) for q in queries])), 2),
+    }
+    print(json.dumps(result, indent=2))
+    if args.json:
+        args.json.write_text(json.dumps(result, indent=2), encoding='utf-8')
+    if tmp is not None:
+        tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Deterministic, offline stand-in for a SentenceTransformer.
+
+Texts are embedded by feature hashing: every lower-cased word adds +-1 to
+one of ``dim`` coordinates (chosen by CRC32, which unlike ``hash()`` is
+stable across processes) and the vector is L2-normalised. Texts that share
+words end up close, so retrieval results are meaningful, and the output is
+identical on every machine. It costs far less than a real model, so build
+numbers measured with it isolate parsing, chunking and indexing.
+"""
+import re
+import zlib
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r'\w+')
+
+
+class HashEmbedder:
+    """Implements the ``encode``/``get_sentence_embedding_dimension`` subset
+    of the SentenceTransformer API used by build_index.py and rag_chat.py."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f'stub-hash-{dim}'
+        self._slots: Dict[str, Tuple[int, float]] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _slot(self, word: str) -> Tuple[int, float]:
+        slot = self._slots.get(word)
+        if slot is None:
+            h = zlib.crc32(word.encode('utf-8'))
+            slot = self._slots[word] = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+        return slot
+
+    def encode(self, texts: Sequence[str], convert_to_numpy: bool = True,
+               **_: object) -> np.ndarray:
+        rows, cols, signs = [], [], []
+        for row, text in enumerate(texts):
+            for word in _WORD.findall(text.lower()):
+                col, sign = self._slot(word)
+                rows.append(row)
+                cols.append(col)
+                signs.append(sign)
+        out = np.zeros((len(texts), self.dim), dtype='float32')
+        np.add.at(out, (np.asarray(rows, dtype='int64'), np.asarray(cols, dtype='int64')),
+                  np.asarray(signs, dtype='float32'))
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Synthetic Markdown corpus in the shape of ``output/*.md``.
+
+Each document has the same YAML front matter fields as the real design
+documents (category, keywords, topics, relatedProducts, trainingQuestions,
+...) followed by ``##`` sections of paragraphs, with occasional code
+blocks, bullet lists and tables. Content is drawn from a seeded RNG, so a
+given ``--sections``/``--seed`` always produces byte-identical files.
+
+    python benchmarks/synthetic_corpus.py --sections 10000 --out /tmp/corpus
+
+One ``trainingQuestions`` entry is written per section; ``queries.txt``
+next to the documents lists them all, one per line.
+"""
+import argparse
+import random
+from pathlib import Path
+from typing import List, Tuple
+
+CATEGORIES = ('network-design', 'security', 'api', 'operations', 'architecture')
+TOPICS = ('evpn', 'vxlan', 'bgp', 'ospf', 'isis', 'gnmi', 'telemetry', 'firewall', 'vrf',
+          'multihoming', 'underlay', 'overlay', 'qos', 'mpls', 'segment-routing', 'lacp')
+NOUNS = ('fabric', 'spine', 'leaf', 'gateway', 'policy', 'session', 'neighbor', 'interface',
+         'route', 'filter', 'zone', 'tenant', 'collector', 'subscription', 'template')
+WORDS = ('the configuration uses a dedicated loopback for every device in the pod '
+         'each leaf advertises type-5 routes into the tenant vrf while spines act as '
+         'route reflectors the collector subscribes to interface counters over gnmi '
+         'firewall filters protect the control plane and rate limit icmp traffic '
+         'commit confirmed gives a rollback window when changing production policy '
+         'mtu must be consistent across the underlay to carry vxlan encapsulation '
+         'esi multihoming keeps servers connected when one leaf fails').split()
+CODE = ('set protocols bgp group overlay type internal\n'
+        'set protocols bgp group overlay local-address 10.0.0.{n}\n'
+        'set protocols evpn encapsulation vxlan\n'
+        'set interfaces xe-0/0/{n} unit 0 family ethernet-switching vlan members v{n}')
+
+
+def _sentence(rng: random.Random, topic: str, noun: str) -> str:
+    words = rng.choices(WORDS, k=rng.randint(8, 18))
+    words.insert(rng.randrange(len(words)), topic)
+    words.insert(rng.randrange(len(words)), noun)
+    return ' '.join(words).capitalize() + '.'
+
+
+def _section(rng: random.Random, title: str, topic: str, noun: str, n: int) -> str:
+    parts = [f'## {title}', '']
+    for _ in range(rng.randint(2, 4)):
+        parts += [' '.join(_sentence(rng, topic, noun) for _ in range(rng.randint(2, 5))), '']
+    kind = rng.random()
+    if kind < 0.2:
+        parts += ['```', CODE.format(n=n % 48), '```', '']
+    elif kind < 0.35:
+        parts += [f'- {_sentence(rng, topic, noun)}' for _ in range(rng.randint(2, 5))] + ['']
+    elif kind < 0.45:
+        parts += ['| Parameter | Value |', '|-----------|-------|']
+        parts += [f'| {rng.choice(NOUNS)}-{i} | {rng.randint(1, 4096)} |' for i in range(3)] + ['']
+    return '\n'.join(parts)
+
+
+def generate_document(rng: random.Random, doc_no: int, sections: int) -> Tuple[str, List[str]]:
+    """Return ``(markdown, questions)`` for one document."""
+    category = rng.choice(CATEGORIES)
+    topics = rng.sample(TOPICS, 3)
+    doc_id = f'synthetic_{doc_no:06d}'
+    titles, questions, body = [], [], []
+    for s in range(sections):
+        topic, noun = rng.choice(topics), rng.choice(NOUNS)
+        title = f'{topic.upper()} {noun} design {s + 1}'
+        titles.append(title)
+        questions.append(f'How is the {topic} {noun} configured in {doc_id} section {s + 1}?')
+        body.append(_section(rng, title, topic, noun, doc_no + s))
+    front = [
+        '---',
+        f'title: "Synthetic Design {doc_no:06d}"',
+        f'description: "Generated {category} document covering {", ".join(topics)}"',
+        'author: "Benchmark Generator"',
+        f'created: "2024-{1 + doc_no % 12:02d}-{1 + doc_no % 28:02d}"',
+        f'version: "1.{doc_no % 5}"',
+        f'id: "{doc_id}"',
+        f'category: "{category}"',
+        'keywords:', *[f'  - {t}' for t in topics],
+        'topics:', *[f'  - {t.upper()} Design' for t in topics],
+        'relatedProducts:', f'  - "Fabric Platform v{1 + doc_no % 3}.0"',
+        'trainingQuestions:', *[f'  - "{q}"' for q in questions],
+        '---',
+        '',
+        f'# Synthetic Design {doc_no:06d}',
+        '',
+        _sentence(rng, topics[0], 'document'),
+        '',
+    ]
+    return '\n'.join(front + body), questions
+
+
+def generate_corpus(out_dir: Path, sections: int, sections_per_doc: int = 20,
+                    seed: int = 0) -> List[str]:
+    """Write ``sections`` sections spread over ``ceil(sections / sections_per_doc)``
+    documents into ``out_dir``; return every document's questions."""
+    rng = random.Random(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    questions: List[str] = []
+    doc_no = 0
+    remaining = sections
+    while remaining > 0:
+        n = min(sections_per_doc, remaining)
+        markdown, qs = generate_document(rng, doc_no, n)
+        (out_dir / f'synthetic_{doc_no:06d}.md').write_text(markdown, encoding='utf-8')
+        questions += qs
+        remaining -= n
+        doc_no += 1
+    (out_dir / 'queries.txt').write_text('\n'.join(questions) + '\n', encoding='utf-8')
+    return questions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', type=Path, required=True)
+    parser.add_argument('--sections', type=int, default=1000)
+    parser.add_argument('--sections-per-doc', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    questions = generate_corpus(args.out, args.sections, args.sections_per_doc, args.seed)
+    print(f"Wrote {len(questions)} sections to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
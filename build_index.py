@@ -5,15 +5,35 @@ This script processes all .md files in 'output/', converts them to JSON-LD via
 Panflute filters, extracts text chunks, and builds a FAISS vector index
 for semantic search.
 """
+import argparse
+import functools
+import hashlib
 import json
 import logging
+import os
+import re
+import shutil
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from subprocess import CalledProcessError, run
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 
 import faiss
-import pickle
-from sentence_transformers import SentenceTransformer
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+from embedders import BACKENDS, DEFAULT_MODEL, DEFAULT_ONNX_DIR, embedder_name, load_embedder
+from graph_export import GraphExporter
+import instrumentation
+from index_versions import new_version_dir, prune_versions, publish_version, resolve_index_dir
+from metadata_store import LEGACY_FILENAME, filter_key, open_metadata, write_metadata
+import shards as shard_layout
+from sparse_index import collection_stats, has_sparse_index, write_sparse_index
+from spill_store import SpillStore
+from token_count import approx_token_count
 
 # -----------------------------------------------------------------------------
 # Logging Configuration
@@ -43,17 +63,120 @@ class IndexingError(BuildIndexError):
     """Raised when FAISS indexing or saving fails."""
     pass
 
+# -----------------------------------------------------------------------------
+# Stage Timing
+# -----------------------------------------------------------------------------
+class StageTimer:
+    """Accumulates wall-clock time and call counts per named build stage."""
+
+    def __init__(self):
+        self.totals: Dict[str, float] = defaultdict(float)
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.totals[name] += time.perf_counter() - start
+            self.counts[name] += 1
+
+    def snapshot(self) -> Dict[str, Tuple[float, int]]:
+        return {name: (secs, self.counts[name]) for name, secs in self.totals.items()}
+
+    def merge(self, snapshot: Dict[str, Tuple[float, int]]) -> None:
+        """Fold in timings recorded elsewhere (e.g. by a pool worker)."""
+        for name, (secs, n) in snapshot.items():
+            self.totals[name] += secs
+            self.counts[name] += n
+
+    def report(self) -> None:
+        if not self.totals:
+            return
+        total = sum(self.totals.values())
+        logger.info("Stage timings (%.3fs total):", total)
+        for name, secs in sorted(self.totals.items(), key=lambda kv: -kv[1]):
+            n = self.counts[name]
+            logger.info("  %-14s %8.3fs  %5.1f%%  n=%-5d avg=%.4fs",
+                        name, secs, 100.0 * secs / total if total else 0.0,
+                        n, secs / n if n else 0.0)
+
 # -----------------------------------------------------------------------------
 # Markdown to JSON-LD Conversion
 # -----------------------------------------------------------------------------
+PARSERS = ('pandoc', 'markdown-it')
+
+
 class MarkdownFilterRunner:
     """Runs pandoc with a Panflute filter to produce AST and JSON-LD."""
 
-    def __init__(self, filter_script: Path):
+    def __init__(self, filter_script: Path, timer: Optional[StageTimer] = None,
+                 parser: str = 'pandoc'):
         if not filter_script.is_file():
             raise FilterNotFoundError(f"Panflute filter not found: {filter_script}")
+        if parser not in PARSERS:
+            raise ValueError(f"Unknown parser {parser!r}, expected one of {PARSERS}")
+        if parser == 'markdown-it':
+            try:
+                import md2jsonld_fast  # noqa: F401
+            except ImportError as e:
+                raise BuildIndexError("--parser markdown-it requires markdown-it-py "
+                                      "(pip install markdown-it-py)") from e
         self.filter_script = filter_script
-        logger.info("Using Panflute filter: %s", filter_script)
+        self.timer = timer or StageTimer()
+        self.parser = parser
+        logger.info("Using Panflute filter: %s (parser: %s)", filter_script, parser)
+
+    def convert(self, md_path: Path, ast_path: Optional[Path] = None) -> Dict[str, Any]:
+        """Single-pass conversion: run pandoc once and reuse its AST in-process.
+
+        The JSON AST feeds both the optional ``.ast.json`` artifact and the
+        md2jsonld prepare/action/build path, so no filter subprocess is spawned.
+        With the ``markdown-it`` parser pandoc only runs for files the fast
+        path cannot convert exactly, and only those get an ``.ast.json``.
+        """
+        if self.parser == 'markdown-it':
+            jsonld = self._convert_fast(md_path)
+            if jsonld is not None:
+                return jsonld
+        with self.timer.stage('pandoc'):
+            ast_json = self._pandoc_json(md_path)
+        if ast_path is not None:
+            with self.timer.stage('ast_write'):
+                ast_path.write_text(ast_json, encoding='utf-8')
+                logger.info("AST generated: %s", ast_path.name)
+        with self.timer.stage('jsonld'):
+            return self.jsonld_from_ast(ast_json, md_path)
+
+    def _convert_fast(self, md_path: Path) -> Optional[Dict[str, Any]]:
+        """Convert in-process with md2jsonld_fast; None when pandoc is needed."""
+        import md2jsonld_fast
+
+        with self.timer.stage('parse'):
+            try:
+                jsonld = md2jsonld_fast.convert(md_path.read_text(encoding='utf-8'), md_path.name)
+            except md2jsonld_fast.UnsupportedMarkdown as e:
+                logger.info("Falling back to pandoc for %s: %s", md_path.name, e)
+                return None
+            except Exception as e:
+                logger.warning("markdown-it conversion failed for %s (%s); falling back to pandoc",
+                               md_path.name, e)
+                logger.debug("Full traceback:", exc_info=True)
+                return None
+        logger.info("✅ Extracted %d graph entries from %s", len(jsonld['@graph']), md_path.name)
+        return jsonld
+
+    def _pandoc_json(self, md_path: Path) -> str:
+        """Convert markdown to a pandoc JSON AST string."""
+        cmd = ['pandoc', str(md_path), '--to', 'json']
+        try:
+            result = run(cmd, check=True, capture_output=True, text=True)
+        except CalledProcessError as e:
+            logger.error("Pandoc JSON conversion failed: %s", e.stderr)
+            raise PandocError(f"Pandoc error for {md_path.name}") from e
+        logger.debug("Pandoc JSON AST output length: %d", len(result.stdout))
+        return result.stdout
 
     def generate_ast(self, md_path: Path, ast_path: Path) -> None:
         """Generate AST JSON using pandoc and verify output."""
@@ -77,21 +200,21 @@ class MarkdownFilterRunner:
 
     def extract_jsonld(self, md_path: Path) -> Dict[str, Any]:
         """Run Panflute filter in-process to extract JSON-LD from markdown."""
+        try:
+            ast_json = self._pandoc_json(md_path)
+        except PandocError:
+            return self._fallback_jsonld(md_path)
+        return self.jsonld_from_ast(ast_json, md_path)
+
+    def jsonld_from_ast(self, ast_json: str, md_path: Path) -> Dict[str, Any]:
+        """Run the md2jsonld filter functions over an existing pandoc JSON AST."""
         import panflute as pf
         import md2jsonld
         import io
 
         try:
-            # Use pandoc to convert markdown to JSON AST
-            cmd = [
-                'pandoc', str(md_path),
-                '--to', 'json'
-            ]
-            result = run(cmd, check=True, capture_output=True, text=True)
-            logger.debug("Pandoc JSON AST output length: %d", len(result.stdout))
-
             # Load into panflute doc object
-            doc = pf.load(io.StringIO(result.stdout))
+            doc = pf.load(io.StringIO(ast_json))
             doc.filename = md_path.name
 
             if not doc:
@@ -116,25 +239,86 @@ class MarkdownFilterRunner:
         except Exception as e:
             logger.error("❌ Exception during JSON-LD extraction for %s: %s", md_path.name, e)
             logger.debug("Full traceback:", exc_info=True)
-            return {
-                '@context': {'@vocab': 'https://schema.org/'},
-                '@graph': [{
-                    '@type': 'Document',
-                    '@id': md_path.stem,
-                    'filename': md_path.name,
-                    'title': md_path.stem,
-                    'sections': []
-                }]
-            }
+            return self._fallback_jsonld(md_path)
+
+    @staticmethod
+    def _fallback_jsonld(md_path: Path) -> Dict[str, Any]:
+        return {
+            '@context': {'@vocab': 'https://schema.org/'},
+            '@graph': [{
+                '@type': 'Document',
+                '@id': md_path.stem,
+                'filename': md_path.name,
+                'title': md_path.stem,
+                'sections': []
+            }]
+        }
 
 
 # -----------------------------------------------------------------------------
 # Chunk Extraction
 # -----------------------------------------------------------------------------
+def load_token_counter(model_name: str) -> Callable[[str], int]:
+    """Count tokens with the embedding model's own tokenizer (no special tokens)."""
+    try:
+        from transformers import AutoTokenizer
+        repo = model_name if '/' in model_name else f'sentence-transformers/{model_name}'
+        tokenizer = AutoTokenizer.from_pretrained(repo)
+    except Exception as e:
+        logger.warning("Tokenizer for %s unavailable (%s); approximating token counts",
+                       model_name, e)
+        return approx_token_count
+    return lambda text: len(tokenizer.tokenize(text))
+
+
+_FENCE = '```'
+# The whitespace between two sentences is captured so splitting keeps it.
+_SENTENCE_END = re.compile(r'(?<=[.!?])(\s+)(?=[A-Z0-9"\'(\[])')
+_LIST_ITEM = re.compile(r'^[ \t]*(?:[-*+]|\d+[.)])[ \t]+', re.MULTILINE)
+
+
+# Document-node attributes copied onto every chunk; metadata_store builds
+# filter indexes over them so searches can be restricted, e.g. to one category.
+DOCUMENT_ATTRIBUTES = ('category', 'keywords', 'topics', 'relatedProducts', 'version')
+
+
+def _attribute_value(value: Any) -> Any:
+    """Lists become lists of strings, anything else a string ('' if missing)."""
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if v not in (None, '')]
+    return '' if value is None else str(value)
+
+
 class ChunkExtractor:
-    """Extracts text chunks from JSON-LD document graphs."""
-    @staticmethod
-    def extract(data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Extracts text chunks from JSON-LD document graphs.
+
+    With ``max_tokens`` set, sections longer than the budget are split into
+    sub-chunks of at most ``max_tokens`` tokens (including the two special
+    tokens the embedder adds), with roughly ``overlap`` tokens repeated
+    between neighbours. Splits fall between the blocks md2jsonld.action
+    emits, then between list items and sentences; fenced code blocks and
+    pipe tables are only cut (line by line) when a single one exceeds the
+    budget. Every sub-chunk keeps its parent ``section_id``.
+
+    The Document node's ``attributes`` are copied onto every chunk.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = 0,
+        overlap: int = 0,
+        tokenizer: Optional[str] = None,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        attributes: Sequence[str] = DOCUMENT_ATTRIBUTES,
+    ):
+        self.max_tokens = max_tokens
+        self.overlap = overlap
+        self.attributes = tuple(attributes)
+        if count_tokens is None and max_tokens > 0:
+            count_tokens = load_token_counter(tokenizer) if tokenizer else approx_token_count
+        self.count_tokens = count_tokens or approx_token_count
+
+    def extract(self, data: Dict[str, Any]) -> List[Dict[str, Any]]:
         chunks: List[Dict[str, Any]] = []
         graph = data.get('@graph', [])
         # The first node is the Document
@@ -142,7 +326,8 @@ class ChunkExtractor:
         base_info = {
             'doc_id':   doc.get('@id', ''),
             'filename': doc.get('filename', ''),
-            'title':    doc.get('title', '')
+            'title':    doc.get('title', ''),
+            **{name: _attribute_value(doc.get(name)) for name in self.attributes},
         }
 
         # Subsequent nodes are Section objects
@@ -153,120 +338,1323 @@ class ChunkExtractor:
             if not text:
                 continue
 
-            chunks.append({
-                **base_info,
-                'section_id':    sec.get('@id', ''),
-                'section_title': sec.get('title', ''),
-                'level':         sec.get('level', 0),
-                'text':          text,
-                'primary':       sec.get('primary', False)   # preserve the flag
-            })
+            section_id = sec.get('@id', '')
+            parts = self.split(text)
+            for i, part in enumerate(parts):
+                chunks.append({
+                    **base_info,
+                    'section_id':    section_id,
+                    'chunk_id':      section_id if len(parts) == 1 else f"{section_id}#{i}",
+                    'chunk_index':   i,
+                    'chunk_count':   len(parts),
+                    'section_title': sec.get('title', ''),
+                    'level':         sec.get('level', 0),
+                    'text':          part,
+                    'primary':       sec.get('primary', False)   # preserve the flag
+                })
 
         logger.info("Extracted %d chunks", len(chunks))
         return chunks
 
+    # ------------------------------------------------------------------
+    # Token-aware splitting
+    # ------------------------------------------------------------------
+    def split(self, text: str) -> List[str]:
+        """Split section text into overlapping pieces that fit the token budget."""
+        budget = self.max_tokens - 2  # [CLS] / [SEP]
+        if self.max_tokens <= 0 or self.count_tokens(text) <= budget:
+            return [text]
+
+        # Units are (separator, text, tokens); the separator joins a unit to
+        # its predecessor: a blank line between blocks, otherwise the
+        # whitespace that stood between the two in the block.
+        units: List[Tuple[str, str, int]] = []
+        for block in self._blocks(text):
+            for i, (sep, piece) in enumerate(self._block_units(block, budget)):
+                units.append(('\n\n' + sep if i == 0 else sep, piece, self.count_tokens(piece)))
+
+        pieces: List[str] = []
+        current: List[Tuple[str, str, int]] = []
+        used = 0
+        for unit in units:
+            if current and used + unit[2] > budget:
+                pieces.append(self._join(current))
+                carry: List[Tuple[str, str, int]] = []
+                kept = 0
+                for prev in reversed(current):
+                    if kept + prev[2] > self.overlap or kept + prev[2] + unit[2] > budget:
+                        break
+                    carry.insert(0, prev)
+                    kept += prev[2]
+                current, used = carry, kept
+            current.append(unit)
+            used += unit[2]
+        if current:
+            pieces.append(self._join(current))
+        return pieces
+
+    @staticmethod
+    def _join(units: List[Tuple[str, str, int]]) -> str:
+        out = units[0][1]
+        for sep, piece, _ in units[1:]:
+            out += sep + piece
+        return out
+
+    @staticmethod
+    def _blocks(text: str) -> List[str]:
+        """Split on blank lines, keeping fenced code blocks in one piece."""
+        blocks: List[str] = []
+        open_fence = False
+        for part in text.split('\n\n'):
+            if open_fence:
+                blocks[-1] += '\n\n' + part
+            else:
+                blocks.append(part)
+            fences = sum(1 for line in part.splitlines() if line.lstrip().startswith(_FENCE))
+            if fences % 2:
+                open_fence = not open_fence
+        return blocks
+
+    @staticmethod
+    def _is_atomic(block: str) -> bool:
+        return block.startswith(_FENCE) or block.lstrip().startswith('|')
+
+    def _block_units(self, block: str, budget: int) -> List[Tuple[str, str]]:
+        """(separator, text) units of a block: list items, then sentences."""
+        if self._is_atomic(block):
+            if self.count_tokens(block) <= budget:
+                return [('', block)]
+            return [('\n\n' if i else '', piece)
+                    for i, piece in enumerate(self._split_lines(block, budget))]
+        units: List[Tuple[str, str]] = []
+        starts = sorted({0, *(m.start() for m in _LIST_ITEM.finditer(block))})
+        sep = ''
+        for start, end in zip(starts, starts[1:] + [len(block)]):
+            item = block[start:end]
+            body = item.rstrip()
+            # Keep a list marker ("2. ") with the first sentence of its item.
+            marker = _LIST_ITEM.match(body)
+            head = marker.group(0) if marker else ''
+            parts = _SENTENCE_END.split(body[len(head):])
+            parts[0] = head + parts[0]
+            for i in range(0, len(parts), 2):
+                sentence = parts[i]
+                if i:
+                    sep = parts[i - 1]
+                if not sentence.strip():
+                    continue
+                if self.count_tokens(sentence) <= budget:
+                    units.append((sep, sentence))
+                else:
+                    units.extend((sep if j == 0 else ' ', words) for j, words in
+                                 enumerate(self._split_words(sentence, budget)))
+                sep = ''
+            sep += item[len(body):]
+        return units
+
+    def _split_lines(self, block: str, budget: int) -> List[str]:
+        """Cut an oversized code block or table between lines, re-fencing code."""
+        lines = block.split('\n')
+        head, tail = '', ''
+        if block.startswith(_FENCE) and len(lines) > 2 and lines[-1].strip() == _FENCE:
+            head, tail = lines[0] + '\n', '\n' + _FENCE
+            lines = lines[1:-1]
+        room = budget - self.count_tokens(head + tail)
+        pieces: List[str] = []
+        current: List[str] = []
+        used = 0
+        for line in lines:
+            n = self.count_tokens(line)
+            if current and used + n > room:
+                pieces.append(head + '\n'.join(current) + tail)
+                current, used = [], 0
+            if n > room:
+                pieces.extend(head + w + tail for w in self._split_words(line, room))
+                continue
+            current.append(line)
+            used += n
+        if current:
+            pieces.append(head + '\n'.join(current) + tail)
+        return pieces
+
+    def _split_words(self, text: str, budget: int) -> List[str]:
+        pieces: List[str] = []
+        current: List[str] = []
+        used = 0
+        for word in text.split():
+            n = self.count_tokens(word)
+            if current and used + n > budget:
+                pieces.append(' '.join(current))
+                current, used = [], 0
+            current.append(word)
+            used += n
+        if current:
+            pieces.append(' '.join(current))
+        return pieces
+
+# -----------------------------------------------------------------------------
+# Index Factory
+# -----------------------------------------------------------------------------
+INDEX_TYPES = ('flat', 'ivf', 'ivfpq', 'hnsw', 'opq')
+# Below this many vectors the trained types cannot fit their quantizers
+# (OPQ alone needs 256 points) and a flat scan is faster anyway.
+MIN_TRAIN_VECTORS = 1000
+MAX_TRAIN_VECTORS = 200_000
+
+
+def _pq_subquantizers(dim: int) -> int:
+    """Largest common PQ sub-quantizer count that divides ``dim`` (>= 2 dims each)."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0 and dim // m >= 2:
+            return m
+    return 1
+
+
+def index_spec(
+    index_type: str,
+    dim: int,
+    n: int,
+    nlist: Optional[int] = None,
+    pq_m: Optional[int] = None,
+    hnsw_m: int = 32,
+    max_train: int = MAX_TRAIN_VECTORS,
+) -> Dict[str, Any]:
+    """Choose a FAISS factory string, training sample size and search params.
+
+    Parameters left as None are derived from the corpus size ``n``: roughly
+    ``4 * sqrt(n)`` inverted lists (keeping >= 39 training points per list),
+    8-bit PQ codes when there is enough data to train 256 centroids, and a
+    training sample of 64 points per centroid, capped at ``max_train``.
+    """
+    if index_type not in INDEX_TYPES:
+        raise IndexingError(f"Unknown index type: {index_type}")
+    if index_type in ('ivf', 'ivfpq', 'opq') and n < MIN_TRAIN_VECTORS:
+        logger.warning("Only %d vectors; using a flat index instead of %s", n, index_type)
+        index_type = 'flat'
+    spec: Dict[str, Any] = {'index_type': index_type, 'train_size': 0, 'search_params': {}}
+    if index_type == 'flat':
+        spec['factory'] = 'IDMap2,Flat'
+        return spec
+    if index_type == 'hnsw':
+        spec['factory'] = f'IDMap2,HNSW{hnsw_m}'
+        spec['ef_construction'] = 200
+        spec['search_params'] = {'efSearch': 64}
+        return spec
+
+    if nlist is None:
+        nlist = int(4 * np.sqrt(max(n, 1)))
+        nlist = max(1, min(nlist, n // 39 or 1))
+    train_size = 64 * nlist
+    if index_type == 'ivf':
+        spec['factory'] = f'IVF{nlist},Flat'
+    else:
+        m = pq_m or _pq_subquantizers(dim)
+        nbits = int(min(8, max(1, np.log2(max(n // 39, 2)))))
+        train_size = max(train_size, 64 * (1 << nbits))
+        prefix = f'OPQ{m},' if index_type == 'opq' else ''
+        spec['factory'] = f'{prefix}IVF{nlist},PQ{m}x{nbits}'
+    spec['nlist'] = nlist
+    spec['train_size'] = int(min(n, train_size, max_train))
+    spec['search_params'] = {'nprobe': min(nlist, max(8, nlist // 16))}
+    return spec
+
+
+def new_ann_index(spec: Dict[str, Any], dim: int) -> faiss.Index:
+    """Empty, untrained index described by :func:`index_spec`."""
+    index = faiss.index_factory(dim, spec['factory'])
+    if 'ef_construction' in spec:
+        faiss.downcast_index(index.index).hnsw.efConstruction = spec['ef_construction']
+    return index
+
+
+def set_search_params(index: faiss.Index, spec: Dict[str, Any]) -> None:
+    for name, value in spec['search_params'].items():
+        faiss.ParameterSpace().set_index_parameter(index, name, value)
+
+
+def build_ann_index(spec: Dict[str, Any], vectors: np.ndarray, ids: np.ndarray) -> faiss.Index:
+    """Create, train and fill an index described by :func:`index_spec`."""
+    index = new_ann_index(spec, vectors.shape[1])
+    if not index.is_trained:
+        n = len(vectors)
+        size = spec['train_size'] or n
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(n, size=size, replace=False)) if size < n else slice(None)
+        logger.info("Training %s on %d of %d vectors", spec['factory'], size, n)
+        index.train(np.ascontiguousarray(vectors[sample]))
+    index.add_with_ids(vectors, ids)
+    set_search_params(index, spec)
+    return index
+
+
+IVF_DATA = 'faiss_index.ivfdata'
+
+
+def build_ondisk_ivf(spec: Dict[str, Any], vectors: np.ndarray, ids: np.ndarray,
+                     positions: np.ndarray, directory: Path, block_rows: int) -> faiss.Index:
+    """Build an IVF index from ``vectors[positions]`` with its lists in ``directory/IVF_DATA``.
+
+    ``vectors`` may be a memmap larger than memory. The index is trained on
+    a sample drawn as in :func:`build_ann_index`; then each block of
+    ``block_rows`` vectors is added to a copy of the empty trained index and
+    written out, and the blocks' inverted lists are merged into one on-disk
+    file (``faiss.contrib.ondisk``) without loading them. Readers open the
+    index with ``faiss.IO_FLAG_ONDISK_SAME_DIR``.
+    """
+    from faiss.contrib.ondisk import merge_ondisk
+
+    index = new_ann_index(spec, vectors.shape[1])
+    n = len(positions)
+    size = spec['train_size'] or n
+    rng = np.random.default_rng(0)
+    sample = positions[np.sort(rng.choice(n, size=size, replace=False))] if size < n else positions
+    logger.info("Training %s on %d of %d vectors", spec['factory'], size, n)
+    index.train(np.ascontiguousarray(vectors[sample]))
+
+    blocks_dir = directory / 'ivf_blocks'
+    shutil.rmtree(blocks_dir, ignore_errors=True)
+    blocks_dir.mkdir(parents=True)
+    blocks = []
+    for start in range(0, n, block_rows):
+        block = positions[start:start + block_rows]
+        part = faiss.clone_index(index)
+        part.add_with_ids(np.ascontiguousarray(vectors[block]), np.asarray(ids[block]))
+        blocks.append(str(blocks_dir / f'block-{len(blocks):05d}.index'))
+        faiss.write_index(part, blocks[-1])
+        del part
+    (directory / IVF_DATA).unlink(missing_ok=True)
+    merge_ondisk(index, blocks, str(directory / IVF_DATA))
+    shutil.rmtree(blocks_dir)
+    logger.info("Merged %d blocks into on-disk inverted lists (%s)", len(blocks), IVF_DATA)
+    set_search_params(index, spec)
+    return index
+
+
 # -----------------------------------------------------------------------------
 # FAISS Index Builder
 # -----------------------------------------------------------------------------
+MANIFEST_VERSION = 1
+
+
+def chunk_key(chunk: Dict[str, Any]) -> str:
+    """Identity of a chunk: its ``chunk_id``, or ``section_id`` for older metadata."""
+    return chunk.get('chunk_id') or chunk['section_id']
+
+
+def stable_id(key: str) -> int:
+    """Derive a stable, non-negative 63-bit FAISS id from a chunk id."""
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') & 0x7FFFFFFFFFFFFFFF
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Replace ``path`` with ``data`` so readers never see a partial file."""
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
 class VectorIndexBuilder:
-    """Builds and saves a FAISS index from text chunks."""
+    """Builds and saves a FAISS index from text chunks.
 
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
-        logger.info("Loading embedding model: %s", model_name)
-        self.embedder = SentenceTransformer(model_name)
+    Vectors are stored in an ``IndexIDMap2`` keyed by :func:`stable_id` of each
+    chunk's ``chunk_id`` (the ``section_id`` for unsplit sections), and a
+    manifest records a content hash per source file and per chunk. Loading a previous build with :meth:`load` lets
+    :meth:`add_document` replace only the files that changed, reusing stored
+    vectors for sections whose text is unchanged.
+
+    The exact flat store is always kept; for approximate ``index_type`` values
+    it is saved as ``vectors.bin`` and the searchable ``faiss_index.bin`` is
+    trained from it at save time.
+
+    With ``shards`` > 1 the builder still holds one store, and :meth:`save`
+    partitions it by ``shard_by`` into independently loadable shard
+    directories (see shards.py).
+
+    Chunks are not embedded one file at a time: :meth:`add_chunks` queues
+    them until ``embed_buffer`` chunks need embedding, and :meth:`flush`
+    (also run by :meth:`save`) encodes the whole queue in one call, so the
+    embedder can group texts of similar length across files. Queued chunks
+    are indexed in the order they were added.
+
+    ``embedder`` replaces the SentenceTransformer for ``model_name``: any object
+    with ``encode(texts, convert_to_numpy=True)`` and
+    ``get_sentence_embedding_dimension()`` (e.g. an :mod:`embedders` backend
+    or the benchmarks' offline stub).
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        cache_dir: Optional[Path] = None,
+        cache_size: int = 200_000,
+        index_type: str = 'flat',
+        index_params: Optional[Dict[str, Any]] = None,
+        chunking: Optional[Dict[str, Any]] = None,
+        embedder: Optional[Any] = None,
+        embed_buffer: int = 1024,
+        shards: int = 1,
+        shard_by: str = 'doc',
+    ):
+        if index_type not in INDEX_TYPES:
+            raise IndexingError(f"Unknown index type: {index_type}")
+        if shard_by not in shard_layout.SHARD_BY:
+            raise IndexingError(f"Unknown shard key: {shard_by}")
+        self.shards = max(1, shards)
+        self.shard_by = shard_by
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.model_name = model_name
+        if embedder is None:
+            embedder = load_embedder(model_name)
+        self.embedder = embedder
+        self.embed_buffer = max(1, embed_buffer)
         self.dim = self.embedder.get_sentence_embedding_dimension()
-        self.index = faiss.IndexFlatL2(self.dim)
+        self.cache: Optional[EmbeddingCache] = None
+        if cache_dir is not None:
+            self.cache = EmbeddingCache(cache_dir, model_name, self.dim, max_entries=cache_size)
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
         self.metadata: List[Dict[str, Any]] = []
+        index_config: Dict[str, Any] = {'type': index_type, 'params': self.index_params}
+        if self.shards > 1:
+            index_config['shards'] = {'count': self.shards, 'by': shard_by}
+        self.manifest: Dict[str, Any] = {
+            'version': MANIFEST_VERSION, 'model': model_name, 'files': {},
+            'index': index_config, 'chunking': chunking or {},
+        }
+        self.index_config_changed = False
+        self._ids: set = set()
+        # Chunks waiting for flush(), each with its reused vector or None
+        self._pending: List[Tuple[Dict[str, Any], Optional[np.ndarray]]] = []
+        self._pending_ids: set = set()
+        self._pending_todo = 0
+
+    def load(self, directory: Path) -> bool:
+        """Load a previous build for incremental updates.
+
+        Returns False (leaving the builder empty) when there is no usable
+        previous build, e.g. it predates the manifest or used another model.
+        """
+        manifest_path = directory / 'manifest.json'
+        if not manifest_path.is_file():
+            logger.info("No manifest in %s; doing a full build", directory)
+            return False
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+            if manifest.get('version') != MANIFEST_VERSION or manifest.get('model') != self.model_name:
+                logger.warning("Manifest version/model mismatch; doing a full build")
+                return False
+            parts = shard_layout.index_parts(directory)
+            if len(parts) == 1:
+                index, metadata = self._read_store(parts[0])
+            else:
+                # Shards are merged back into one store; save() splits it again.
+                index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+                metadata = []
+                for part in parts:
+                    shard, rows = self._read_store(part)
+                    index.add_with_ids(shard.index.reconstruct_n(0, shard.ntotal),
+                                       faiss.vector_to_array(shard.id_map).astype('int64'))
+                    metadata.extend(rows)
+        except Exception as e:
+            logger.warning("Could not load previous build (%s); doing a full build", e)
+            return False
+        if index.d != self.dim or index.ntotal != len(metadata) or \
+                not isinstance(index, faiss.IndexIDMap2) or \
+                any('id' not in m for m in metadata):
+            logger.warning("Previous index is inconsistent with its metadata; doing a full build")
+            return False
+
+        self.index = index
+        self.metadata = metadata
+        index_config = self.manifest['index']
+        chunking = self.manifest['chunking']
+        self.index_config_changed = manifest.get('index') != index_config
+        if manifest.get('chunking') != chunking:
+            # Every file must be re-chunked; unchanged chunks still reuse vectors.
+            logger.info("Chunking settings changed; re-parsing all files")
+            for entry in manifest['files'].values():
+                entry['sha256'] = None
+        self.manifest = {**manifest, 'index': index_config, 'chunking': chunking}
+        self._ids = {m['id'] for m in metadata}
+        logger.info("Loaded previous build: %d chunks from %d files",
+                    len(metadata), len(manifest['files']))
+        return True
 
-    def add_chunks(self, chunks: List[Dict[str, Any]]) -> None:
-        if not chunks:
+    @staticmethod
+    def _read_store(directory: Path) -> Tuple[faiss.Index, List[Dict[str, Any]]]:
+        """The exact vector store and metadata rows saved in ``directory``."""
+        store = directory / 'vectors.bin'
+        if not store.is_file():
+            if shard_layout.read_info(directory).get('index_type', 'flat') != 'flat':
+                raise IndexingError(f"no exact vector store in {directory} "
+                                    "(--streaming builds do not write vectors.bin)")
+            store = directory / 'faiss_index.bin'
+        return (faiss.read_index(str(store), faiss.IO_FLAG_ONDISK_SAME_DIR),
+                list(open_metadata(directory)))
+
+    @property
+    def chunk_count(self) -> int:
+        return len(self.metadata)
+
+    @property
+    def file_count(self) -> int:
+        return len(self.manifest['files'])
+
+    def is_unchanged(self, filename: str, file_hash: str) -> bool:
+        entry = self.manifest['files'].get(filename)
+        return entry is not None and entry.get('sha256') == file_hash
+
+    def indexed_files(self) -> List[str]:
+        return sorted(self.manifest['files'])
+
+    def add_document(self, filename: str, file_hash: str,
+                     chunks: List[Dict[str, Any]]) -> None:
+        """Index a source file, replacing whatever a previous build stored for it."""
+        previous = self.manifest['files'].get(filename, {}).get('sections', {})
+        sections = {chunk_key(c): content_hash(c['text'].encode('utf-8')) for c in chunks}
+        reused = {}
+        for sid, digest in sections.items():
+            if previous.get(sid) == digest and stable_id(sid) in self._ids:
+                reused[sid] = self.index.reconstruct(stable_id(sid))
+        self.remove_document(filename)
+        self.add_chunks(chunks, reused)
+        self.manifest['files'][filename] = {'sha256': file_hash, 'sections': sections}
+
+    def remove_document(self, filename: str) -> None:
+        """Drop all vectors, metadata and queued chunks belonging to ``filename``."""
+        if any(c['filename'] == filename for c, _ in self._pending):
+            self._pending = [(c, v) for c, v in self._pending if c['filename'] != filename]
+            self._pending_ids = {c['id'] for c, _ in self._pending}
+            self._pending_todo = sum(v is None for _, v in self._pending)
+        stale = [m['id'] for m in self.metadata if m['filename'] == filename]
+        if stale:
+            try:
+                self.index.remove_ids(np.array(stale, dtype='int64'))
+            except Exception as e:
+                logger.error("Failed to remove embeddings: %s", e)
+                raise IndexingError("Embedding removal failed") from e
+            self._ids.difference_update(stale)
+            self.metadata = [m for m in self.metadata if m['filename'] != filename]
+            logger.info("Removed %d chunks from %s", len(stale), filename)
+        self.manifest['files'].pop(filename, None)
+
+    def add_chunks(self, chunks: List[Dict[str, Any]],
+                   reused: Optional[Dict[str, Any]] = None) -> None:
+        """Queue chunks for indexing; ``reused`` maps chunk_id to a stored vector.
+
+        Flushes once ``embed_buffer`` queued chunks need embedding.
+        """
+        reused = reused or {}
+        for c in chunks:
+            cid = stable_id(chunk_key(c))
+            if cid in self._ids or cid in self._pending_ids:
+                logger.warning("Duplicate chunk id %s in %s; skipping",
+                               chunk_key(c), c['filename'])
+                continue
+            vector = reused.get(chunk_key(c))
+            self._pending.append(({**c, 'id': cid}, vector))
+            self._pending_ids.add(cid)
+            self._pending_todo += vector is None
+        if self._pending_todo >= self.embed_buffer:
+            self.flush()
+
+    def flush(self) -> None:
+        """Embed and index every queued chunk in one encode call.
+
+        If the vectors cannot be added, the files they belong to are dropped
+        from the manifest (so an incremental build retries them) and
+        IndexingError is raised.
+        """
+        if not self._pending:
             return
-        texts = [c['text'] for c in chunks]
-        embeddings = self.embedder.encode(texts, convert_to_numpy=True)
+        pending, self._pending, self._pending_ids = self._pending, [], set()
+        self._pending_todo = 0
+        accepted = [c for c, _ in pending]
+        vectors = np.empty((len(accepted), self.dim), dtype='float32')
+        todo = [i for i, (_, v) in enumerate(pending) if v is None]
+        for i, (_, v) in enumerate(pending):
+            if v is not None:
+                vectors[i] = v
+        start = time.perf_counter()
+        if todo:
+            texts = [accepted[i]['text'] for i in todo]
+            with instrumentation.timed('build.embed', chunks=len(todo)):
+                vectors[todo] = self._encode(texts)
+        embed_secs = time.perf_counter() - start
+        files = sorted({c['filename'] for c in accepted})
         try:
-            self.index.add(embeddings.astype('float32'))
-            self.metadata.extend(chunks)
-            logger.info("Indexed %d chunks", len(chunks))
+            ids = np.array([c['id'] for c in accepted], dtype='int64')
+            with instrumentation.timed('build.index_add', chunks=len(accepted)):
+                self.index.add_with_ids(vectors, ids)
+            self.metadata.extend(accepted)
+            self._ids.update(ids.tolist())
+            logger.info("Indexed %d chunks from %d files (%d embedded in %.3fs, %d reused)",
+                        len(accepted), len(files), len(todo), embed_secs,
+                        len(accepted) - len(todo))
         except Exception as e:
-            logger.error("Failed to add embeddings: %s", e)
+            logger.error("Failed to add embeddings for %s: %s", ', '.join(files), e)
+            for filename in files:
+                self.manifest['files'].pop(filename, None)
             raise IndexingError("Embedding addition failed") from e
 
+    @staticmethod
+    def _write_index(index: faiss.Index, path: Path) -> None:
+        tmp = path.with_name(path.name + '.tmp')
+        faiss.write_index(index, str(tmp))
+        os.replace(tmp, path)
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        def encode(batch: List[str]) -> np.ndarray:
+            return self.embedder.encode(batch, convert_to_numpy=True)
+        if self.cache is None:
+            return encode(texts)
+        return self.cache.encode(texts, encode)
+
     def save(self, directory: Path) -> None:
+        self.flush()
+        if self.cache is not None:
+            self.cache.flush()
+            self.cache.log_stats()
         try:
             directory.mkdir(parents=True, exist_ok=True)
-            faiss.write_index(self.index, str(directory / 'faiss_index.bin'))
-            with open(directory / 'metadata.pkl', 'wb') as f:
-                pickle.dump(self.metadata, f)
-            info = {
-                'dimension': self.dim,
-                'chunks': len(self.metadata),
-                'documents': len({m['doc_id'] for m in self.metadata})
-            }
-            with open(directory / 'info.json', 'w') as f:
-                json.dump(info, f, indent=2)
-            logger.info("Index saved (%d chunks, %d docs)",
-                        info['chunks'], info['documents'])
+            info = self._save_index(directory)
+            _write_atomic(directory / 'info.json', json.dumps(info, indent=2).encode('utf-8'))
+            # The manifest goes last: it is only trusted once everything else is in place.
+            self._write_manifest(directory / 'manifest.json')
+            logger.info("Index saved (%d chunks, %d docs, %s)",
+                        info['chunks'], info['documents'], info['index_factory'])
         except Exception as e:
             logger.error("Failed to save index: %s", e)
             raise IndexingError("Index saving failed") from e
 
+    def _save_index(self, directory: Path) -> Dict[str, Any]:
+        """Write the searchable index (or its shards); return the build's info."""
+        if self.shards > 1 and self.metadata:
+            return self._save_shards(directory)
+        info = self._save_part(directory, self.index, self.metadata)
+        # Changes whenever the indexed content, model or index layout does;
+        # the chat server keys its answer cache on it.
+        info['build_hash'] = self._build_hash(info['index_factory'])
+        return info
+
+    def _write_manifest(self, path: Path) -> None:
+        _write_atomic(path, json.dumps(self.manifest, indent=2).encode('utf-8'))
+
+    def _build_hash(self, factory: Any) -> str:
+        return hashlib.sha256(json.dumps([self.manifest, factory], sort_keys=True)
+                              .encode('utf-8')).hexdigest()[:16]
+
+    def _save_part(self, directory: Path, index: faiss.Index, metadata: List[Dict[str, Any]],
+                   sparse_stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Write one searchable index (the whole build or a shard); return its info."""
+        directory.mkdir(parents=True, exist_ok=True)
+        spec = index_spec(self.index_type, self.dim, index.ntotal, **self.index_params)
+        if spec['index_type'] == 'flat':
+            search_index = index
+            (directory / 'vectors.bin').unlink(missing_ok=True)
+        else:
+            self._write_index(index, directory / 'vectors.bin')
+            ids = faiss.vector_to_array(index.id_map).astype('int64')
+            vectors = index.index.reconstruct_n(0, index.ntotal)
+            search_index = build_ann_index(spec, vectors, ids)
+        self._write_index(search_index, directory / 'faiss_index.bin')
+        (directory / IVF_DATA).unlink(missing_ok=True)
+        write_metadata(directory, metadata, filter_fields=DOCUMENT_ATTRIBUTES)
+        (directory / LEGACY_FILENAME).unlink(missing_ok=True)
+        write_sparse_index(directory, metadata, stats=sparse_stats)
+        return self._part_info(spec, len(metadata), len({m['doc_id'] for m in metadata}))
+
+    def _part_info(self, spec: Dict[str, Any], chunks: int, documents: int) -> Dict[str, Any]:
+        return {
+            'dimension': self.dim,
+            'chunks': chunks,
+            'documents': documents,
+            'id_map': True,
+            'index_type': spec['index_type'],
+            'index_factory': spec['factory'],
+            'train_size': spec['train_size'],
+            'search_params': spec['search_params'],
+        }
+
+    def _save_shards(self, directory: Path) -> Dict[str, Any]:
+        """Partition the store by ``shard_by`` and write each shard under ``shards/``."""
+        assignment = shard_layout.assign_shards(self.metadata, self.shards, self.shard_by)
+        ids = faiss.vector_to_array(self.index.id_map).astype('int64')
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        position = {int(i): pos for pos, i in enumerate(ids)}
+        stats = collection_stats(self.metadata)
+        parts = []
+        for shard in range(self.shards):
+            rows = [m for m, s in zip(self.metadata, assignment) if s == shard]
+            if not rows:
+                logger.warning("Shard %d of %d is empty; not writing it", shard, self.shards)
+                continue
+            index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.dim))
+            positions = [position[m['id']] for m in rows]
+            index.add_with_ids(vectors[positions], ids[positions])
+            name = shard_layout.shard_name(shard)
+            part = self._save_part(directory / shard_layout.DIRNAME / name, index, rows, stats)
+            parts.append((name, part))
+            logger.info("Shard %s: %d chunks, %d docs", name, part['chunks'], part['documents'])
+        return self._finish_shards(directory, parts, len(self.metadata),
+                                   len({m['doc_id'] for m in self.metadata}))
+
+    def _finish_shards(self, directory: Path, parts: List[Tuple[str, Dict[str, Any]]],
+                       chunks: int, documents: int) -> Dict[str, Any]:
+        """Write each shard's info.json; return the top-level info of a sharded build."""
+        build_hash = self._build_hash([part['index_factory'] for _, part in parts])
+        for i, (name, part) in enumerate(parts):
+            part.update(build_hash=build_hash, shard={'name': name, 'index': i, 'count': len(parts),
+                                                      'by': self.shard_by})
+            _write_atomic(directory / shard_layout.DIRNAME / name / 'info.json',
+                          json.dumps(part, indent=2).encode('utf-8'))
+        return {
+            'dimension': self.dim,
+            'chunks': chunks,
+            'documents': documents,
+            'id_map': True,
+            'index_type': self.index_type,
+            'index_factory': ', '.join(sorted({part['index_factory'] for _, part in parts})),
+            'build_hash': build_hash,
+            'shard_by': self.shard_by,
+            'shards': [{'name': name, 'chunks': part['chunks'], 'documents': part['documents'],
+                        'index_factory': part['index_factory']} for name, part in parts],
+        }
+
+# -----------------------------------------------------------------------------
+# Streaming (memory-bounded) Builder
+# -----------------------------------------------------------------------------
+DEFAULT_MEMORY_LIMIT_MB = 1024
+# Rough in-memory size of one queued chunk (dict, text, attributes) and of
+# one row's share of a BM25 run while it is sorted.
+CHUNK_BYTES = 8192
+POSTINGS_BYTES = 4096
+# Stands in for the manifest's file entries, which are streamed from the spill
+_MANIFEST_FILES = '\0files\0'
+
+
+class StreamingIndexBuilder(VectorIndexBuilder):
+    """Full builds whose working set stays within ``memory_limit_mb``.
+
+    Instead of growing an in-memory store, every :meth:`flush` appends the
+    embedded batch to a :class:`spill_store.SpillStore` in ``spill_dir``,
+    together with the manifest entries of the files it completes, and
+    commits a checkpoint. A build that was interrupted is continued by
+    running it again with the same settings: :meth:`resume` keeps the
+    committed files, which are then skipped.
+
+    :meth:`save` builds each index part from the spill files. ivf, ivfpq and
+    opq are trained on a sample and filled block by block into on-disk
+    inverted lists (:func:`build_ondisk_ivf`); flat and hnsw are filled
+    block by block too, but must fit in memory as a whole. Metadata, BM25
+    postings and the manifest are written by streaming over the spilled
+    rows. The output matches a :class:`VectorIndexBuilder` build of the same
+    files, except that ``vectors.bin`` is not written: an ``--incremental``
+    build after a streaming one is a full build unless the index is flat.
+
+    The memory limit sizes the embedding batches, the training sample, the
+    index blocks and the BM25 runs; the embedding model comes on top.
+    """
+
+    def __init__(self, spill_dir: Path, memory_limit_mb: int = DEFAULT_MEMORY_LIMIT_MB,
+                 **kwargs: Any):
+        super().__init__(**kwargs)
+        self.memory_limit = max(1, memory_limit_mb) << 20
+        self.embed_buffer = min(self.embed_buffer,
+                                self._budget_rows(CHUNK_BYTES + 4 * self.dim, 0.5))
+        self.spill = SpillStore(spill_dir, self.dim, {
+            'model': self.model_name, 'dim': self.dim, 'chunking': self.manifest['chunking'],
+        })
+        # Files whose chunks are queued; recorded in the spill with them
+        self._pending_files: List[Tuple[str, Dict[str, Any]]] = []
+
+    def _budget_rows(self, row_bytes: int, share: float = 1.0) -> int:
+        """Rows of ``row_bytes`` each that fit in ``share`` of the memory limit."""
+        return max(1, int(self.memory_limit * share) // row_bytes)
+
+    @property
+    def chunk_count(self) -> int:
+        return self.spill.rows
+
+    @property
+    def file_count(self) -> int:
+        return len(self.spill.files)
+
+    def resume(self, file_hashes: Dict[str, str]) -> None:
+        """Keep the spilled files of an interrupted build if none of them changed."""
+        if not self.spill.files:
+            return
+        stale = [name for name, digest in self.spill.files.items()
+                 if file_hashes.get(name) != digest]
+        if stale:
+            logger.info("%d spilled files changed or were removed (e.g. %s); "
+                        "restarting the streaming build", len(stale), stale[0])
+            self.spill.reset()
+            return
+        logger.info("Resuming streaming build: %d files (%d chunks) already embedded",
+                    len(self.spill.files), self.spill.rows)
+
+    def is_unchanged(self, filename: str, file_hash: str) -> bool:
+        return self.spill.files.get(filename) == file_hash
+
+    def indexed_files(self) -> List[str]:
+        return sorted(self.spill.files)
+
+    def add_document(self, filename: str, file_hash: str,
+                     chunks: List[Dict[str, Any]]) -> None:
+        """Queue a source file's chunks; the file counts as done once they are spilled."""
+        sections = {chunk_key(c): content_hash(c['text'].encode('utf-8')) for c in chunks}
+        self._pending_files.append((filename, {'sha256': file_hash, 'sections': sections}))
+        self.add_chunks(chunks)
+
+    def flush(self) -> None:
+        """Embed the queued chunks, append them to the spill files and commit.
+
+        If they cannot be spilled, everything since the last commit is
+        dropped (so a rerun retries those files) and IndexingError is raised.
+        """
+        if not self._pending and not self._pending_files:
+            return
+        pending, self._pending, self._pending_ids = self._pending, [], set()
+        files, self._pending_files = self._pending_files, []
+        self._pending_todo = 0
+        rows = [c for c, _ in pending]
+        vectors = np.empty((len(rows), self.dim), dtype='float32')
+        start = time.perf_counter()
+        if rows:
+            with instrumentation.timed('build.embed', chunks=len(rows)):
+                vectors[:] = self._encode([c['text'] for c in rows])
+        embed_secs = time.perf_counter() - start
+        try:
+            with instrumentation.timed('build.spill', chunks=len(rows)):
+                self.spill.append(rows, vectors)
+                for filename, entry in files:
+                    self.spill.add_file(filename, entry)
+                self.spill.commit()
+        except OSError as e:
+            logger.error("Failed to spill embeddings for %s: %s",
+                         ', '.join(name for name, _ in files), e)
+            self.spill.rollback()
+            raise IndexingError("Spilling embeddings failed") from e
+        logger.info("Spilled %d chunks from %d files (embedded in %.3fs); %d chunks in total",
+                    len(rows), len(files), embed_secs, self.spill.rows)
+
+    def _unique_rows(self) -> np.ndarray:
+        """Positions of the spilled rows to index: the first row with each id."""
+        ids = np.array(self.spill.ids())
+        _, first = np.unique(ids, return_index=True)
+        if len(first) < len(ids):
+            logger.warning("Skipping %d spilled chunks with duplicate ids", len(ids) - len(first))
+        return np.sort(first)
+
+    def _mask(self, positions: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.spill.rows, dtype=bool)
+        mask[positions] = True
+        return mask
+
+    def _save_index(self, directory: Path) -> Dict[str, Any]:
+        keep = self._unique_rows()
+        if self.shards > 1 and len(keep):
+            return self._save_shards_spilled(directory, keep)
+        info = self._save_part_spilled(directory, keep)
+        info['build_hash'] = self._build_hash(info['index_factory'])
+        return info
+
+    def _save_part_spilled(self, directory: Path, positions: np.ndarray,
+                           sparse_stats: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Like ``_save_part``, for the spilled rows at ``positions``."""
+        directory.mkdir(parents=True, exist_ok=True)
+        n = len(positions)
+        max_train = min(MAX_TRAIN_VECTORS, self._budget_rows(4 * self.dim, 0.5))
+        spec = index_spec(self.index_type, self.dim, n, max_train=max_train, **self.index_params)
+        vectors, ids = self.spill.vectors(), self.spill.ids()
+        block_rows = self._budget_rows(8 * self.dim, 0.25)
+        if spec['index_type'] in ('flat', 'hnsw'):
+            if n * 4 * self.dim > self.memory_limit:
+                logger.warning("The %s index of %d vectors needs about %d MB of memory, more "
+                               "than the limit; ivf, ivfpq and opq indexes are built on disk",
+                               spec['index_type'], n, n * 4 * self.dim >> 20)
+            index = new_ann_index(spec, self.dim)
+            for start in range(0, n, block_rows):
+                block = positions[start:start + block_rows]
+                index.add_with_ids(np.ascontiguousarray(vectors[block]), np.asarray(ids[block]))
+            set_search_params(index, spec)
+            (directory / IVF_DATA).unlink(missing_ok=True)
+        else:
+            index = build_ondisk_ivf(spec, vectors, ids, positions, directory, block_rows)
+        self._write_index(index, directory / 'faiss_index.bin')
+        del index
+        (directory / 'vectors.bin').unlink(missing_ok=True)
+
+        mask = self._mask(positions)
+        documents: set = set()
+
+        def rows() -> Iterator[Dict[str, Any]]:
+            for row in self.spill.iter_rows(mask):
+                documents.add(row['doc_id'])
+                yield row
+
+        write_metadata(directory, rows(), filter_fields=DOCUMENT_ATTRIBUTES)
+        (directory / LEGACY_FILENAME).unlink(missing_ok=True)
+        write_sparse_index(directory, self.spill.iter_rows(mask), stats=sparse_stats,
+                           batch_rows=self._budget_rows(POSTINGS_BYTES))
+        return self._part_info(spec, n, len(documents))
+
+    def _save_shards_spilled(self, directory: Path, keep: np.ndarray) -> Dict[str, Any]:
+        """Like ``_save_shards``, streaming each shard's rows from the spill."""
+        mask = self._mask(keep)
+        documents: set = set()
+        categories: Counter = Counter()
+
+        def scan() -> Iterator[Dict[str, Any]]:
+            for row in self.spill.iter_rows(mask):
+                documents.add(row['doc_id'])
+                categories[filter_key(row.get('category', ''))] += 1
+                yield row
+
+        stats = collection_stats(scan())
+        if self.shard_by == 'doc':
+            shard_of = (shard_layout.doc_shard(r['doc_id'], self.shards)
+                        for r in self.spill.iter_rows(mask))
+        else:
+            target = shard_layout.category_shards(categories, self.shards)
+            shard_of = (target[filter_key(r.get('category', ''))]
+                        for r in self.spill.iter_rows(mask))
+        assignment = np.fromiter(shard_of, dtype='int32', count=len(keep))
+        parts = []
+        for shard in range(self.shards):
+            positions = keep[assignment == shard]
+            if not len(positions):
+                logger.warning("Shard %d of %d is empty; not writing it", shard, self.shards)
+                continue
+            name = shard_layout.shard_name(shard)
+            part = self._save_part_spilled(directory / shard_layout.DIRNAME / name,
+                                           positions, stats)
+            parts.append((name, part))
+            logger.info("Shard %s: %d chunks, %d docs", name, part['chunks'], part['documents'])
+        return self._finish_shards(directory, parts, len(keep), len(documents))
+
+    def _manifest_around_files(self, **dump_args: Any) -> Tuple[str, str]:
+        """The manifest's JSON before and after its ``files`` object."""
+        text = json.dumps({**self.manifest, 'files': _MANIFEST_FILES}, **dump_args)
+        head, tail = text.split(json.dumps(_MANIFEST_FILES), 1)
+        return head, tail
+
+    def _build_hash(self, factory: Any) -> str:
+        # Same digest as VectorIndexBuilder._build_hash, with the file entries streamed in
+        text = json.dumps([{**self.manifest, 'files': _MANIFEST_FILES}, factory], sort_keys=True)
+        head, tail = text.split(json.dumps(_MANIFEST_FILES), 1)
+        digest = hashlib.sha256(head.encode('utf-8') + b'{')
+        for i, (name, entry) in enumerate(self.spill.iter_files(sort=True)):
+            digest.update(f"{', ' if i else ''}{json.dumps(name)}: "
+                          f"{json.dumps(entry, sort_keys=True)}".encode('utf-8'))
+        digest.update(b'}' + tail.encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def _write_manifest(self, path: Path) -> None:
+        # Same text as json.dumps(manifest, indent=2), one file entry at a time
+        head, tail = self._manifest_around_files(indent=2)
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(head)
+            count = 0
+            for name, entry in self.spill.iter_files():
+                body = json.dumps(entry, indent=2).replace('\n', '\n    ')
+                f.write(f"{',' if count else '{'}\n    {json.dumps(name)}: {body}")
+                count += 1
+            f.write('\n  }' if count else '{}')
+            f.write(tail)
+        os.replace(tmp, path)
+
+# -----------------------------------------------------------------------------
+# Document Processing (serial or process pool)
+# -----------------------------------------------------------------------------
+def jsonld_path(proc_dir: Path, md: Path) -> Path:
+    return proc_dir / f"{md.stem}.jsonld"
+
+
+def process_document(
+    runner: MarkdownFilterRunner,
+    extractor: ChunkExtractor,
+    md: Path,
+    proc_dir: Path,
+    write_ast: bool = True,
+    two_pass: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+    """Parse one markdown file, write its JSON-LD and return its chunks.
+
+    Returns None when the file has to be skipped because of a filter error.
+    """
+    timer = runner.timer
+    try:
+        ast_path = proc_dir / f"{md.stem}.ast.json"
+        if two_pass:
+            with timer.stage('pandoc+filter'):
+                runner.generate_ast(md, ast_path)
+            with timer.stage('extract_jsonld'):
+                jsonld = runner.extract_jsonld(md)
+        else:
+            jsonld = runner.convert(md, ast_path if write_ast else None)
+        jl_path = jsonld_path(proc_dir, md)
+        with timer.stage('jsonld_write'):
+            jl_path.write_text(json.dumps(jsonld, indent=2), encoding='utf-8')
+    except BuildIndexError:
+        logger.warning("Skipping file due to filter error: %s", md.name)
+        return None
+
+    with timer.stage('chunk'):
+        return extractor.extract(jsonld)
+
+
+def record_file_timings(timer: StageTimer, md: Path, timings: Dict[str, Tuple[float, int]]) -> None:
+    """Fold one file's parse timings into the build totals and the stage histograms."""
+    timer.merge(timings)
+    for name, (secs, _) in timings.items():
+        instrumentation.observe(f'build.{name}', secs)
+    logger.info("Parsed %s in %.3fs (%s)", md.name, sum(secs for secs, _ in timings.values()),
+                ', '.join(f"{name} {secs:.3f}s" for name, (secs, _) in timings.items()))
+
+
+# Per-process state for pool workers, populated by _init_worker.
+_worker_runner: Optional[MarkdownFilterRunner] = None
+_worker_extractor: Optional[ChunkExtractor] = None
+
+
+def _init_worker(filter_script: Path, log_level: int, chunk_options: Dict[str, Any],
+                 parser: str = 'pandoc') -> None:
+    global _worker_runner, _worker_extractor
+    logging.getLogger().setLevel(log_level)
+    logger.setLevel(log_level)
+    _worker_runner = MarkdownFilterRunner(filter_script, parser=parser)
+    _worker_extractor = ChunkExtractor(**chunk_options)
+
+
+def _process_in_worker(
+    md: Path, proc_dir: Path, write_ast: bool, two_pass: bool
+) -> Tuple[Optional[List[Dict[str, Any]]], Dict[str, Tuple[float, int]]]:
+    _worker_runner.timer = StageTimer()
+    chunks = process_document(_worker_runner, _worker_extractor, md, proc_dir,
+                              write_ast, two_pass)
+    return chunks, _worker_runner.timer.snapshot()
+
+
+def iter_documents(
+    md_files: List[Path],
+    proc_dir: Path,
+    filter_script: Path,
+    timer: StageTimer,
+    workers: int = 1,
+    write_ast: bool = True,
+    two_pass: bool = False,
+    chunk_options: Optional[Dict[str, Any]] = None,
+    parser: str = 'pandoc',
+) -> Iterator[Tuple[Path, Optional[List[Dict[str, Any]]]]]:
+    """Yield ``(md_path, chunks)`` for every file, in ``md_files`` order.
+
+    With ``workers > 1`` parsing, JSON-LD writing and chunk extraction run in
+    a process pool. Results are still yielded in input order, so the caller's
+    embedding stage assigns the same FAISS ids as a serial run would; at most
+    ``2 * workers`` files are in flight at once.
+    """
+    chunk_options = chunk_options or {}
+    if workers <= 1:
+        runner = MarkdownFilterRunner(filter_script, parser=parser)
+        extractor = ChunkExtractor(**chunk_options)
+        for md in md_files:
+            runner.timer = StageTimer()
+            chunks = process_document(runner, extractor, md, proc_dir, write_ast, two_pass)
+            record_file_timings(timer, md, runner.timer.snapshot())
+            yield md, chunks
+        return
+
+    logger.info("Processing documents with %d worker processes", workers)
+    files = iter(md_files)
+    pending: deque = deque()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(filter_script, logger.getEffectiveLevel(), chunk_options, parser),
+    ) as pool:
+        def submit_next() -> None:
+            md = next(files, None)
+            if md is not None:
+                pending.append((md, pool.submit(_process_in_worker, md, proc_dir,
+                                                write_ast, two_pass)))
+
+        for _ in range(2 * workers):
+            submit_next()
+        while pending:
+            md, future = pending.popleft()
+            chunks, timings = future.result()
+            record_file_timings(timer, md, timings)
+            submit_next()
+            yield md, chunks
+
 # -----------------------------------------------------------------------------
 # Main Execution Flow
 # -----------------------------------------------------------------------------
-def main() -> None:
-    import sys
-    
+def write_build_metrics(path: Path, builder: VectorIndexBuilder, timer: StageTimer,
+                        success: bool) -> None:
+    """Write the stage histograms plus build totals as a Prometheus textfile."""
+    registry = instrumentation.REGISTRY
+    registry.gauge('build_chunks', "Chunks in the index after the last build.",
+                   lambda: builder.chunk_count)
+    registry.gauge('build_files', "Source files in the index after the last build.",
+                   lambda: builder.file_count)
+    registry.gauge('build_stage_seconds_total', "Total seconds per stage in the last build.",
+                   lambda: {(name,): secs for name, secs in timer.totals.items()},
+                   labels=('stage',))
+    registry.gauge('build_success', "1 if the last build was saved and published, else 0.",
+                   lambda: int(success))
+    registry.gauge('build_finished_timestamp_seconds', "Unix time the last build finished.",
+                   lambda: time.time())
+    registry.write_textfile(path)
+    logger.info("Build metrics written to %s", path)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build RAG index from Markdown design documents.")
+    parser.add_argument('--log-level', default=None,
+                        help="Logging level (DEBUG, INFO, WARNING, ...)")
+    parser.add_argument('--input-dir', type=Path, default=Path('output'),
+                        help="Directory containing the markdown sources")
+    parser.add_argument('--processed-dir', type=Path, default=Path('processed'),
+                        help="Directory for .jsonld and .ast.json artifacts")
+    parser.add_argument('--index-dir', type=Path, default=Path('index'),
+                        help="Directory for the FAISS index and metadata; each build is "
+                             "written to a new version under it and published atomically")
+    parser.add_argument('--keep-versions', type=int, default=3,
+                        help="Index versions to keep, including the live one (default: 3)")
+    parser.add_argument('--no-ast', dest='write_ast', action='store_false',
+                        help="Skip writing the .ast.json debugging artifact")
+    parser.add_argument('--two-pass', action='store_true',
+                        help="Legacy mode: run pandoc with the external filter and "
+                             "again for in-process extraction (always writes the AST)")
+    parser.add_argument('--parser', choices=PARSERS, default='pandoc',
+                        help="Markdown parser: pandoc (default), or the in-process markdown-it "
+                             "fast path, which falls back to pandoc for files it cannot "
+                             "convert identically and writes no .ast.json for the rest")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Parse documents in N worker processes (default: 1, serial)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Update the existing index: only re-parse changed files and "
+                             "only re-embed changed sections")
+    parser.add_argument('--embed-backend', choices=BACKENDS, default='torch',
+                        help="Embedding backend: torch (SentenceTransformer, default) or onnx "
+                             "(ONNX Runtime; needs onnxruntime)")
+    parser.add_argument('--onnx-int8', action='store_true',
+                        help="With --embed-backend onnx, use int8 dynamically quantized weights")
+    parser.add_argument('--onnx-dir', type=Path, default=DEFAULT_ONNX_DIR,
+                        help="Where exported and quantized ONNX models are kept")
+    parser.add_argument('--embed-threads', type=int, default=None,
+                        help="CPU threads for embedding (default: all cores); the onnx backend "
+                             "runs one single-threaded batch per thread")
+    parser.add_argument('--embed-batch-size', type=int, default=32,
+                        help="Texts per onnx inference batch, grouped by token length")
+    parser.add_argument('--embed-buffer', type=int, default=1024,
+                        help="Chunks collected across files before each embedding call")
+    parser.add_argument('--embed-cache', type=Path, default=Path('cache/embeddings'),
+                        help="Directory of the persistent embedding cache")
+    parser.add_argument('--embed-cache-size', type=int, default=200_000,
+                        help="Maximum cached embeddings per model (0 disables the cache)")
+    parser.add_argument('--chunk-tokens', type=int, default=256,
+                        help="Split sections into chunks of at most N embedder tokens "
+                             "(default: 256, the model's limit; 0 = one chunk per section)")
+    parser.add_argument('--chunk-overlap', type=int, default=32,
+                        help="Approximate tokens repeated between neighbouring chunks")
+    parser.add_argument('--metrics-file', type=Path, default=None,
+                        help="Write per-stage timing histograms to this file in the Prometheus "
+                             "text format (e.g. for node_exporter's textfile collector)")
+    parser.add_argument('--trace', default=None,
+                        help="Record spans: 'otel' for OpenTelemetry, or a JSON-lines file path")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat',
+                        help="FAISS index type (default: flat, exact search)")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="Split the index into N independently loadable shards, searched "
+                             "in parallel by the chat server (default: 1, unsharded)")
+    parser.add_argument('--shard-by', choices=shard_layout.SHARD_BY, default='doc',
+                        help="Assign documents to shards by doc_id hash (default) or keep "
+                             "each category in one shard")
+    parser.add_argument('--nlist', type=int, default=None,
+                        help="Inverted lists for ivf/ivfpq/opq (default: ~4*sqrt(chunks))")
+    parser.add_argument('--pq-m', type=int, default=None,
+                        help="PQ sub-quantizers for ivfpq/opq (default: derived from dimension)")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Spill embeddings to disk in checkpointed batches and build the "
+                             "index from the spill files; an interrupted build resumes when "
+                             "rerun (full builds only)")
+    parser.add_argument('--memory-limit-mb', type=int, default=None,
+                        help="Memory budget of a --streaming build for batches, training "
+                             f"samples and index blocks (default: {DEFAULT_MEMORY_LIMIT_MB})")
+    parser.add_argument('--spill-dir', type=Path, default=None,
+                        help="Spill files of a --streaming build (default: INDEX_DIR/spill)")
+    parser.add_argument('--graph-export', type=Path, default=None, metavar='DIR',
+                        help="Also export every document's nodes and relationships to DIR as "
+                             "NDJSON and neo4j-admin import CSV (see graph_export.py)")
+    args = parser.parse_args(argv)
+    if args.onnx_int8 and args.embed_backend != 'onnx':
+        parser.error("--onnx-int8 requires --embed-backend onnx")
+    if args.streaming and args.incremental:
+        parser.error("--streaming builds are full builds; drop --incremental")
+    if not args.streaming and (args.memory_limit_mb is not None or args.spill_dir is not None):
+        parser.error("--memory-limit-mb and --spill-dir require --streaming")
+    return args
+
+
+def main(argv: Optional[List[str]] = None, embedder: Optional[Any] = None) -> None:
+    """Run a build; ``embedder`` (see VectorIndexBuilder) is injected by the benchmarks.
+
+    An injected embedder's ``model_name`` attribute, if any, names it in the
+    manifest, and chunks are sized with the approximate token count;
+    ``--embed-backend`` and the other model options are then ignored.
+    """
+    args = parse_args(argv)
+
     # Enable debug logging if requested
-    if '--log-level' in sys.argv:
-        try:
-            idx = sys.argv.index('--log-level')
-            if idx + 1 < len(sys.argv):
-                level = getattr(logging, sys.argv[idx + 1].upper())
-                logging.getLogger().setLevel(level)
-                logger.setLevel(level)
-        except (ValueError, AttributeError):
-            pass
-    
-    input_dir = Path('output')
-    proc_dir = Path('processed')
-    index_dir = Path('index')
+    if args.log_level:
+        level = getattr(logging, args.log_level.upper(), None)
+        if isinstance(level, int):
+            logging.getLogger().setLevel(level)
+            logger.setLevel(level)
+
+    instrumentation.configure(metrics=args.metrics_file is not None, tracing=args.trace)
+
+    input_dir = args.input_dir
+    proc_dir = args.processed_dir
+    index_dir = args.index_dir
     proc_dir.mkdir(exist_ok=True)
     index_dir.mkdir(exist_ok=True)
 
     if not input_dir.is_dir():
-        logger.error("Input directory 'output/' not found")
+        logger.error("Input directory '%s' not found", input_dir)
         return
 
-    filter_runner = MarkdownFilterRunner(Path('md2jsonld.py'))
-    extractor = ChunkExtractor()
-    builder = VectorIndexBuilder()
+    timer = StageTimer()
+    filter_script = Path(__file__).with_name('md2jsonld.py')
+    if not filter_script.is_file():
+        raise FilterNotFoundError(f"Panflute filter not found: {filter_script}")
+    injected = embedder is not None
+    if injected:
+        model_name = getattr(embedder, 'model_name', DEFAULT_MODEL)
+    else:
+        model_name = embedder_name(DEFAULT_MODEL, args.embed_backend, args.onnx_int8)
+        embedder = load_embedder(DEFAULT_MODEL, backend=args.embed_backend,
+                                 quantize=args.onnx_int8, threads=args.embed_threads,
+                                 batch_size=args.embed_batch_size, cache_dir=args.onnx_dir)
+    if args.streaming:
+        builder_class = functools.partial(
+            StreamingIndexBuilder, args.spill_dir or index_dir / 'spill',
+            args.memory_limit_mb or DEFAULT_MEMORY_LIMIT_MB)
+    else:
+        builder_class = VectorIndexBuilder
+    builder = builder_class(
+        model_name=model_name,
+        embedder=embedder,
+        embed_buffer=args.embed_buffer,
+        shards=args.shards,
+        shard_by=args.shard_by,
+        cache_dir=args.embed_cache if args.embed_cache_size > 0 else None,
+        cache_size=args.embed_cache_size,
+        index_type=args.index_type,
+        index_params={k: v for k, v in (('nlist', args.nlist), ('pq_m', args.pq_m)) if v},
+        chunking={'max_tokens': args.chunk_tokens, 'overlap': args.chunk_overlap,
+                  'attributes': list(DOCUMENT_ATTRIBUTES)},
+    )
+    live_dir = resolve_index_dir(index_dir)
+    if args.incremental:
+        builder.load(live_dir)
 
-    md_files = list(input_dir.glob('*.md'))
+    md_files = sorted(input_dir.glob('*.md'))
     logger.info("Found %d markdown files", len(md_files))
 
-    for md in md_files:
-        try:
-            ast_path = proc_dir / f"{md.stem}.ast.json"
-            filter_runner.generate_ast(md, ast_path)
-            jsonld = filter_runner.extract_jsonld(md)
-            jl_path = proc_dir / f"{md.stem}.jsonld"
-            jl_path.write_text(json.dumps(jsonld, indent=2), encoding='utf-8')
-        except BuildIndexError:
-            logger.warning("Skipping file due to filter error: %s", md.name)
-            continue
+    with timer.stage('hash'):
+        file_hashes = {md.name: content_hash(md.read_bytes()) for md in md_files}
+    if args.streaming:
+        builder.resume(file_hashes)
+    changed = [md for md in md_files if not builder.is_unchanged(md.name, file_hashes[md.name])]
+    deleted = [name for name in builder.indexed_files() if name not in file_hashes]
+    exporter = None
+    if args.graph_export:
+        # Unchanged files are exported from their JSON-LD of an earlier build,
+        # the others as they are parsed below.
+        exporter = GraphExporter(args.graph_export)
+        pending = set(changed)
+        with timer.stage('graph_export'):
+            for md in md_files:
+                if md not in pending:
+                    exporter.add_file(jsonld_path(proc_dir, md))
+    if args.incremental:
+        logger.info("Incremental build: %d changed, %d unchanged, %d deleted",
+                    len(changed), len(md_files) - len(changed), len(deleted))
+        if not changed and not deleted and not builder.index_config_changed and \
+                (live_dir / 'manifest.json').is_file() and \
+                all(has_sparse_index(part) for part in shard_layout.index_parts(live_dir)):
+            logger.info("Index is up to date")
+            if exporter is not None:
+                exporter.close()
+            timer.report()
+            return
+
+    for name in deleted:
+        builder.remove_document(name)
 
-        chunks = extractor.extract(jsonld)
+    documents = iter_documents(changed, proc_dir, filter_script, timer,
+                               workers=args.workers, write_ast=args.write_ast,
+                               two_pass=args.two_pass, parser=args.parser,
+                               chunk_options={**builder.manifest['chunking'],
+                                              'tokenizer': None if injected
+                                              else DEFAULT_MODEL})
+    for md, chunks in documents:
+        if chunks is None:
+            continue
+        if exporter is not None:
+            with timer.stage('graph_export'):
+                exporter.add_file(jsonld_path(proc_dir, md))
         try:
-            builder.add_chunks(chunks)
+            with timer.stage('embed+index'), \
+                    instrumentation.timed('build.file', file=md.name, chunks=len(chunks)):
+                builder.add_document(md.name, file_hashes[md.name], chunks)
         except IndexingError:
             logger.warning("Skipping indexing for file: %s", md.name)
             continue
+    try:
+        with timer.stage('embed+index'):
+            builder.flush()
+    except IndexingError:
+        logger.warning("Skipping indexing for the last embedding batch")
+    if exporter is not None:
+        with timer.stage('graph_export'):
+            exporter.close()
 
+    # Write a complete new version, then switch CURRENT to it in one rename,
+    # so a running chat server can pick it up without ever seeing a partial build.
+    version_dir = new_version_dir(index_dir)
+    saved = False
     try:
-        builder.save(index_dir)
-        logger.info("Index build complete")
+        with timer.stage('save'):
+            builder.save(version_dir)
+        publish_version(index_dir, version_dir)
+        prune_versions(index_dir, keep=max(1, args.keep_versions))
+        saved = True
+        logger.info("Index build complete: %s", version_dir)
     except IndexingError:
         logger.error("Index build failed during save")
+        shutil.rmtree(version_dir, ignore_errors=True)
+    if args.streaming:
+        if saved:
+            builder.spill.remove()
+        else:
+            builder.spill.close()
+            logger.info("Kept the spill files in %s; rerun to retry from them",
+                        builder.spill.directory)
+    timer.report()
+    if args.metrics_file:
+        write_build_metrics(args.metrics_file, builder, timer, saved)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Sentence-embedding backends behind the SentenceTransformer ``encode`` API.
+
+:func:`load_embedder` returns the PyTorch SentenceTransformer (backend
+``torch``, the default) or an :class:`OnnxEmbedder`, which runs the same
+transformer through ONNX Runtime, optionally with int8 dynamically quantized
+weights. Both offer ``encode(texts, convert_to_numpy=True)`` and
+``get_sentence_embedding_dimension()``, so build_index.py and rag_chat.py
+use them interchangeably.
+
+OnnxEmbedder tokenizes all texts of a call first, sorts them by token
+count and cuts the sorted list into batches, so every batch is only padded
+to its own longest text. Batches run concurrently on a thread pool (ONNX
+Runtime releases the GIL while it computes). The ONNX model is taken from
+the checkpoint's ``onnx/model.onnx`` when the hub repo ships one, otherwise
+exported from the PyTorch weights, and is quantized on first use; both
+files are kept under ``cache_dir``. Pooling and normalisation follow the
+checkpoint's sentence-transformers configuration.
+"""
+import json
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+DEFAULT_ONNX_DIR = Path('cache/onnx')
+BACKENDS = ('torch', 'onnx')
+POOLING_MODES = ('mean', 'cls', 'max')
+
+
+class EmbedderError(RuntimeError):
+    """Raised when an embedding backend cannot be set up."""
+
+
+def hub_repo(model_name: str) -> str:
+    """Hub id of a model given by its short sentence-transformers name."""
+    return model_name if '/' in model_name or Path(model_name).is_dir() \
+        else f'sentence-transformers/{model_name}'
+
+
+def embedder_name(model_name: str, backend: str = 'torch', quantize: bool = False) -> str:
+    """Name the vectors of a backend are recorded and cached under.
+
+    ONNX vectors differ from the PyTorch ones by rounding (fp32) or by
+    quantization error (int8), so they get their own embedding-cache entries
+    and an index built with one backend is not extended with another.
+    """
+    if backend == 'torch':
+        return model_name
+    return f"{model_name}@{backend}{'-int8' if quantize else ''}"
+
+
+def load_embedder(
+    model_name: str = DEFAULT_MODEL,
+    backend: str = 'torch',
+    quantize: bool = False,
+    threads: Optional[int] = None,
+    workers: Optional[int] = None,
+    batch_size: int = 32,
+    cache_dir: Path = DEFAULT_ONNX_DIR,
+) -> Any:
+    """Load ``model_name`` with the given backend.
+
+    ``threads`` caps the CPU threads used for inference (default: PyTorch's
+    own default, or every core for ONNX). For ONNX, ``workers`` batches run
+    at once with ``threads // workers`` threads each; builds want one
+    single-threaded batch per core, the chat server (small batches, latency
+    bound) a single worker using every thread.
+    """
+    if backend not in BACKENDS:
+        raise EmbedderError(f"Unknown embedding backend: {backend} (choose from {', '.join(BACKENDS)})")
+    if backend == 'torch':
+        if quantize:
+            raise EmbedderError("int8 quantization needs the onnx embedding backend")
+        from sentence_transformers import SentenceTransformer
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        logger.info("Loading embedding model: %s", model_name)
+        return SentenceTransformer(model_name)
+    return OnnxEmbedder(model_name, quantize=quantize, threads=threads, workers=workers,
+                        batch_size=batch_size, cache_dir=cache_dir)
+
+# -----------------------------------------------------------------------------
+# ONNX Runtime backend
+# -----------------------------------------------------------------------------
+def _hub_file(repo: str, filename: str) -> Optional[Path]:
+    """Local path of ``filename`` in a model directory or hub repo, or None."""
+    if Path(repo).is_dir():
+        path = Path(repo) / filename
+        return path if path.is_file() else None
+    try:
+        from huggingface_hub import hf_hub_download
+        return Path(hf_hub_download(repo, filename))
+    except Exception:
+        return None
+
+
+def sentence_config(repo: str) -> Dict[str, Any]:
+    """Pooling mode, normalisation and max sequence length of a checkpoint.
+
+    Read from the sentence-transformers files (``modules.json``, the pooling
+    module's ``config.json`` and ``sentence_bert_config.json``); plain
+    transformer checkpoints get mean pooling without normalisation.
+    """
+    config: Dict[str, Any] = {'pooling': 'mean', 'normalize': False, 'max_seq_length': None}
+    modules_file = _hub_file(repo, 'modules.json')
+    modules = json.loads(modules_file.read_text(encoding='utf-8')) if modules_file else []
+    for module in modules:
+        kind = module.get('type', '')
+        if kind.endswith('.Normalize'):
+            config['normalize'] = True
+        elif kind.endswith('.Pooling'):
+            pooling_file = _hub_file(repo, f"{module['path']}/config.json".lstrip('/'))
+            pooling = json.loads(pooling_file.read_text(encoding='utf-8')) if pooling_file else {}
+            for mode in POOLING_MODES:
+                key = 'pooling_mode_cls_token' if mode == 'cls' else f'pooling_mode_{mode}_tokens'
+                if pooling.get(key):
+                    config['pooling'] = mode
+                    break
+    st_file = _hub_file(repo, 'sentence_bert_config.json')
+    if st_file:
+        config['max_seq_length'] = json.loads(st_file.read_text(encoding='utf-8')).get('max_seq_length')
+    return config
+
+
+def export_onnx(repo: str, path: Path) -> None:
+    """Export a transformer's token embeddings (``last_hidden_state``) to ONNX."""
+    try:
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+    except ImportError as e:
+        raise EmbedderError(f"Exporting {repo} to ONNX needs torch and transformers: {e}") from e
+    logger.info("Exporting %s to ONNX: %s", repo, path)
+    model = AutoModel.from_pretrained(repo).eval()
+    sample = AutoTokenizer.from_pretrained(repo)(['an export sample'], return_tensors='pt')
+    names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in sample]
+
+    class TokenEmbeddings(torch.nn.Module):
+        def __init__(self) -> None:
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs: Any) -> Any:
+            return self.model(**dict(zip(names, inputs)))[0]
+
+    axes = {n: {0: 'batch', 1: 'sequence'} for n in names + ['last_hidden_state']}
+    tmp = path.with_name(path.name + '.tmp')
+    with torch.no_grad():
+        torch.onnx.export(TokenEmbeddings(), tuple(sample[n] for n in names), str(tmp),
+                          input_names=names, output_names=['last_hidden_state'],
+                          dynamic_axes=axes, opset_version=14)
+    os.replace(tmp, path)
+
+
+def quantize_onnx(source: Path, path: Path) -> None:
+    """Write an int8 dynamically quantized copy of an ONNX model."""
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as e:
+        raise EmbedderError(f"int8 quantization needs onnxruntime: {e}") from e
+    logger.info("Quantizing %s to int8: %s", source, path)
+    tmp = path.with_name(path.stem + '.tmp.onnx')
+    quantize_dynamic(str(source), str(tmp), weight_type=QuantType.QInt8)
+    os.replace(tmp, path)
+
+
+def onnx_model_path(model_name: str, quantize: bool = False,
+                    cache_dir: Path = DEFAULT_ONNX_DIR) -> Path:
+    """Path of the (possibly quantized) ONNX model, creating it if needed."""
+    repo = hub_repo(model_name)
+    directory = Path(cache_dir) / re.sub(r'[^\w.-]+', '_', repo)
+    directory.mkdir(parents=True, exist_ok=True)
+    fp32 = directory / 'model.onnx'
+    if not fp32.is_file():
+        shipped = _hub_file(repo, 'onnx/model.onnx')
+        if shipped is not None:
+            tmp = fp32.with_name(fp32.name + '.tmp')
+            shutil.copyfile(shipped, tmp)
+            os.replace(tmp, fp32)
+        else:
+            export_onnx(repo, fp32)
+    if not quantize:
+        return fp32
+    int8 = directory / 'model_int8.onnx'
+    if not int8.is_file():
+        quantize_onnx(fp32, int8)
+    return int8
+
+
+class OnnxEmbedder:
+    """Sentence embeddings from an ONNX export of a sentence-transformers model.
+
+    Matches ``SentenceTransformer(model_name).encode`` up to float rounding
+    (fp32) or quantization error (``quantize=True``);
+    ``benchmarks/embedder_parity.py`` measures the drift.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_MODEL,
+        quantize: bool = False,
+        threads: Optional[int] = None,
+        workers: Optional[int] = None,
+        batch_size: int = 32,
+        cache_dir: Path = DEFAULT_ONNX_DIR,
+    ):
+        try:
+            import onnxruntime as ort
+            from transformers import AutoTokenizer
+        except ImportError as e:
+            raise EmbedderError(f"The onnx embedding backend needs onnxruntime and transformers: {e}") from e
+        repo = hub_repo(model_name)
+        self.model_name = embedder_name(model_name, 'onnx', quantize)
+        self.batch_size = max(1, batch_size)
+        self.threads = max(1, threads or os.cpu_count() or 1)
+        self.workers = max(1, min(workers or self.threads, self.threads))
+        path = onnx_model_path(model_name, quantize, cache_dir)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(repo)
+        config = sentence_config(repo)
+        self.pooling = config['pooling']
+        self.normalize = config['normalize']
+        limit = self.tokenizer.model_max_length
+        self.max_length = min(config['max_seq_length'] or 512, limit if limit < 100_000 else 512)
+        self.pad_id = self.tokenizer.pad_token_id or 0
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = max(1, self.threads // self.workers)
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        logger.info("Loading ONNX embedding model: %s (%s pooling, %d x %d threads)",
+                    path, self.pooling, self.workers, options.intra_op_num_threads)
+        self.session = ort.InferenceSession(str(path), options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                        thread_name_prefix='onnx-embed') if self.workers > 1 else None
+        self.dim = int(self._run([self.tokenize(['dimension probe'])[0]]).shape[1])
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def tokenize(self, texts: Sequence[str]) -> List[List[int]]:
+        """Token ids (with special tokens), truncated to the model's limit."""
+        return self.tokenizer(list(texts), add_special_tokens=True, truncation=True,
+                              max_length=self.max_length)['input_ids']
+
+    def encode(self, texts: Sequence[str], convert_to_numpy: bool = True,
+               batch_size: Optional[int] = None, **_: Any) -> np.ndarray:
+        """Embed ``texts``; rows are returned in input order."""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size=batch_size)[0]
+        if not texts:
+            return np.zeros((0, self.dim), dtype='float32')
+        size = batch_size or self.batch_size
+        ids = self.tokenize(texts)
+        # Longest first, like SentenceTransformer.encode, so padding per batch is minimal
+        order = sorted(range(len(ids)), key=lambda i: -len(ids[i]))
+        batches = [order[i:i + size] for i in range(0, len(order), size)]
+        run = lambda batch: self._run([ids[i] for i in batch])  # noqa: E731
+        results = self._pool.map(run, batches) if self._pool else map(run, batches)
+        out = np.empty((len(ids), self.dim), dtype='float32')
+        for batch, vectors in zip(batches, results):
+            out[batch] = vectors
+        return out
+
+    def _run(self, ids: List[List[int]]) -> np.ndarray:
+        """Embed one batch of token id lists, padded to the longest."""
+        width = max(len(row) for row in ids)
+        input_ids = np.full((len(ids), width), self.pad_id, dtype='int64')
+        mask = np.zeros((len(ids), width), dtype='int64')
+        for i, row in enumerate(ids):
+            input_ids[i, :len(row)] = row
+            mask[i, :len(row)] = 1
+        feeds = {'input_ids': input_ids, 'attention_mask': mask,
+                 'token_type_ids': np.zeros_like(input_ids)}
+        output = self.session.run(None, {k: v for k, v in feeds.items() if k in self.input_names})[0]
+        if output.ndim == 3:
+            output = self._pool_tokens(output, mask)
+        output = output.astype('float32', copy=False)
+        if self.normalize:
+            output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        return output
+
+    def _pool_tokens(self, tokens: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling == 'cls':
+            return tokens[:, 0]
+        weights = mask[:, :, None].astype(tokens.dtype)
+        if self.pooling == 'max':
+            return np.where(weights > 0, tokens, -1e9).max(axis=1)
+        return (tokens * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
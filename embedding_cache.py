@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Persistent on-disk cache of sentence embeddings.
+
+Embeddings are keyed by (model name, normalised chunk text) and stored in a
+memory-mappable float32 matrix, one row per cache slot, next to a compact key
+index (16-byte digest + last-use tick per slot). The cache is size bounded:
+once full, the least recently used slots are evicted and reused.
+
+Each model gets its own sub-directory, so vectors of different dimensions
+never share a file. A cache directory must only have one writer at a time.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+SLOT_DTYPE = np.dtype([('key', f'V{KEY_BYTES}'), ('tick', '<u8')])
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so cosmetic reflows still hit the cache."""
+    return ' '.join(text.split())
+
+
+class EmbeddingCache:
+    """LRU-bounded embedding cache backed by a float32 memmap."""
+
+    VECTORS = 'vectors.f32'
+    SLOTS = 'slots.npy'
+    META = 'meta.json'
+
+    def __init__(
+        self,
+        directory: Path,
+        model_name: str,
+        dim: int,
+        max_entries: int = 200_000,
+        flush_every: int = 256,
+    ):
+        slug = re.sub(r'[^\w.-]+', '_', model_name)
+        self.directory = Path(directory) / slug
+        self.model_name = model_name
+        self.dim = dim
+        self.max_entries = max(1, max_entries)
+        self.flush_every = flush_every
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self._tick = 0
+        self._slots: Dict[bytes, int] = {}
+        self._free: List[int] = []
+        self._vectors: Optional[np.memmap] = None
+        self._slot_table = np.zeros(0, dtype=SLOT_DTYPE)
+        self._open()
+        atexit.register(self.flush)
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def key(self, text: str) -> bytes:
+        h = hashlib.sha256()
+        h.update(self.model_name.encode('utf-8'))
+        h.update(b'\0')
+        h.update(normalize_text(text).encode('utf-8'))
+        return h.digest()[:KEY_BYTES]
+
+    def encode(self, texts: List[str], encode_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """Return embeddings for ``texts``, calling ``encode_fn`` only for misses.
+
+        Duplicate texts within one call are encoded once.
+        """
+        out = np.empty((len(texts), self.dim), dtype='float32')
+        keys = [self.key(t) for t in texts]
+        missing: Dict[bytes, List[int]] = {}
+        with self._lock:
+            for i, k in enumerate(keys):
+                slot = self._slots.get(k)
+                if slot is None:
+                    missing.setdefault(k, []).append(i)
+                    continue
+                out[i] = self._vectors[slot]
+                self._touch(slot)
+                self.hits += 1
+        if not missing:
+            return out
+
+        first = [rows[0] for rows in missing.values()]
+        fresh = np.asarray(encode_fn([texts[i] for i in first]), dtype='float32')
+        with self._lock:
+            for (k, rows), vec in zip(missing.items(), fresh):
+                out[rows] = vec
+                self.misses += len(rows)
+                if k not in self._slots:
+                    self._store(k, vec)
+            if self._dirty >= self.flush_every:
+                self._flush_locked()
+        return out
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._slots),
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+    def log_stats(self) -> None:
+        st = self.stats()
+        logger.info("Embedding cache: hits=%d misses=%d hit_rate=%.1f%% entries=%d evictions=%d",
+                    st['hits'], st['misses'], 100.0 * st['hit_rate'],
+                    st['entries'], st['evictions'])
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    # ------------------------------------------------------------------
+    # Storage
+    # ------------------------------------------------------------------
+    def _open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        meta_path = self.directory / self.META
+        slots_path = self.directory / self.SLOTS
+        vec_path = self.directory / self.VECTORS
+        if meta_path.is_file() and slots_path.is_file() and vec_path.is_file():
+            try:
+                meta = json.loads(meta_path.read_text(encoding='utf-8'))
+                if meta.get('dim') != self.dim:
+                    raise ValueError(f"dimension {meta.get('dim')} != {self.dim}")
+                table = np.load(slots_path)
+                capacity = len(table)
+                if vec_path.stat().st_size < capacity * self.dim * 4:
+                    raise ValueError("vector file shorter than slot table")
+                self._tick = int(meta.get('tick', 0))
+                self._slot_table = table
+                self._vectors = np.memmap(vec_path, dtype='float32', mode='r+',
+                                          shape=(capacity, self.dim))
+                for slot, (key, tick) in enumerate(table.tolist()):
+                    if tick:
+                        self._slots[bytes(key)] = slot
+                    else:
+                        self._free.append(slot)
+                logger.info("Embedding cache opened: %s (%d entries)",
+                            self.directory, len(self._slots))
+                return
+            except Exception as e:
+                logger.warning("Discarding unreadable embedding cache %s: %s", self.directory, e)
+        self._resize(min(self.max_entries, 1024))
+
+    def _resize(self, capacity: int) -> None:
+        old = len(self._slot_table)
+        vec_path = self.directory / self.VECTORS
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(vec_path, 'ab') as f:
+            f.truncate(capacity * self.dim * 4)
+        self._vectors = np.memmap(vec_path, dtype='float32', mode='r+',
+                                  shape=(capacity, self.dim))
+        table = np.zeros(capacity, dtype=SLOT_DTYPE)
+        table[:old] = self._slot_table[:old]
+        self._slot_table = table
+        self._free.extend(range(capacity - 1, old - 1, -1))
+
+    def _touch(self, slot: int) -> None:
+        self._tick += 1
+        self._slot_table['tick'][slot] = self._tick
+
+    def _store(self, key: bytes, vec: np.ndarray) -> None:
+        if not self._free:
+            capacity = len(self._slot_table)
+            if capacity < self.max_entries:
+                self._resize(min(self.max_entries, capacity * 2))
+            else:
+                self._evict()
+        slot = self._free.pop()
+        self._vectors[slot] = vec
+        self._slot_table['key'][slot] = np.void(key)
+        self._touch(slot)
+        self._slots[key] = slot
+        self._dirty += 1
+
+    def _evict(self) -> None:
+        """Free the least recently used ~5% of slots in one pass."""
+        n = max(1, self.max_entries // 20)
+        ticks = self._slot_table['tick']
+        victims = np.argpartition(ticks, n - 1)[:n]
+        for slot in victims.tolist():
+            key = bytes(self._slot_table['key'][slot])
+            if self._slots.get(key) == slot:
+                del self._slots[key]
+                self.evictions += 1
+            ticks[slot] = 0
+            self._free.append(slot)
+        # Persist the eviction before the freed rows are overwritten, so a
+        # crash can never leave an old key pointing at someone else's vector.
+        self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._vectors is None:
+            return
+        self._vectors.flush()
+        slots_tmp = self.directory / (self.SLOTS + '.tmp')
+        with open(slots_tmp, 'wb') as f:
+            np.save(f, self._slot_table)
+        os.replace(slots_tmp, self.directory / self.SLOTS)
+        meta = {'model': self.model_name, 'dim': self.dim, 'tick': self._tick}
+        meta_tmp = self.directory / (self.META + '.tmp')
+        meta_tmp.write_text(json.dumps(meta), encoding='utf-8')
+        os.replace(meta_tmp, self.directory / self.META)
+        self._dirty = 0
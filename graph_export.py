@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Bulk graph export of the JSON-LD documents for Neo4j.
+
+``build_index.py --graph-export DIR`` streams every document's JSON-LD
+into files that load the whole corpus in one bulk import, instead of one
+transaction per node:
+
+    DIR/
+      graph.ndjson            every node and relationship, one JSON object
+                              per line (the apoc.import.json format)
+      documents.csv           Document nodes      id:ID(Document), ...
+      sections.csv            Section nodes       id:ID(Section), ...
+      products.csv            Product nodes       id:ID(Product), name
+      section_of.csv          (:Section)-[:SECTION_OF {position}]->(:Document)
+      main_entity.csv         (:Document)-[:MAIN_ENTITY]->(:Section)
+      related_products.csv    (:Document)-[:RELATED_PRODUCT]->(:Product)
+
+The CSV files follow the ``neo4j-admin import`` header format; list
+properties are joined with ``ARRAY_DELIMITER`` (pass it as
+``--array-delimiter=U+001F``) and section content may span lines
+(``--multiline-fields=true``). Ids are stable across builds: documents and
+sections keep their JSON-LD ``@id``, products are keyed by their
+normalised name.
+
+Files are written to ``DIR.new`` as documents arrive and replace ``DIR``
+when the exporter is closed. Export existing ``processed/*.jsonld`` files
+without a build with:
+
+    python graph_export.py processed/ graph/
+"""
+import argparse
+import csv
+import json
+import logging
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from metadata_store import filter_key
+
+logger = logging.getLogger(__name__)
+
+ARRAY_DELIMITER = '\x1f'
+
+# (JSON-LD key, CSV header) of every exported property; mainEntity and
+# relatedProducts become relationships instead.
+DOCUMENT_FIELDS: List[Tuple[str, str]] = [
+    ('filename', 'filename'),
+    ('title', 'title'),
+    ('description', 'description'),
+    ('dateCreated', 'dateCreated'),
+    ('author', 'author'),
+    ('version', 'version'),
+    ('category', 'category'),
+    ('keywords', 'keywords:string[]'),
+    ('topics', 'topics:string[]'),
+    ('trainingQuestions', 'trainingQuestions:string[]'),
+]
+SECTION_FIELDS: List[Tuple[str, str]] = [
+    ('title', 'title'),
+    ('level', 'level:int'),
+    ('content', 'content'),
+    ('primary', 'primary:boolean'),
+]
+
+# file name -> CSV header row
+CSV_FILES: Dict[str, List[str]] = {
+    'documents.csv': ['id:ID(Document)'] + [h for _, h in DOCUMENT_FIELDS],
+    'sections.csv': ['id:ID(Section)'] + [h for _, h in SECTION_FIELDS],
+    'products.csv': ['id:ID(Product)', 'name'],
+    'section_of.csv': [':START_ID(Section)', ':END_ID(Document)', 'position:int'],
+    'main_entity.csv': [':START_ID(Document)', ':END_ID(Section)'],
+    'related_products.csv': [':START_ID(Document)', ':END_ID(Product)'],
+}
+
+
+def product_id(name: str) -> str:
+    """Stable id of a related product (names are compared like the metadata filters)."""
+    return f'product:{filter_key(name)}'
+
+
+def _typed(value: Any, header: str) -> Any:
+    """A JSON-LD value as the property type named in a CSV header."""
+    if header.endswith('[]'):
+        items = value if isinstance(value, list) else [value] if value not in (None, '') else []
+        return [str(v) for v in items]
+    if header.endswith(':int'):
+        return int(value or 0)
+    if header.endswith(':boolean'):
+        return bool(value)
+    return ', '.join(map(str, value)) if isinstance(value, list) else str(value or '')
+
+
+def _csv_cell(value: Any) -> Any:
+    if isinstance(value, list):
+        return ARRAY_DELIMITER.join(v.replace(ARRAY_DELIMITER, ' ') for v in value)
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return value
+
+
+class GraphExporter:
+    """Streams JSON-LD documents into NDJSON and neo4j-admin CSV files."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.staging = self.directory.with_name(self.directory.name + '.new')
+        shutil.rmtree(self.staging, ignore_errors=True)
+        self.staging.mkdir(parents=True)
+        self.counts: Dict[str, int] = {}
+        self._documents: set = set()
+        self._products: set = set()
+        self._ndjson = open(self.staging / 'graph.ndjson', 'w', encoding='utf-8')
+        self._handles = {}
+        self._csv = {}
+        for name, header in CSV_FILES.items():
+            f = open(self.staging / name, 'w', encoding='utf-8', newline='')
+            self._handles[name] = f
+            self._csv[name] = csv.writer(f, lineterminator='\n')
+            self._csv[name].writerow(header)
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def add(self, jsonld: Dict[str, Any]) -> bool:
+        """Export one JSON-LD document (its Document node and Sections)."""
+        graph = jsonld.get('@graph') or []
+        doc = next((n for n in graph if n.get('@type') == 'Document'), None)
+        if doc is None or not doc.get('@id'):
+            logger.warning("No Document node in JSON-LD; not exported")
+            return False
+        doc_id = str(doc['@id'])
+        if doc_id in self._documents:
+            logger.warning("Duplicate document id %s (%s); not exported",
+                           doc_id, doc.get('filename', ''))
+            return False
+        self._documents.add(doc_id)
+        self._node('Document', 'documents.csv', doc_id, doc, DOCUMENT_FIELDS)
+
+        sections = set()
+        position = 0
+        for sec in graph:
+            if sec.get('@type') != 'Section' or not sec.get('@id'):
+                continue
+            sec_id = str(sec['@id'])
+            if sec_id in sections:
+                continue
+            sections.add(sec_id)
+            position += 1
+            self._node('Section', 'sections.csv', sec_id, sec, SECTION_FIELDS)
+            self._relationship('SECTION_OF', 'section_of.csv', (sec_id, 'Section'),
+                               (doc_id, 'Document'), {'position': position})
+        main = doc.get('mainEntity')
+        if main and str(main) in sections:
+            self._relationship('MAIN_ENTITY', 'main_entity.csv', (doc_id, 'Document'),
+                               (str(main), 'Section'))
+        products = doc.get('relatedProducts') or []
+        for name in products if isinstance(products, list) else [products]:
+            name = str(name).strip()
+            if not name:
+                continue
+            pid = product_id(name)
+            if pid not in self._products:
+                self._products.add(pid)
+                self._node('Product', 'products.csv', pid, {'name': name}, [('name', 'name')])
+            self._relationship('RELATED_PRODUCT', 'related_products.csv', (doc_id, 'Document'),
+                               (pid, 'Product'))
+        return True
+
+    def add_file(self, path: Path) -> bool:
+        """Export a ``.jsonld`` file written by build_index.py; False if it is unusable."""
+        try:
+            jsonld = json.loads(Path(path).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            logger.warning("Cannot export %s (%s); rerun a full build to regenerate it", path, e)
+            return False
+        return self.add(jsonld)
+
+    def close(self) -> Dict[str, int]:
+        """Finish the files and move them into place; return node/relationship counts."""
+        self._close_files()
+        old = self.directory.with_name(self.directory.name + '.old')
+        shutil.rmtree(old, ignore_errors=True)
+        if self.directory.exists():
+            self.directory.rename(old)
+        self.staging.rename(self.directory)
+        shutil.rmtree(old, ignore_errors=True)
+        logger.info("Graph export written to %s: %s", self.directory,
+                    ', '.join(f"{n} {kind}" for kind, n in sorted(self.counts.items())))
+        return dict(self.counts)
+
+    def abort(self) -> None:
+        """Drop the partial export, leaving any previous one in place."""
+        self._close_files()
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _close_files(self) -> None:
+        self._ndjson.close()
+        for f in self._handles.values():
+            f.close()
+
+    def _node(self, label: str, csv_name: str, node_id: str, node: Dict[str, Any],
+              fields: List[Tuple[str, str]]) -> None:
+        values = [_typed(node.get(key), header) for key, header in fields]
+        properties = {key: value for (key, _), value in zip(fields, values)}
+        self._ndjson.write(json.dumps({'type': 'node', 'id': node_id, 'labels': [label],
+                                       'properties': properties}, ensure_ascii=False) + '\n')
+        self._csv[csv_name].writerow([node_id] + [_csv_cell(v) for v in values])
+        self.counts[label] = self.counts.get(label, 0) + 1
+
+    def _relationship(self, rel_type: str, csv_name: str, start: Tuple[str, str],
+                      end: Tuple[str, str], properties: Optional[Dict[str, Any]] = None) -> None:
+        properties = properties or {}
+        self._ndjson.write(json.dumps({
+            'type': 'relationship', 'id': f'{start[0]}|{rel_type}|{end[0]}', 'label': rel_type,
+            'properties': properties,
+            'start': {'id': start[0], 'labels': [start[1]]},
+            'end': {'id': end[0], 'labels': [end[1]]},
+        }, ensure_ascii=False) + '\n')
+        self._csv[csv_name].writerow([start[0], end[0]] + list(properties.values()))
+        self.counts[rel_type] = self.counts.get(rel_type, 0) + 1
+
+
+def export_files(paths: Iterable[Path], directory: Path) -> Dict[str, int]:
+    """Export ``.jsonld`` files into ``directory`` in one go."""
+    exporter = GraphExporter(directory)
+    try:
+        for path in paths:
+            exporter.add_file(path)
+    except BaseException:
+        exporter.abort()
+        raise
+    return exporter.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Export JSON-LD documents for a Neo4j bulk import.")
+    parser.add_argument('processed_dir', type=Path, help="Directory of .jsonld files")
+    parser.add_argument('output_dir', type=Path, help="Export directory (replaced)")
+    args = parser.parse_args(argv)
+    files = sorted(args.processed_dir.glob('*.jsonld'))
+    if not files:
+        parser.error(f"no .jsonld files in {args.processed_dir}")
+    counts = export_files(files, args.output_dir)
+    print(json.dumps(counts, indent=2))
+
+
+if __name__ == '__main__':
+    main()
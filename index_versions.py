@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Versioned index directories with an atomic ``CURRENT`` pointer.
+
+Each build writes a complete, self-contained version and only then points
+``CURRENT`` at it, so a reader always finds one consistent build:
+
+    index/
+      CURRENT          name of the live version (replaced with os.replace)
+      versions/
+        20261017-021500-k3v9q1/
+          faiss_index.bin  metadata/  sparse/  info.json  manifest.json
+
+An index directory without ``CURRENT`` is a pre-versioning build whose
+files live directly in it; :func:`resolve_index_dir` returns it unchanged.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+POINTER = 'CURRENT'
+VERSIONS = 'versions'
+
+
+def current_version(index_dir: Path) -> Optional[str]:
+    """Name of the version ``CURRENT`` points at, or None for a legacy layout."""
+    try:
+        name = (index_dir / POINTER).read_text(encoding='utf-8').strip()
+    except FileNotFoundError:
+        return None
+    return name or None
+
+
+def resolve_index_dir(index_dir: Path) -> Path:
+    """Directory holding the live build's files."""
+    name = current_version(index_dir)
+    return index_dir / VERSIONS / name if name else index_dir
+
+
+def new_version_dir(index_dir: Path) -> Path:
+    """Create an empty, uniquely named version directory (not yet published)."""
+    versions = index_dir / VERSIONS
+    versions.mkdir(parents=True, exist_ok=True)
+    path = Path(tempfile.mkdtemp(prefix=time.strftime('%Y%m%d-%H%M%S-'), dir=versions))
+    path.chmod(0o755)
+    return path
+
+
+def publish_version(index_dir: Path, version_dir: Path) -> None:
+    """Atomically point ``CURRENT`` at ``version_dir``."""
+    tmp = index_dir / f'{POINTER}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(version_dir.name + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, index_dir / POINTER)
+    logger.info("Published index version %s", version_dir.name)
+
+
+def list_versions(index_dir: Path) -> List[str]:
+    """Version names, oldest first."""
+    versions = index_dir / VERSIONS
+    return sorted(p.name for p in versions.iterdir() if p.is_dir()) if versions.is_dir() else []
+
+
+def prune_versions(index_dir: Path, keep: int = 3) -> List[str]:
+    """Delete all but the ``keep`` newest versions; the live one is always kept.
+
+    Servers still on an older version are unaffected on POSIX systems: the
+    FAISS index is in memory and the metadata/sparse mmaps keep the deleted
+    files alive until the server swaps to the new version.
+    """
+    live = current_version(index_dir)
+    names = list_versions(index_dir)
+    stale = [n for n in names[:max(0, len(names) - keep)] if n != live]
+    for name in stale:
+        shutil.rmtree(index_dir / VERSIONS / name, ignore_errors=True)
+    if stale:
+        logger.info("Pruned %d old index versions", len(stale))
+    return stale
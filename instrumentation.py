@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Lightweight pipeline instrumentation: stage histograms and optional spans.
+
+Hot paths are wrapped in ``timed(stage)`` blocks (or the ``instrumented``
+decorator). When enabled, each block feeds a latency histogram exported in
+the Prometheus text format, and can also emit a span:
+
+    rag_stage_seconds{stage="rag.request"}        one question, end to end
+    rag_stage_seconds{stage="retrieve.embed"}     query encoding (incl. batching wait)
+    rag_stage_seconds{stage="retrieve.dense"}     FAISS search
+    rag_stage_seconds{stage="rag.context"}        context assembly
+    rag_stage_seconds{stage="llm.generate"}       LLM call
+    rag_stage_seconds{stage="build.pandoc"}       per-file build stages
+    rag_stage_errors_total{stage="..."}           blocks that raised
+
+Spans nest per request (a ``rag.request`` span parents the retrieval, context
+and LLM spans). They go to OpenTelemetry when ``tracing="otel"`` and the
+``opentelemetry-api`` package is installed, else one JSON object per line to
+a file.
+
+Everything is off until :func:`configure` is called; a disabled ``timed``
+block costs one global check and a no-op context manager.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from pathlib import Path
+from typing import (
+    Any, AsyncIterator, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple,
+    TypeVar, Union
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+F = TypeVar('F', bound=Callable[..., Any])
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+# -----------------------------------------------------------------------------
+# Metrics
+# -----------------------------------------------------------------------------
+class Histogram:
+    """Cumulative-bucket histogram with label values, Prometheus style."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List[float]] = {}  # bucket counts..., sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        n = len(self.buckets)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0.0] * (n + 2)
+            for i in range(n):
+                if value <= self.buckets[i]:
+                    series[i] += 1
+                    break
+            series[n] += value
+            series[n + 1] += 1
+
+    def samples(self) -> Iterable[str]:
+        n = len(self.buckets)
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for values, s in sorted(series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, s[:n]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.label_names, values, le)} ' \
+                      f'{_format_value(cumulative)}'
+            inf = _format_labels(self.label_names, values, 'le="+Inf"')
+            yield f'{self.name}_bucket{inf} {_format_value(s[n + 1])}'
+            labels = _format_labels(self.label_names, values)
+            yield f'{self.name}_sum{labels} {_format_value(s[n])}'
+            yield f'{self.name}_count{labels} {_format_value(s[n + 1])}'
+
+
+class Counter:
+    """Monotonic counter with label values."""
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+
+
+class Gauge:
+    """Value read from a callback at export time.
+
+    The callback returns a number, or a mapping of label-value tuples to
+    numbers; None skips the gauge (e.g. the component is not loaded yet).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn
+
+    def samples(self) -> Iterable[str]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug("Gauge %s failed: %s", self.name, e)
+            return
+        if value is None:
+            return
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        for labels, v in sorted(items):
+            yield f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(v)}'
+
+
+Metric = Union[Histogram, Counter, Gauge]
+
+
+class Registry:
+    """Named metrics, rendered together in the Prometheus text format (0.0.4)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_add(self, metric: Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None and not isinstance(metric, Gauge):
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._get_or_add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any],
+              labels: Sequence[str] = ()) -> Gauge:
+        """Register (or replace) a callback gauge."""
+        return self._get_or_add(Gauge(name, help, fn, labels))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines: List[str] = []
+        for m in metrics:
+            samples = list(m.samples())
+            if not samples:
+                continue
+            lines.append(f'# HELP {m.name} {m.help}')
+            lines.append(f'# TYPE {m.name} {m.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def write_textfile(self, path: Path) -> None:
+        """Write the metrics for node_exporter's textfile collector, atomically."""
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text(self.render(), encoding='utf-8')
+        os.replace(tmp, path)
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'rag_stage_seconds', 'Wall-clock time spent in each pipeline stage.', labels=('stage',))
+STAGE_ERRORS = REGISTRY.counter(
+    'rag_stage_errors_total', 'Pipeline stage executions that raised.', labels=('stage',))
+
+
+# -----------------------------------------------------------------------------
+# Spans
+# -----------------------------------------------------------------------------
+class Span:
+    """A timed operation within a trace; ends when its ``timed`` block exits."""
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start', 'attributes', 'status')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self.attributes = attributes
+        self.status = 'ok'
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+
+class JsonlSpanExporter:
+    """Appends finished spans to a file, one JSON object per line."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=1)
+
+    def export(self, span: Span, duration: float) -> None:
+        record = {
+            'name': span.name, 'trace_id': span.trace_id, 'span_id': span.span_id,
+            'parent_id': span.parent_id, 'start': span.start,
+            'duration_ms': round(duration * 1e3, 3), 'status': span.status,
+            'attributes': span.attributes,
+        }
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+
+    def close(self) -> None:
+        self._file.close()
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar('rag_current_span', default=None)
+
+
+def current_span() -> Optional[Span]:
+    """The innermost active span in this context, when tracing to a file."""
+    return _current_span.get()
+
+
+# -----------------------------------------------------------------------------
+# Timed blocks
+# -----------------------------------------------------------------------------
+_metrics = False
+_exporter: Optional[JsonlSpanExporter] = None
+_otel_tracer: Any = None
+_active = False  # any of the above
+
+
+class _NullTimer:
+    """Shared no-op block used while instrumentation is disabled."""
+    __slots__ = ()
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc: Any) -> bool:
+        return False
+
+
+_NULL = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('stage', 'attributes', 'start', 'span', 'token', 'otel')
+
+    def __init__(self, stage: str, attributes: Dict[str, Any]):
+        self.stage = stage
+        self.attributes = attributes
+        self.span: Optional[Span] = None
+        self.otel: Any = None
+
+    def __enter__(self) -> Optional[Span]:
+        if _otel_tracer is not None:
+            self.otel = _otel_tracer.start_as_current_span(self.stage, attributes=self.attributes)
+            self.otel.__enter__()
+        elif _exporter is not None:
+            self.span = Span(self.stage, _current_span.get(), self.attributes)
+            self.token = _current_span.set(self.span)
+        self.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> bool:
+        elapsed = time.perf_counter() - self.start
+        if _metrics:
+            STAGE_SECONDS.observe(elapsed, self.stage)
+            if exc_type is not None:
+                STAGE_ERRORS.inc(1.0, self.stage)
+        if self.otel is not None:
+            self.otel.__exit__(exc_type, exc, tb)
+        elif self.span is not None:
+            if exc_type is not None:
+                self.span.status = f'error: {exc_type.__name__}'
+            try:
+                _current_span.reset(self.token)
+            except ValueError:  # exited in another context, e.g. a generator resumed elsewhere
+                _current_span.set(None)
+            exporter = _exporter
+            if exporter is not None:
+                exporter.export(self.span, elapsed)
+        return False
+
+
+def timed(stage: str, **attributes: Any) -> Any:
+    """Context manager timing one pipeline stage (a no-op while disabled)."""
+    if not _active:
+        return _NULL
+    return _Timer(stage, attributes)
+
+
+def instrumented(stage: str) -> Callable[[F], F]:
+    """Decorator form of :func:`timed`.
+
+    Works on functions, coroutines, generators and async generators; for
+    the latter two the stage lasts until the iteration ends.
+    """
+    def decorate(fn: F) -> F:
+        if inspect.isasyncgenfunction(fn):
+            @functools.wraps(fn)
+            def agen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                agen = fn(*args, **kwargs)
+                return _timed_agen(stage, agen) if _active else agen
+            return agen_wrapper  # type: ignore[return-value]
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def gen_wrapper(*args: Any, **kwargs: Any) -> Any:
+                gen = fn(*args, **kwargs)
+                return _timed_gen(stage, gen) if _active else gen
+            return gen_wrapper  # type: ignore[return-value]
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not _active:
+                    return await fn(*args, **kwargs)
+                with _Timer(stage, {}):
+                    return await fn(*args, **kwargs)
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _active:
+                return fn(*args, **kwargs)
+            with _Timer(stage, {}):
+                return fn(*args, **kwargs)
+        return wrapper  # type: ignore[return-value]
+    return decorate
+
+
+def _timed_gen(stage: str, gen: Iterator[Any]) -> Iterator[Any]:
+    with _Timer(stage, {}):
+        return (yield from gen)
+
+
+async def _timed_agen(stage: str, agen: AsyncIterator[Any]) -> AsyncIterator[Any]:
+    with _Timer(stage, {}):
+        async for item in agen:
+            yield item
+
+
+def observe(stage: str, seconds: float) -> None:
+    """Record a duration measured elsewhere (e.g. in a worker process)."""
+    if _metrics:
+        STAGE_SECONDS.observe(seconds, stage)
+
+
+def metrics_enabled() -> bool:
+    return _metrics
+
+
+def configure(metrics: bool = False, tracing: Optional[str] = None) -> None:
+    """Enable metrics and/or tracing for this process.
+
+    ``tracing`` is ``"otel"`` to create spans through the OpenTelemetry API
+    (configure its SDK/exporter as usual, e.g. with ``opentelemetry-instrument``),
+    a file path for JSON-lines spans, or None/"" for no spans.
+    """
+    global _metrics, _exporter, _otel_tracer, _active
+    if _exporter is not None:
+        _exporter.close()
+    _metrics, _exporter, _otel_tracer = bool(metrics), None, None
+    if tracing == 'otel':
+        try:
+            from opentelemetry import trace
+            _otel_tracer = trace.get_tracer('rag-pipeline')
+        except ImportError:
+            logger.warning("opentelemetry-api is not installed; tracing disabled")
+    elif tracing:
+        _exporter = JsonlSpanExporter(Path(tracing))
+    _active = _metrics or _exporter is not None or _otel_tracer is not None
+    if _active:
+        logger.info("Instrumentation: metrics=%s tracing=%s", 'on' if _metrics else 'off',
+                    'otel' if _otel_tracer is not None else (tracing or 'off'))
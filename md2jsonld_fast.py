@@ -0,0 +1,746 @@
+#!/usr/bin/env python3
+"""
+In-process Markdown to JSON-LD conversion without pandoc.
+
+:func:`convert` returns the same ``@graph`` as running pandoc and the
+md2jsonld Panflute filter (``MarkdownFilterRunner.convert``), at a fraction
+of the cost. markdown-it-py tokenizes the document, and the tokens are
+turned into a small tree with the shape of pandoc's AST. The differences
+between pandoc's Markdown and CommonMark that show up in the output are
+applied along the way:
+
+- smart quotes, dashes, ellipses and abbreviations
+- ``{#id .class key=value}`` header attributes
+- paragraphs that headers, lists, quotes and tables cannot interrupt
+- Para vs Plain in list items
+- task list checkboxes and implicit figures
+- YAML metadata values parsed as Markdown
+
+The md2jsonld ``action``/``stringify`` logic then replays over that tree.
+
+Documents with constructs whose pandoc output is not reproduced here raise
+:class:`UnsupportedMarkdown`, and callers fall back to pandoc. Those
+constructs include raw HTML blocks, spans and divs, TeX math, footnotes,
+sub/superscript, definition lists, line blocks, grid/simple/multiline
+tables, fancy list markers and fenced code attributes other than a class.
+"""
+import re
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import yaml
+from markdown_it import MarkdownIt
+from markdown_it.rules_block import list_block
+from markdown_it.token import Token
+
+from md2jsonld import MarkdownToJSONLD
+
+
+class UnsupportedMarkdown(ValueError):
+    """The document uses Markdown this parser cannot convert exactly like pandoc."""
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Pandoc-shaped AST
+# -----------------------------------------------------------------------------
+class Node:
+    """One pandoc element: ``tag`` (Para, Str, BulletList, ...), child
+    ``content``, leaf ``text`` (Str, Code, CodeBlock, Raw*, MetaString) and
+    element specific ``attrs`` (level, primary, lang, url).
+
+    Space, SoftBreak and LineBreak are folded into the surrounding Str as
+    ``' '``, which is all ``stringify`` makes of them.
+    """
+    __slots__ = ('tag', 'content', 'text', 'attrs')
+
+    def __init__(self, tag: str, content: Optional[List['Node']] = None,
+                 text: Optional[str] = None, **attrs: Any):
+        self.tag = tag
+        self.content = content if content is not None else []
+        self.text = text
+        self.attrs = attrs
+
+    def __repr__(self) -> str:
+        return f"Node({self.tag!r}, {self.content!r}, {self.text!r})"
+
+
+def _collect(node: Node, in_quoted: bool, first: bool, last: bool, out: List[str]) -> None:
+    # Post-order walk, as panflute's Element.walk
+    content = node.content
+    if content:
+        quoted = node.tag == 'Quoted'
+        n = len(content)
+        for i, child in enumerate(content):
+            _collect(child, quoted, i == 0, i == n - 1, out)
+    if node.text is not None:
+        ans = node.text
+    elif node.tag == 'Para':
+        ans = '\n\n'
+    else:
+        ans = ''
+    if in_quoted:
+        if first:
+            ans = '"' + ans
+        if last:
+            ans += '"'
+    out.append(ans)
+
+
+def stringify(node: Node, in_quoted: bool = False, first: bool = False, last: bool = False) -> str:
+    """``panflute.stringify``; the flags describe ``node``'s own position in a Quoted."""
+    out: List[str] = []
+    _collect(node, in_quoted, first, last, out)
+    return ''.join(out)
+
+
+def _walk(node: Node, in_quoted: bool, first: bool, last: bool, md: MarkdownToJSONLD) -> None:
+    content = node.content
+    if content:
+        quoted = node.tag == 'Quoted'
+        n = len(content)
+        for i, child in enumerate(content):
+            _walk(child, quoted, i == 0, i == n - 1, md)
+    _action(node, in_quoted, first, last, md)
+
+
+def _action(elem: Node, in_quoted: bool, first: bool, last: bool, md: MarkdownToJSONLD) -> None:
+    """``md2jsonld.action`` over :class:`Node` elements."""
+    tag = elem.tag
+    if tag == 'Header':
+        title = stringify(elem)
+        lvl = elem.attrs['level']
+        if lvl <= 2:
+            md.new_section(title, lvl, primary=elem.attrs['primary'])
+        else:
+            md.add_text('#' * lvl + ' ' + title)
+    elif tag in ('Para', 'Table', 'BulletList', 'OrderedList'):
+        md.add_text(stringify(elem))
+    elif tag == 'CodeBlock':
+        md.add_text(f"```{elem.attrs['lang']}\n{elem.text}\n```")
+    elif tag == 'Image':
+        alt = stringify(elem, in_quoted, first, last)
+        md.add_text(f"![{alt}]({elem.attrs['url']})")
+    elif tag == 'BlockQuote':
+        quote_lines = stringify(elem).splitlines()
+        md.add_text('\n'.join(f"> {line}" for line in quote_lines))
+
+
+# -----------------------------------------------------------------------------
+# YAML Metadata
+# -----------------------------------------------------------------------------
+class _Number(str):
+    """A plain YAML scalar that pandoc reads as a number."""
+
+
+class _MetaLoader(yaml.SafeLoader):
+    """Resolves scalars like pandoc: YAML 1.1 booleans, nulls and numbers;
+    everything else (dates included) stays a string."""
+
+
+_MetaLoader.yaml_implicit_resolvers = {}
+_MetaLoader.add_implicit_resolver(
+    'tag:yaml.org,2002:bool',
+    re.compile(r'^(?:y|Y|yes|Yes|YES|n|N|no|No|NO|true|True|TRUE|false|False|FALSE'
+               r'|on|On|ON|off|Off|OFF)$'),
+    list('yYnNtTfFoO'))
+_MetaLoader.add_implicit_resolver(
+    'tag:yaml.org,2002:null', re.compile(r'^(?:~|null|Null|NULL|)$'), ['~', 'n', 'N', ''])
+_MetaLoader.add_implicit_resolver(
+    '!number',
+    re.compile(r'^(?:[-+]?[0-9]+(?:\.[0-9]*)?(?:[eE][-+]?[0-9]+)?|0x[0-9a-fA-F]+|0o[0-7]+)$'),
+    list('-+0123456789'))
+_MetaLoader.add_constructor(
+    'tag:yaml.org,2002:bool',
+    lambda loader, node: loader.construct_scalar(node).lower() in ('y', 'yes', 'true', 'on'))
+_MetaLoader.add_constructor('!number', lambda loader, node: _Number(loader.construct_scalar(node)))
+
+
+def _construct_meta_mapping(loader: _MetaLoader, node: yaml.MappingNode,
+                            deep: bool = False) -> Dict[Any, Any]:
+    # pandoc keys are the scalar text as written: ``yes:``, ``1:`` and ``null:`` stay strings
+    loader.flatten_mapping(node)
+    mapping = {}
+    for key_node, value_node in node.value:
+        key = key_node.value if isinstance(key_node, yaml.ScalarNode) else None
+        mapping[key] = loader.construct_object(value_node, deep=deep)
+    return mapping
+
+
+_MetaLoader.construct_mapping = _construct_meta_mapping
+
+
+def _haskell_double(x: float) -> str:
+    """``show`` of a Haskell Double: fixed notation in [0.1, 1e7), else ``d.ddde<n>``."""
+    if x == 0:
+        return '0.0'
+    if 0.1 <= abs(x) < 1e7:
+        text = repr(x)
+        if 'e' not in text:
+            return text if '.' in text else text + '.0'
+    sign, digits, exp = Decimal(repr(x)).normalize().as_tuple()
+    mantissa = ''.join(map(str, digits))
+    return (f"{'-' if sign else ''}{mantissa[0]}.{mantissa[1:] or '0'}"
+            f"e{exp + len(mantissa) - 1}")
+
+
+def _number_text(value: str) -> str:
+    """Render a YAML number the way pandoc does (integral values as integers)."""
+    if value[:2] in ('0x', '0o'):
+        return str(int(value, 0))
+    number = Decimal(value)
+    if number == number.to_integral_value() and abs(number) < 2 ** 63:
+        return str(int(number))
+    return _haskell_double(float(number))
+
+
+# -----------------------------------------------------------------------------
+# Markdown Parser
+# -----------------------------------------------------------------------------
+_FRONT_MATTER = re.compile(r'\A---[ \t]*\n(?![ \t]*\n)(.*?\n)?(?:---|\.\.\.)[ \t]*(?:\n|\Z)', re.S)
+_HEADER_ATTRS = re.compile(r'[ \t]*\{([^{}]*)\}[ \t]*$')
+_ATTR_TOKEN = re.compile(r'\s*(?:#([\w.:-]+)|\.([\w.:-]+)'
+                         r'|([\w.:-]+)=(?:"([^"]*)"|\'([^\']*)\'|([^\s"\']*))|(-))(?=\s|$)')
+_TASK = re.compile(r'^\[([ xX])\][ \t]')
+_BLANK = re.compile(r'^[\s>]*$')
+_UNDERLINE = re.compile(r'^[\s>]*(?:=+|-+)[ \t]*$')
+_SAFE_URL = re.compile(r"^[A-Za-z0-9\-._~:/?#\[\]@!$&'()*+,;=%]*$")
+_CODE_SPAN = re.compile(r'(`+)[\s\S]*?\1')
+_UNSUPPORTED_INLINE = re.compile(
+    r'\[\^|\^\[|\]\{|\)\{|\\ '                            # footnotes, spans, link attrs, nbsp
+    r'|\$[^\s$](?:[^$]*[^\s$\\])?\$(?!\d)|\$\$'           # TeX math
+    r'|(?<![~\\])~(?!~)[^\s~]+(?<![\\~])~(?!~)'            # subscript
+    r'|(?<!\\)\^[^\s^]+\^'                                # superscript
+    r'|</?(?:span|div)\b', re.I)
+_UNSUPPORTED_LINE = re.compile(
+    r'^[ \t]*(?:[:~][ \t]|:::|Table:|\||\+[-=:+]'          # definition lists, divs, captions,
+                                                          # line blocks, grid tables
+    r'|-{3,}(?:[ \t]+-+)+[ \t]*$'                         # simple table rules
+    r'|\\begin\{'                                         # raw TeX
+    r'|(?:[A-Za-z]|[ivxlcdmIVXLCDM]+|#|@[\w-]*)[.)][ \t]'   # fancy / example list markers
+    r'|\((?:[A-Za-z]|[ivxlcdmIVXLCDM]+|[0-9]+|#|@[\w-]*)\)[ \t])', re.M)
+_STRAY_DELIMITERS = re.compile(r'\*|(?<![^\W_])_|_(?![^\W_])'
+                             r'|<(?:[A-Za-z][\w.+-]*:|[^\s<>]*@)')  # or autolinks pandoc accepts
+_YAML_BLOCK_START = re.compile(r'(?:\A|\n[ \t]*\n)---[ \t]*\n[ \t]*\S')
+
+# pandoc's default readerAbbreviations: a following space becomes a non-breaking one
+ABBREVIATIONS = frozenset((
+    'Mr.', 'Mrs.', 'Ms.', 'Capt.', 'Dr.', 'Prof.', 'Gen.', 'Gov.', 'e.g.', 'i.e.', 'Sgt.',
+    'St.', 'vol.', 'vs.', 'Sen.', 'Rep.', 'Pres.', 'Hon.', 'Rev.', 'Ph.D.', 'M.D.', 'M.A.',
+    'p.', 'pp.', 'ch.', 'sec.', 'cf.', 'cp.',
+))
+
+# Units of smart-punctuation parsing (pandoc's inline granularity)
+_UNIT = re.compile(r'(?P<str>(?:[^\W_]|\.(?!\.))+)|(?P<sp>[ \t]+)|(?P<ell>\.\.\.)'
+                   r'|(?P<dash>---?)|(?P<q>["\'])|(?P<sym>.)', re.S)
+
+
+def _unsupported_text(source: str, what: str) -> None:
+    text = _CODE_SPAN.sub('', source)
+    m = _UNSUPPORTED_INLINE.search(text) or _UNSUPPORTED_LINE.search(text)
+    if m:
+        raise UnsupportedMarkdown(f"{what}: {m.group(0).strip()!r}")
+
+
+def parse_attributes(spec: str) -> Optional[Dict[str, Any]]:
+    """Parse a pandoc ``{#id .class key=value}`` attribute block, or None if invalid."""
+    attrs: Dict[str, Any] = {'id': '', 'classes': [], 'kv': {}}
+    pos = 0
+    spec = spec.strip()
+    while pos < len(spec):
+        m = _ATTR_TOKEN.match(spec, pos)
+        if not m:
+            return None
+        ident, cls, key, dq, sq, bare, dash = m.groups()
+        if ident:
+            attrs['id'] = ident
+        elif cls:
+            attrs['classes'].append(cls)
+        elif key:
+            attrs['kv'][key] = next(v for v in (dq, sq, bare) if v is not None)
+        elif dash:
+            attrs['classes'].append('unnumbered')
+        pos = m.end()
+    return attrs
+
+
+def _pandoc_rules(state: Any) -> None:
+    """Core rule run before inline parsing: header attributes and task lists."""
+    tokens = state.tokens
+    for i, tok in enumerate(tokens):
+        if tok.type == 'heading_open':
+            inline = tokens[i + 1]
+            m = _HEADER_ATTRS.search(inline.content)
+            if m:
+                attrs = parse_attributes(m.group(1))
+                if attrs is None:
+                    raise UnsupportedMarkdown(f"header attributes {m.group(0).strip()!r}")
+                inline.content = inline.content[:m.start()].rstrip()
+                tok.meta['attrs'] = attrs
+        elif tok.type == 'list_item_open' and tokens[i + 1].type == 'paragraph_open':
+            inline = tokens[i + 2]
+            m = _TASK.match(inline.content)
+            if m:
+                box = '☐' if m.group(1) == ' ' else '☒'
+                inline.content = box + ' ' + inline.content[m.end():]
+
+
+def _list_rule(state: Any, start: int, end: int, silent: bool) -> bool:
+    # pandoc: a list interrupts a paragraph only when nested in another list item
+    if silent and state.listIndent < 0:
+        return False
+    return list_block(state, start, end, silent)
+
+
+def make_markdown_it() -> MarkdownIt:
+    """A markdown-it parser configured for pandoc's Markdown block structure."""
+    md = MarkdownIt('commonmark', {'html': True})
+    md.enable(['table', 'strikethrough'])
+    md.disable('text_join')  # keep escapes and entities apart: they are not smart-quoted
+    rules = {rule.name: rule for rule in md.block.ruler.__rules__}
+    for name in ('table', 'blockquote', 'hr', 'html_block', 'heading'):
+        rule = rules[name]
+        md.block.ruler.at(name, rule.fn, {'alt': [a for a in rule.alt if a != 'paragraph']})
+    md.block.ruler.at('list', _list_rule, {'alt': rules['list'].alt})
+    md.core.ruler.before('inline', 'pandoc', _pandoc_rules)
+    return md
+
+
+class _Converter:
+    """Builds the pandoc-shaped tree for one document."""
+
+    def __init__(self, md: MarkdownIt, lines: Sequence[str]):
+        self.md = md
+        self.lines = lines
+
+    # ---- blocks -------------------------------------------------------------
+    def blocks(self, tokens: List[Token], start: int, end: int, in_item: bool = False) -> List[Node]:
+        out: List[Node] = []
+        i = start
+        while i < end:
+            tok = tokens[i]
+            t = tok.type
+            if t == 'paragraph_open':
+                inline = tokens[i + 1]
+                _unsupported_text(inline.content, 'paragraph')
+                out.append(self.paragraph(tokens, i, in_item))
+                i += 3
+                continue
+            if t == 'heading_open':
+                inline = tokens[i + 1]
+                _unsupported_text(inline.content, 'header')
+                first, after = tok.map
+                if tok.markup in ('=', '-') and after - first > 2:
+                    raise UnsupportedMarkdown("multi-line setext header")
+                if tok.markup.startswith('#') and after < len(self.lines) \
+                        and _UNDERLINE.match(self.lines[after]):
+                    raise UnsupportedMarkdown("ATX header underlined as a setext header")
+                attrs = tok.meta.get('attrs') or {'kv': {}}
+                out.append(Node('Header', self.inlines(inline.children or []),
+                                level=int(tok.tag[1]),
+                                primary=attrs['kv'].get('primary', 'false').lower() == 'true'))
+                i += 3
+                continue
+            if t in ('fence', 'code_block'):
+                out.append(self.code(tok))
+            elif t == 'hr':
+                nxt = tokens[i + 1] if i + 1 < end else None
+                if nxt is not None and nxt.map and tok.map and nxt.map[0] == tok.map[1]:
+                    raise UnsupportedMarkdown("rule directly followed by text (pandoc table)")
+                out.append(Node('HorizontalRule'))
+            elif t == 'html_block':
+                text = tok.content.rstrip()
+                if not (text.startswith('<!--') and text.endswith('-->') and text.count('-->') == 1):
+                    raise UnsupportedMarkdown(f"raw HTML block {text[:30]!r}")
+                out.append(Node('RawBlock', text=text))
+            else:
+                close = self._close(tokens, i)
+                if t == 'blockquote_open':
+                    out.append(Node('BlockQuote', self.blocks(tokens, i + 1, close)))
+                elif t in ('bullet_list_open', 'ordered_list_open'):
+                    tag = 'BulletList' if t == 'bullet_list_open' else 'OrderedList'
+                    if out and out[-1].tag == tag:
+                        raise UnsupportedMarkdown("adjacent lists (pandoc merges them)")
+                    out.append(Node(tag, self.list_items(tokens, i + 1, close)))
+                elif t == 'table_open':
+                    out.append(self.table(tokens, i + 1, close))
+                else:
+                    raise UnsupportedMarkdown(f"unexpected token {t}")
+                i = close
+            i += 1
+        return out
+
+    @staticmethod
+    def _close(tokens: List[Token], i: int) -> int:
+        level = tokens[i].level
+        close = tokens[i].type[:-5] + '_close'
+        j = i + 1
+        while not (tokens[j].type == close and tokens[j].level == level):
+            j += 1
+        return j
+
+    def paragraph(self, tokens: List[Token], i: int, in_item: bool) -> Node:
+        inline = tokens[i + 1]
+        content = self.inlines(inline.children or [])
+        last_line = self.lines[tokens[i].map[1] - 1]
+        if last_line.endswith('\\'):
+            raise UnsupportedMarkdown("paragraph ending in a hard line break")
+        if len(content) == 1 and content[0].tag == 'Image' and content[0].content:
+            # implicit figure, also where the paragraph would be Plain
+            image = content[0]
+            return Node('Figure', [Node('Plain', [image]),
+                                   Node('Caption', [Node('Plain', image.content)])])
+        if in_item:
+            # pandoc: Para only when followed by a blank line or a fenced code block
+            end = tokens[i].map[1]
+            nxt = tokens[i + 3] if i + 3 < len(tokens) else None
+            para = (end >= len(self.lines) or _BLANK.match(self.lines[end]) is not None
+                    or (nxt is not None and nxt.type == 'fence' and nxt.map[0] == end))
+            if not para:
+                if last_line.endswith('  '):
+                    raise UnsupportedMarkdown("list item ending in a hard line break")
+                return Node('Plain', content)
+        return Node('Para', content)
+
+    def code(self, tok: Token) -> Node:
+        text = tok.content[:-1] if tok.content.endswith('\n') else tok.content
+        lang = ''
+        if tok.type == 'code_block':
+            text = text.rstrip('\n')
+        else:
+            start, end = tok.map
+            closing = self.lines[end - 1].lstrip(' >').strip() if end - start >= 2 else ''
+            if not (closing.startswith(tok.markup) and closing == closing[0] * len(closing)):
+                raise UnsupportedMarkdown("unclosed code fence")
+            info = tok.info.strip()
+            if info.startswith('{') and info.endswith('}'):
+                attrs = parse_attributes(info[1:-1])
+                if attrs is None:
+                    raise UnsupportedMarkdown(f"code attributes {info!r}")
+                lang = attrs['classes'][0] if attrs['classes'] else ''
+            elif info:
+                if len(info.split()) != 1 or '{' in info:
+                    raise UnsupportedMarkdown(f"code info string {info!r}")
+                lang = info
+        return Node('CodeBlock', text=text, lang=lang)
+
+    def list_items(self, tokens: List[Token], start: int, end: int) -> List[Node]:
+        items: List[List[Node]] = []
+        i = start
+        while i < end:
+            close = self._close(tokens, i)  # list_item_open .. list_item_close
+            items.append(self.blocks(tokens, i + 1, close, in_item=True))
+            i = close + 1
+        _compactify(items)
+        return [Node('ListItem', blocks) for blocks in items]
+
+    def table(self, tokens: List[Token], start: int, end: int) -> Node:
+        sections: List[Node] = []
+        rows: List[Node] = []
+        cells: List[Node] = []
+        for tok in tokens[start:end]:
+            if tok.type == 'inline':
+                _unsupported_text(tok.content, 'table cell')
+                content = self.inlines(tok.children or [])
+                cells.append(Node('TableCell', [Node('Plain', content)] if content else []))
+            elif tok.type == 'tr_close':
+                rows.append(Node('TableRow', cells))
+                cells = []
+            elif tok.type in ('thead_close', 'tbody_close'):
+                sections.append(Node('TableHead' if tok.type == 'thead_close' else 'TableBody', rows))
+                rows = []
+        return Node('Table', sections)
+
+    # ---- inlines ------------------------------------------------------------
+    def inlines(self, children: List[Token], context: Optional[str] = None,
+                closed: bool = False) -> List[Node]:
+        """Convert one level of markdown-it inline tokens, applying smart punctuation.
+
+        ``context`` is the enclosing quote (``'`` or ``"``), which cannot open
+        again; ``closed`` means a closing delimiter (``*``, ``]``) follows.
+        """
+        units: List[Tuple[str, Any]] = []
+        i = 0
+        n = len(children)
+        while i < n:
+            tok = children[i]
+            t = tok.type
+            if t == 'text':
+                if _STRAY_DELIMITERS.search(tok.content):
+                    # delimiters CommonMark left unmatched that pandoc may pair up
+                    raise UnsupportedMarkdown(f"unmatched delimiters in {tok.content!r}")
+                for m in _UNIT.finditer(tok.content):
+                    kind = m.lastgroup
+                    units.append((kind, m.group(kind)))
+            elif t == 'text_special':
+                if ' ' in tok.content:
+                    raise UnsupportedMarkdown(f"escaped space {tok.markup!r}")
+                units.append(('lit', tok.content))
+            elif t in ('softbreak', 'hardbreak'):
+                units.append(('br', ' '))
+            elif t == 'code_inline':
+                units.append(('node', Node('Code', text=tok.content.strip())))
+            elif t == 'html_inline':
+                units.append(('node', Node('RawInline', text=tok.content)))
+            elif t == 'image':
+                url = tok.attrGet('src') or ''
+                if not _SAFE_URL.match(url):
+                    raise UnsupportedMarkdown(f"image URL {url!r}")
+                units.append(('span', ('Image', tok.children or [], url)))
+            elif t.endswith('_open'):
+                depth = 1
+                j = i + 1
+                close = t[:-5] + '_close'
+                while True:
+                    if children[j].type == t:
+                        depth += 1
+                    elif children[j].type == close:
+                        depth -= 1
+                        if depth == 0:
+                            break
+                    j += 1
+                inner = children[i + 1:j]
+                if any(c.type == t and c.markup == tok.markup for c in inner) and t != 'link_open':
+                    raise UnsupportedMarkdown(f"nested {tok.markup} emphasis")
+                if t == 'link_open' and tok.markup == 'autolink':
+                    text = ''.join(c.content for c in inner)
+                    if not _SAFE_URL.match(text):
+                        raise UnsupportedMarkdown(f"autolink {text!r}")
+                    units.append(('node', Node('Link', [Node('Str', text=text)])))
+                else:
+                    tag = {'em_open': 'Emph', 'strong_open': 'Strong', 's_open': 'Strikeout',
+                           'link_open': 'Link'}.get(t)
+                    if tag is None:
+                        raise UnsupportedMarkdown(f"unexpected inline token {t}")
+                    units.append(('span', (tag, inner, None)))
+                i = j
+            else:
+                raise UnsupportedMarkdown(f"unexpected inline token {t}")
+            i += 1
+        nodes, _, _ = _Smart(self, units, closed).sequence(0, None, context)
+        return _trim(nodes)
+
+    # ---- metadata -----------------------------------------------------------
+    def meta_value(self, value: Any) -> Node:
+        if isinstance(value, bool):
+            return Node('MetaBool')
+        if value is None:
+            return Node('MetaString', text='')
+        if isinstance(value, _Number):
+            return Node('MetaInlines', [Node('Str', text=_number_text(value))])
+        if isinstance(value, str):
+            if value.endswith('\n'):
+                return Node('MetaBlocks', parse_blocks(self.md, value))
+            if '\n' in value:
+                raise UnsupportedMarkdown("metadata string with line breaks")
+            _unsupported_text(value, 'metadata')
+            tokens = self.md.parseInline(value)
+            return Node('MetaInlines', self.inlines(tokens[0].children or []) if tokens else [])
+        if isinstance(value, list):
+            return Node('MetaList', [self.meta_value(v) for v in value])
+        if isinstance(value, dict):
+            return Node('MetaMap', [self.meta_value(v) for _, v in _meta_items(value)])
+        raise UnsupportedMarkdown(f"metadata value of type {type(value).__name__}")
+
+
+def _meta_items(mapping: Dict[Any, Any]) -> List[Tuple[str, Any]]:
+    """Key-sorted items, as in pandoc's JSON; keys ending in ``_`` are ignored."""
+    if not all(isinstance(k, str) for k in mapping):
+        raise UnsupportedMarkdown("non-string metadata key")
+    return sorted((k, v) for k, v in mapping.items() if not k.endswith('_'))
+
+
+def _trim(nodes: List[Node]) -> List[Node]:
+    """pandoc's ``trimInlines``, on Str nodes that carry their spaces."""
+    if nodes and nodes[0].tag == 'Str' and nodes[0].text.startswith(' '):
+        nodes[0].text = nodes[0].text.lstrip(' ')
+        if not nodes[0].text:
+            del nodes[0]
+    if nodes and nodes[-1].tag == 'Str' and nodes[-1].text.endswith(' '):
+        nodes[-1].text = nodes[-1].text.rstrip(' ')
+        if not nodes[-1].text:
+            del nodes[-1]
+    return nodes
+
+
+def _compactify(items: List[List[Node]]) -> None:
+    """pandoc's ``compactify``: final Para to Plain if the list has no other
+    Para, otherwise every item's Plain blocks become Para."""
+    if not items:
+        return
+    final = items[-1]
+    paras = [b for item in items for b in item if b.tag == 'Para']
+    if final and final[-1].tag == 'Para' and paras == [final[-1]]:
+        final[-1].tag = 'Plain'
+    elif paras:
+        for item in items:
+            for block in item:
+                if block.tag == 'Plain':
+                    block.tag = 'Para'
+
+
+class _Smart:
+    """pandoc's smart punctuation over one level of inline units.
+
+    A port of the Markdown reader's ``doubleQuoted``/``singleQuoted``/
+    ``apostrophe``/``dash``/``ellipses`` parsers and its abbreviation rule,
+    including when a quote may open (not right after a word, not before a
+    space) or close (a single quote not followed by a letter or digit).
+    """
+
+    def __init__(self, converter: _Converter, units: List[Tuple[str, Any]], closed: bool):
+        self.converter = converter
+        self.units = units
+        self.closed = closed
+
+    def _next_is(self, i: int, alnum: bool) -> bool:
+        """Does the unit after ``i`` start with a non-space (or, with
+        ``alnum``, an alphanumeric) character?"""
+        if i + 1 >= len(self.units):
+            return self.closed and not alnum
+        kind, value = self.units[i + 1]
+        if kind == 'span':
+            return not alnum
+        if kind == 'node':
+            return not alnum
+        if kind in ('sp', 'br'):
+            return False
+        return value[0].isalnum() if alnum else True
+
+    def sequence(self, i: int, stop: Optional[str],
+                 context: Optional[str]) -> Tuple[List[Node], int, bool]:
+        """Parse units from ``i`` inside quote ``context``; ``stop`` is the
+        closing quote being looked for. Returns ``(nodes, next_index, closed)``."""
+        units = self.units
+        out: List[Node] = []
+        buf: List[str] = []
+        after_str = False
+
+        def flush() -> None:
+            if buf:
+                out.append(Node('Str', text=''.join(buf)))
+                buf.clear()
+
+        start = i
+        while i < len(units):
+            kind, value = units[i]
+            if stop is not None and kind == 'q' and value == stop \
+                    and (stop == '"' or not self._next_is(i, alnum=True)):
+                # pandoc's many1Till: a quote cannot close before any content
+                flush()
+                return out, i + (stop == "'"), i > start
+            if kind == 'str':
+                if value in ABBREVIATIONS and i + 1 < len(units) and units[i + 1][0] == 'sp':
+                    buf.append(value + '\xa0')
+                    i += 2
+                    after_str = False
+                    continue
+                buf.append(value)
+                after_str = True
+            elif kind in ('sp', 'br'):
+                # Space, SoftBreak and LineBreak all stringify to ' ': keep them in the Str
+                buf.append(' ')
+                after_str = False
+            elif kind == 'q':
+                if not after_str and context != value and self._next_is(i, alnum=False):
+                    # An opening quote; if it never closes pandoc keeps just the
+                    # quote mark and parses on from the next unit
+                    contents, j, closed = self.sequence(i + 1, value, value)
+                    if closed:
+                        flush()
+                        out.append(Node('Quoted', _trim(contents)))
+                        i = j + 1 if value == '"' else j
+                    else:
+                        buf.append('“' if value == '"' else '’')
+                        i += 1
+                    after_str = False
+                    continue
+                buf.append('”' if value == '"' else '’')
+                after_str = False
+            elif kind == 'dash':
+                buf.append('—' if value == '---' else '–')
+                after_str = False
+            elif kind == 'ell':
+                buf.append('…')
+                after_str = False
+            elif kind in ('sym', 'lit'):
+                buf.append(value)
+                after_str = False
+            else:
+                flush()
+                if kind == 'span':
+                    tag, inner, url = value
+                    # link text is parsed on its own; emphasis continues into its closer
+                    content = self.converter.inlines(inner, context,
+                                                     closed=tag not in ('Link', 'Image'))
+                    value = Node(tag, content, url=url) if tag == 'Image' else Node(tag, content)
+                out.append(value)
+                # pandoc's emphasis closers count as the end of a word
+                after_str = value.tag in ('Emph', 'Strong')
+            i += 1
+        flush()
+        return out, i, False
+
+
+def parse_blocks(md: MarkdownIt, text: str) -> List[Node]:
+    """Parse Markdown ``text`` (no front matter) into pandoc-shaped blocks."""
+    if _YAML_BLOCK_START.search(text):
+        raise UnsupportedMarkdown("YAML metadata block inside the document")
+    converter = _Converter(md, text.split('\n'))
+    tokens = md.parse(text)
+    return converter.blocks(tokens, 0, len(tokens))
+
+
+def parse_document(text: str, md: Optional[MarkdownIt] = None
+                   ) -> Tuple[List[Tuple[str, Node]], List[Node]]:
+    """Return ``(metadata, blocks)``: key-sorted metadata values and body blocks."""
+    md = md or _default_md()
+    text = '\n'.join(line.expandtabs(4) for line in
+                     text.lstrip('﻿').replace('\r\n', '\n').replace('\r', '\n').split('\n'))
+    meta: List[Tuple[str, Node]] = []
+    m = _FRONT_MATTER.match(text)
+    if m:
+        try:
+            data = yaml.load(m.group(1) or '', Loader=_MetaLoader)
+        except yaml.YAMLError as e:
+            raise UnsupportedMarkdown(f"front matter: {e}") from e
+        if data is not None and not isinstance(data, dict):
+            raise UnsupportedMarkdown("front matter is not a mapping")
+        converter = _Converter(md, [])
+        meta = [(k, converter.meta_value(v)) for k, v in _meta_items(data or {})]
+        text = text[m.end():]
+    return meta, parse_blocks(md, text)
+
+
+_MD: Optional[MarkdownIt] = None
+
+
+def _default_md() -> MarkdownIt:
+    global _MD
+    if _MD is None:
+        _MD = make_markdown_it()
+    return _MD
+
+
+def convert(text: str, filename: str) -> Dict[str, Any]:
+    """JSON-LD for one Markdown document, as ``md2jsonld`` produces it from pandoc's AST.
+
+    Raises :class:`UnsupportedMarkdown` when the result could differ from pandoc's.
+    """
+    meta, blocks = parse_document(text)
+    md = MarkdownToJSONLD()
+    md.set_filename(filename or 'unknown')
+    # md2jsonld.prepare / process_frontmatter
+    for key, value in meta:
+        val = ([stringify(item) for item in value.content] if value.tag == 'MetaList'
+               else stringify(value))
+        camel_key = md.to_camel(key)
+        md.meta[camel_key] = val
+        md.meta[key] = val
+    md.new_section('Document Introduction', 1)
+    # pf.run_filter walks the metadata first, then the body
+    for _, value in meta:
+        _walk(value, False, False, False, md)
+    for block in blocks:
+        _walk(block, False, False, False, md)
+    return md.build()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+Columnar, memory-mapped store for chunk metadata.
+
+Replaces the pickled list of dicts (``metadata.pkl``) with a directory of
+flat files that are mmapped and decoded lazily, row by row:
+
+    metadata/
+      schema.json                format version and row count
+      ids.npy                    int64 FAISS id per row
+      sorted_ids.npy             ids in ascending order ...
+      sorted_rows.npy            ... and the row each one belongs to
+      text.idx.npy / text.bin    uint64 offsets + concatenated UTF-8 chunk text
+      attrs.idx.npy / attrs.bin  uint64 offsets + one compact JSON object per row
+      filters.json               optional: field -> value -> slice of filter_rows
+      filter_rows.npy            sorted int32 row numbers for every (field, value)
+
+Looking up the top-k search hits therefore touches only k rows, and every
+process serving the same index shares one copy in the page cache. The filter
+index maps document attributes (category, keywords, ...) to row sets, so a
+filtered search can hand FAISS the allowed ids up front.
+
+Convert an existing pickle-based index with:
+
+    python metadata_store.py convert index/
+"""
+import argparse
+import json
+import logging
+import pickle
+import shutil
+from array import array
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DIRNAME = 'metadata'
+LEGACY_FILENAME = 'metadata.pkl'
+
+
+class MetadataStoreError(Exception):
+    """Raised when a metadata store is missing or unreadable."""
+    pass
+
+
+# -----------------------------------------------------------------------------
+# Writing
+# -----------------------------------------------------------------------------
+class _ColumnWriter:
+    """Appends values to ``<name>.bin``; :meth:`close` writes their offsets."""
+
+    def __init__(self, directory: Path, name: str):
+        self.directory = directory
+        self.name = name
+        self._file = open(directory / f'{name}.bin', 'wb')
+        self._ends = array('Q')
+        self._size = 0
+
+    def append(self, value: bytes) -> None:
+        self._file.write(value)
+        self._size += len(value)
+        self._ends.append(self._size)
+
+    def close(self) -> None:
+        self._file.close()
+        offsets = np.zeros(len(self._ends) + 1, dtype='<u8')
+        offsets[1:] = np.array(self._ends, dtype='<u8')
+        np.save(self.directory / f'{self.name}.idx.npy', offsets)
+
+
+def filter_key(value: Any) -> str:
+    """Normalised form of an attribute value, as stored in the filter index."""
+    return str(value).strip().lower()
+
+
+class _FilterWriter:
+    """Collects the rows of every (field, value) pair; :meth:`write` saves the index."""
+
+    def __init__(self, fields: Sequence[str]):
+        self.postings: Dict[str, Dict[str, array]] = {f: {} for f in fields}
+
+    def add(self, pos: int, row: Dict[str, Any]) -> None:
+        for f, values in self.postings.items():
+            value = row.get(f)
+            for v in (value if isinstance(value, (list, tuple)) else [value]):
+                key = filter_key(v) if v is not None else ''
+                if key:
+                    rows = values.get(key)
+                    if rows is None:
+                        rows = values[key] = array('i')
+                    if not rows or rows[-1] != pos:
+                        rows.append(pos)
+
+    def write(self, directory: Path) -> None:
+        spans: Dict[str, Dict[str, List[int]]] = {}
+        chunks: List[array] = []
+        offset = 0
+        for f, values in self.postings.items():
+            spans[f] = {}
+            for key in sorted(values):
+                spans[f][key] = [offset, offset + len(values[key])]
+                chunks.append(values[key])
+                offset += len(values[key])
+        flat = np.concatenate([np.array(c, dtype='int32') for c in chunks]) if chunks \
+            else np.zeros(0, dtype='int32')
+        np.save(directory / 'filter_rows.npy', flat)
+        (directory / 'filters.json').write_text(
+            json.dumps({'fields': spans}, ensure_ascii=False), encoding='utf-8')
+
+
+def write_metadata(
+    index_dir: Path,
+    rows: Iterable[Dict[str, Any]],
+    filter_fields: Sequence[str] = (),
+) -> None:
+    """Write ``rows`` as a columnar store under ``index_dir/metadata``.
+
+    Rows without an ``id`` are keyed by their position, which is what a
+    FAISS index without an id map returns from ``search()``. For every
+    name in ``filter_fields`` a value -> rows index is written as well.
+    ``rows`` is consumed once, row by row, so it may be a generator over
+    more rows than fit in memory.
+    """
+    target = index_dir / DIRNAME
+    staging = index_dir / f'{DIRNAME}.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    row_ids = array('q')
+    text = _ColumnWriter(staging, 'text')
+    attrs = _ColumnWriter(staging, 'attrs')
+    filters = _FilterWriter(filter_fields) if filter_fields else None
+    try:
+        for pos, r in enumerate(rows):
+            row_ids.append(r.get('id', pos))
+            text.append(r.get('text', '').encode('utf-8'))
+            attrs.append(json.dumps({k: v for k, v in r.items() if k not in ('id', 'text')},
+                                    ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+            if filters is not None:
+                filters.add(pos, r)
+    finally:
+        text.close()
+        attrs.close()
+    ids = np.array(row_ids, dtype='int64')
+    order = np.argsort(ids, kind='stable')
+    np.save(staging / 'ids.npy', ids)
+    np.save(staging / 'sorted_ids.npy', ids[order])
+    np.save(staging / 'sorted_rows.npy', order.astype('int64'))
+    if filters is not None:
+        filters.write(staging)
+    (staging / 'schema.json').write_text(
+        json.dumps({'version': FORMAT_VERSION, 'rows': len(ids)}), encoding='utf-8')
+
+    # Swap directories; readers holding mmaps of the old files keep them alive.
+    old = index_dir / f'{DIRNAME}.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        target.rename(old)
+    staging.rename(target)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+class _Column:
+    """Lazily decoded variable-length byte column."""
+
+    def __init__(self, directory: Path, name: str):
+        self.offsets = np.load(directory / f'{name}.idx.npy', mmap_mode='r')
+        path = directory / f'{name}.bin'
+        self.blob = np.memmap(path, dtype='uint8', mode='r') if path.stat().st_size else b''
+
+    def __getitem__(self, row: int) -> bytes:
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        return bytes(self.blob[start:end])
+
+
+class FilterIndex:
+    """Attribute value -> row set lookups over a store's ``filters.json``.
+
+    A filter maps field names to one value or a list of values; rows must
+    match every field and any of that field's values.
+    """
+
+    def __init__(self, directory: Path, ids: np.ndarray):
+        self.fields: Dict[str, Dict[str, List[int]]] = json.loads(
+            (directory / 'filters.json').read_text(encoding='utf-8'))['fields']
+        self._rows = np.load(directory / 'filter_rows.npy', mmap_mode='r')
+        self._ids = ids
+
+    def values(self, field: str) -> List[str]:
+        return list(self.fields.get(field, {}))
+
+    def rows(self, filters: Mapping[str, Union[str, Sequence[str]]]) -> np.ndarray:
+        """Sorted row numbers matching ``filters``."""
+        result: Optional[np.ndarray] = None
+        for field, wanted in filters.items():
+            if field not in self.fields:
+                raise ValueError(f"Unknown filter field {field!r}; "
+                                 f"expected one of {sorted(self.fields)}")
+            values = [wanted] if isinstance(wanted, str) else list(wanted)
+            spans = [self.fields[field].get(filter_key(v)) for v in values]
+            parts = [self._rows[s:e] for s, e in (sp for sp in spans if sp)]
+            matched = np.unique(np.concatenate(parts)) if len(parts) > 1 else \
+                np.asarray(parts[0]) if parts else np.empty(0, dtype='int32')
+            result = matched if result is None else \
+                np.intersect1d(result, matched, assume_unique=True)
+            if not len(result):
+                break
+        return result if result is not None else np.arange(len(self._ids), dtype='int32')
+
+    def ids(self, filters: Mapping[str, Union[str, Sequence[str]]]) -> np.ndarray:
+        """FAISS ids of the rows matching ``filters``."""
+        return np.asarray(self._ids[self.rows(filters)], dtype='int64')
+
+
+def parse_filters(expr: str) -> Dict[str, List[str]]:
+    """Parse ``"category=security; keywords=gnmi,evpn"`` into a filter mapping."""
+    filters: Dict[str, List[str]] = {}
+    for clause in expr.split(';'):
+        if not clause.strip():
+            continue
+        field, sep, values = clause.partition('=')
+        if not sep or not field.strip():
+            raise ValueError(f"Bad filter clause {clause.strip()!r}; expected field=value[,value]")
+        filters.setdefault(field.strip(), []).extend(
+            v.strip() for v in values.split(',') if v.strip())
+    return filters
+
+
+class ColumnarMetadata:
+    """Read-only, mmapped view of a store written by :func:`write_metadata`."""
+
+    def __init__(self, index_dir: Path):
+        self.directory = index_dir / DIRNAME
+        try:
+            schema = json.loads((self.directory / 'schema.json').read_text(encoding='utf-8'))
+            if schema.get('version') != FORMAT_VERSION:
+                raise MetadataStoreError(f"Unsupported metadata format: {schema.get('version')}")
+            self._rows = int(schema['rows'])
+            self.ids = np.load(self.directory / 'ids.npy', mmap_mode='r')
+            self._sorted_ids = np.load(self.directory / 'sorted_ids.npy', mmap_mode='r')
+            self._sorted_rows = np.load(self.directory / 'sorted_rows.npy', mmap_mode='r')
+            self._text = _Column(self.directory, 'text')
+            self._attrs = _Column(self.directory, 'attrs')
+            self.filters: Optional[FilterIndex] = FilterIndex(self.directory, self.ids) \
+                if (self.directory / 'filters.json').is_file() else None
+        except (OSError, ValueError, KeyError) as e:
+            raise MetadataStoreError(f"Cannot open metadata store {self.directory}: {e}") from e
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        if not 0 <= row < self._rows:
+            raise IndexError(row)
+        chunk = json.loads(self._attrs[row])
+        chunk['id'] = int(self.ids[row])
+        chunk['text'] = self._text[row].decode('utf-8')
+        return chunk
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for row in range(self._rows):
+            yield self[row]
+
+    def row_for_id(self, idx: int) -> Optional[int]:
+        pos = int(np.searchsorted(self._sorted_ids, idx))
+        if pos < len(self._sorted_ids) and self._sorted_ids[pos] == idx:
+            return int(self._sorted_rows[pos])
+        return None
+
+    def get(self, idx: int) -> Optional[Dict[str, Any]]:
+        """Return the chunk for a FAISS search result id, if known."""
+        row = self.row_for_id(int(idx))
+        return self[row] if row is not None else None
+
+
+class ListMetadata:
+    """Same interface over a legacy in-memory ``metadata.pkl`` list."""
+
+    filters: Optional[FilterIndex] = None
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self._list = rows
+        self._by_id: Optional[Dict[int, int]] = None
+        if rows and 'id' in rows[0]:
+            self._by_id = {r['id']: pos for pos, r in enumerate(rows)}
+
+    def __len__(self) -> int:
+        return len(self._list)
+
+    def __getitem__(self, row: int) -> Dict[str, Any]:
+        return self._list[row]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._list)
+
+    def get(self, idx: int) -> Optional[Dict[str, Any]]:
+        if self._by_id is not None:
+            row = self._by_id.get(int(idx))
+        else:
+            row = int(idx) if 0 <= idx < len(self._list) else None
+        return self._list[row] if row is not None else None
+
+
+MetadataStore = Union[ColumnarMetadata, ListMetadata]
+
+
+def has_metadata(index_dir: Path) -> bool:
+    return (index_dir / DIRNAME / 'schema.json').is_file() or \
+        (index_dir / LEGACY_FILENAME).is_file()
+
+
+def open_metadata(index_dir: Path) -> MetadataStore:
+    """Open the columnar store, falling back to a legacy ``metadata.pkl``."""
+    if (index_dir / DIRNAME / 'schema.json').is_file():
+        return ColumnarMetadata(index_dir)
+    legacy = index_dir / LEGACY_FILENAME
+    if legacy.is_file():
+        logger.warning("Loading legacy %s into memory; run 'python metadata_store.py "
+                       "convert %s' to switch to the mmapped store", legacy, index_dir)
+        with open(legacy, 'rb') as f:
+            return ListMetadata(pickle.load(f))
+    raise MetadataStoreError(f"No metadata found in {index_dir}")
+
+
+def convert(index_dir: Path, remove_legacy: bool = False) -> int:
+    """Convert ``index_dir/metadata.pkl`` into the columnar store."""
+    legacy = index_dir / LEGACY_FILENAME
+    with open(legacy, 'rb') as f:
+        rows = pickle.load(f)
+    write_metadata(index_dir, rows)
+    if remove_legacy:
+        legacy.unlink()
+    logger.info("Converted %d rows from %s", len(rows), legacy)
+    return len(rows)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Manage the columnar chunk metadata store.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    conv = sub.add_parser('convert', help="Convert a metadata.pkl index to the columnar store")
+    conv.add_argument('index_dir', type=Path)
+    conv.add_argument('--remove-pkl', action='store_true', help="Delete metadata.pkl afterwards")
+    args = parser.parse_args()
+    if args.command == 'convert':
+        convert(args.index_dir, remove_legacy=args.remove_pkl)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Micro-batching of concurrent requests.
+
+Callers in many threads submit single items; one background thread collects
+whatever arrives within ``max_wait_ms`` of the first item (up to
+``max_batch_size`` items) and hands the whole list to ``fn`` in one call.
+The chat server uses it so that concurrent users share one encoder forward
+pass and one multi-row FAISS search instead of paying for one each.
+"""
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+_STOP = object()
+
+
+class MicroBatcher(Generic[T, R]):
+    """Run ``fn(items) -> results`` over batches of concurrently submitted items.
+
+    ``fn`` must return one result per item, in order. If it raises, every
+    caller in that batch gets the exception.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[T]], List[R]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 2.0,
+        name: str = 'micro-batcher',
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue: 'queue.Queue[Any]' = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Public API
+    # ------------------------------------------------------------------
+    def submit(self, item: T, timeout: Optional[float] = None) -> R:
+        """Block until ``item``'s batch has run and return its result."""
+        return self.submit_future(item).result(timeout)
+
+    async def asubmit(self, item: T) -> R:
+        """Awaitable variant of :meth:`submit` for event-loop callers."""
+        return await asyncio.wrap_future(self.submit_future(item))
+
+    def submit_future(self, item: T) -> 'Future[R]':
+        if self._closed:
+            raise RuntimeError(f"{self.name} is closed")
+        future: 'Future[R]' = Future()
+        self._queue.put((item, future))
+        return future
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+        }
+
+    def close(self) -> None:
+        """Stop the worker after the requests already queued have been served."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    # ------------------------------------------------------------------
+    # Worker
+    # ------------------------------------------------------------------
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch: List[Tuple[T, 'Future[R]']] = [first]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 \
+                        else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            self._serve(batch)
+            # Drop the served items before blocking on the queue, so whatever
+            # they reference (e.g. a superseded index snapshot) can be freed.
+            first = nxt = batch = None
+
+    def _serve(self, batch: List[Tuple[T, 'Future[R]']]) -> None:
+        self.batches += 1
+        self.items += len(batch)
+        try:
+            results = self.fn([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"{self.name}: fn returned {len(results)} results "
+                                   f"for {len(batch)} items")
+        except Exception as e:
+            logger.error("%s: batch of %d failed: %s", self.name, len(batch), e)
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
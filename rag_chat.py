@@ -3,18 +3,55 @@
 RAG Chat Interface using Gradio.
 This script loads the pre-built FAISS index and provides a chat interface
 for querying design documents with semantic search and LLM synthesis.
+
+Heavy dependencies (gradio, faiss, sentence-transformers, openai) are
+imported where they are first used, so the web server binds right away and
+the model, index and UI load in background threads; ``/readyz`` reports
+when they are warm.
 """
 import os
+import argparse
+import asyncio
+import contextvars
+import functools
+import hashlib
+import hmac
+import importlib
+import ipaddress
+import json
 import logging
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
 from pathlib import Path
-from typing import List, Dict, Any, Tuple, Protocol
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    TYPE_CHECKING, List, Dict, Any, AsyncIterator, Callable, Deque, Iterator, Mapping,
+    Optional, Sequence, Tuple, Protocol, Union
+)
 
-import gradio as gr
-import faiss
-import pickle
+import numpy as np
 import requests
-from sentence_transformers import SentenceTransformer
-import openai
+
+if TYPE_CHECKING:
+    import faiss
+
+from answer_cache import AnswerCache, normalize_query
+from embedders import DEFAULT_ONNX_DIR, embedder_name, load_embedder
+from embedding_cache import EmbeddingCache
+from index_versions import current_version, resolve_index_dir
+import instrumentation
+from instrumentation import instrumented, timed
+from metadata_store import (
+    MetadataStore, MetadataStoreError, filter_key, has_metadata, open_metadata, parse_filters
+)
+from micro_batcher import MicroBatcher
+from shards import is_sharded, read_info, shard_dirs
+from token_count import approx_token_count
+from sparse_index import SparseIndex, SparseIndexError, open_sparse_index, reciprocal_rank_fusion
 
 # -----------------------------------------------------------------------------
 # Configure logging
@@ -48,6 +85,16 @@ class LLMClient(Protocol):
     def generate(self, system_prompt: str, user_prompt: str) -> str:
         ...
 
+    def stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        """Yield the completion incrementally as text deltas."""
+        ...
+
+def _messages(system_prompt: str, user_prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user",   "content": user_prompt},
+    ]
+
 # -----------------------------------------------------------------------------
 # Concrete LLM Clients
 # -----------------------------------------------------------------------------
@@ -57,15 +104,13 @@ class OpenAIClient:
         openai.api_key = api_key
         self.model = model
 
+    @instrumented("llm.generate")
     def generate(self, system_prompt: str, user_prompt: str) -> str:
         import openai
         try:
             resp = openai.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user",   "content": user_prompt},
-                ],
+                messages=_messages(system_prompt, user_prompt),
                 max_tokens=1000,
                 temperature=0.7,
             )
@@ -74,25 +119,122 @@ class OpenAIClient:
             logger.error("OpenAI API call failed: %s", e)
             raise LLMClientError("OpenAI generation error") from e
 
+    @instrumented("llm.stream")
+    def stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        import openai
+        try:
+            resp = openai.chat.completions.create(
+                model=self.model,
+                messages=_messages(system_prompt, user_prompt),
+                max_tokens=1000,
+                temperature=0.7,
+                stream=True,
+            )
+            for event in resp:
+                if event.choices and event.choices[0].delta.content:
+                    yield event.choices[0].delta.content
+        except Exception as e:
+            logger.error("OpenAI streaming call failed: %s", e)
+            raise LLMClientError("OpenAI generation error") from e
+
+
+_STREAM_DONE = object()
+
+
+def parse_stream_line(line: str) -> Any:
+    """Extract the text delta from one line of a streamed chat completion.
+
+    Handles OpenAI-style server-sent events (``data: {...}`` / ``data: [DONE]``)
+    as well as newline-delimited JSON as emitted by Ollama's native API.
+    Returns ``_STREAM_DONE`` at the end of the stream and "" for lines that
+    carry no text (keep-alives, comments, role-only deltas).
+    """
+    line = line.strip()
+    if not line or line.startswith(':'):
+        return ""
+    if line.startswith('data:'):
+        line = line[5:].strip()
+    if line == '[DONE]':
+        return _STREAM_DONE
+    try:
+        data = json.loads(line)
+    except json.JSONDecodeError:
+        logger.debug("Ignoring unparsable stream line: %r", line[:80])
+        return ""
+    if data.get("choices"):
+        choice = data["choices"][0]
+        text = (choice.get("delta") or choice.get("message") or {}).get("content") or ""
+        return text
+    if "message" in data:
+        text = data["message"].get("content") or ""
+        return _STREAM_DONE if data.get("done") and not text else text
+    return _STREAM_DONE if data.get("done") else ""
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
 class LocalLLMClient:
-    """Client for local LLM endpoint (e.g., Ollama, LocalAI)."""
-    def __init__(self, url: str, model: str) -> None:
+    """Client for local LLM endpoint (e.g., Ollama, LocalAI).
+
+    Sync calls share a pooled keep-alive ``requests.Session`` with bounded
+    retries and exponential backoff; the async variants use a lazily created
+    ``httpx.AsyncClient`` with the same pool size, timeouts and retry policy.
+    """
+    def __init__(
+        self,
+        url: str,
+        model: str,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 30.0,
+        max_retries: int = 2,
+        backoff_factor: float = 0.5,
+    ) -> None:
         self.url = url.rstrip('/')
         self.model = model
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.session = self._make_session()
+        # One httpx.AsyncClient per event loop: its connections belong to that loop
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = \
+            weakref.WeakKeyDictionary()
+        self._async_lock = threading.Lock()
 
-    def generate(self, system_prompt: str, user_prompt: str) -> str:
-        payload = {
+    def _make_session(self) -> requests.Session:
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset({"POST"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=self.pool_size,
+                              pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _payload(self, system_prompt: str, user_prompt: str, stream: bool) -> Dict[str, Any]:
+        return {
             "model": self.model,
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            "stream": False,
+            "messages": _messages(system_prompt, user_prompt),
+            "stream": stream,
             "options": {"temperature": 0.7, "num_predict": 1000},
         }
+
+    @instrumented("llm.generate")
+    def generate(self, system_prompt: str, user_prompt: str) -> str:
+        payload = self._payload(system_prompt, user_prompt, stream=False)
         try:
-            resp = requests.post(f"{self.url}/chat/completions", json=payload, timeout=30)
+            resp = self.session.post(f"{self.url}/chat/completions", json=payload,
+                                     timeout=self.timeout)
             resp.raise_for_status()
             data = resp.json()
             return data["choices"][0]["message"]["content"].strip()
@@ -101,132 +243,1364 @@ class LocalLLMClient:
             logger.error("Local LLM connection failed: %s", e)
             raise LLMClientError("Local LLM generation error") from e
 
+    @instrumented("llm.stream")
+    def stream(self, system_prompt: str, user_prompt: str) -> Iterator[str]:
+        payload = self._payload(system_prompt, user_prompt, stream=True)
+        try:
+            with self.session.post(f"{self.url}/chat/completions", json=payload,
+                                   timeout=self.timeout, stream=True) as resp:
+                resp.raise_for_status()
+                # Decode ourselves: SSE responses often omit the charset and
+                # requests would then fall back to ISO-8859-1.
+                for raw in resp.iter_lines():
+                    delta = parse_stream_line(raw.decode("utf-8", errors="replace"))
+                    if delta is _STREAM_DONE:
+                        break
+                    if delta:
+                        yield delta
+        except requests.RequestException as e:
+            logger.error("Local LLM streaming failed: %s", e)
+            raise LLMClientError("Local LLM generation error") from e
+
+    def close(self) -> None:
+        self.session.close()
+
+    # ------------------------------------------------------------------
+    # Async variants
+    # ------------------------------------------------------------------
+    def _get_async_client(self) -> Any:
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            # A closed loop's client can no longer be awaited; dropping it lets
+            # its sockets be collected instead of lingering with the client.
+            for old in [l for l in self._async_clients if l.is_closed()]:
+                del self._async_clients[old]
+            client = self._async_clients.get(loop)
+            if client is None:
+                connect, read = self.timeout
+                client = httpx.AsyncClient(
+                    base_url=self.url,
+                    timeout=httpx.Timeout(read, connect=connect),
+                    # Connect errors are retried by the transport, status codes below.
+                    transport=httpx.AsyncHTTPTransport(
+                        retries=self.max_retries,
+                        limits=httpx.Limits(max_connections=self.pool_size,
+                                            max_keepalive_connections=self.pool_size),
+                    ),
+                )
+                self._async_clients[loop] = client
+        return client
+
+    async def _backoff(self, attempt: int, reason: Any) -> None:
+        delay = self.backoff_factor * (2 ** attempt)
+        logger.warning("Local LLM returned %s; retrying in %.2fs", reason, delay)
+        await asyncio.sleep(delay)
+
+    @instrumented("llm.generate")
+    async def agenerate(self, system_prompt: str, user_prompt: str) -> str:
+        import httpx
+
+        client = self._get_async_client()
+        payload = self._payload(system_prompt, user_prompt, stream=False)
+        try:
+            for attempt in range(self.max_retries + 1):
+                resp = await client.post("/chat/completions", json=payload)
+                if resp.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                    await self._backoff(attempt, resp.status_code)
+                    continue
+                resp.raise_for_status()
+                return resp.json()["choices"][0]["message"]["content"].strip()
+        except httpx.HTTPError as e:
+            logger.error("Local LLM connection failed: %s", e)
+            raise LLMClientError("Local LLM generation error") from e
+        raise LLMClientError("Local LLM generation error")  # unreachable
+
+    @instrumented("llm.stream")
+    async def astream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        import httpx
+
+        client = self._get_async_client()
+        payload = self._payload(system_prompt, user_prompt, stream=True)
+        try:
+            for attempt in range(self.max_retries + 1):
+                async with client.stream("POST", "/chat/completions", json=payload) as resp:
+                    if resp.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                        await self._backoff(attempt, resp.status_code)
+                        continue
+                    resp.raise_for_status()
+                    async for line in resp.aiter_lines():
+                        delta = parse_stream_line(line)
+                        if delta is _STREAM_DONE:
+                            break
+                        if delta:
+                            yield delta
+                    return
+        except httpx.HTTPError as e:
+            logger.error("Local LLM streaming failed: %s", e)
+            raise LLMClientError("Local LLM generation error") from e
+
+    async def aclose(self) -> None:
+        """Close the async clients: this loop's here, other running loops' on their own loop."""
+        loop = asyncio.get_running_loop()
+        with self._async_lock:
+            clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        for client_loop, client in clients:
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+
 # -----------------------------------------------------------------------------
 # RAG System Components
 # -----------------------------------------------------------------------------
 class EmbeddingModel:
-    """Wrapper around SentenceTransformer."""
-    def __init__(self, model_name: str):
-        logger.info("Loading sentence transformer model: %s", model_name)
-        self.model = SentenceTransformer(model_name)
+    """Wrapper around SentenceTransformer with an optional persistent cache.
+
+    ``model`` replaces the SentenceTransformer for ``model_name`` (any object
+    with the same ``encode``/``get_sentence_embedding_dimension`` methods).
+    Otherwise the model is loaded with ``backend`` (see :mod:`embedders`);
+    the onnx backend runs each batch on ``threads`` threads.
+    """
+    def __init__(self, model_name: str, cache_dir: Optional[Path] = None,
+                 cache_size: int = 200_000, model: Optional[Any] = None,
+                 backend: str = "torch", quantize: bool = False,
+                 threads: Optional[int] = None, onnx_dir: Path = DEFAULT_ONNX_DIR):
+        cache_name = model_name
+        if model is None:
+            cache_name = embedder_name(model_name, backend, quantize)
+            model = load_embedder(model_name, backend=backend, quantize=quantize,
+                                  threads=threads, workers=1, cache_dir=onnx_dir)
+        self.model = model
+        self.cache: Optional[EmbeddingCache] = None
+        if cache_dir is not None:
+            dim = self.model.get_sentence_embedding_dimension()
+            self.cache = EmbeddingCache(cache_dir, cache_name, dim, max_entries=cache_size)
 
     def encode(self, texts: List[str]) -> Any:
+        if self.cache is not None:
+            return self.cache.encode(texts, self._encode)
+        return self._encode(texts)
+
+    def _encode(self, texts: List[str]) -> Any:
         return self.model.encode(texts, convert_to_numpy=True)
 
-class IndexStore:
-    """Handles FAISS index and associated metadata."""
+Filters = Mapping[str, Union[str, Sequence[str]]]
+
+def filters_key(filters: Optional[Filters]) -> Tuple:
+    """Canonical, hashable form of a filter mapping."""
+    return tuple(sorted(
+        (field, tuple(sorted({filter_key(v) for v in ([values] if isinstance(values, str)
+                                                       else values)})))
+        for field, values in (filters or {}).items()
+    ))
+
+class IndexSnapshot:
+    """One loaded index version: FAISS index, metadata and sparse postings.
+
+    A snapshot never changes after construction; :class:`IndexStore` swaps
+    whole snapshots when a new build is published.
+    """
+    MAX_CACHED_SELECTIONS = 128
+
     def __init__(self, index_dir: Path):
         self.index_dir = index_dir
-        self.index = self._load_faiss()
-        self.metadata = self._load_metadata()
+        self.version = index_dir.name
+        self.info = self._load_info()
+        self.search_params: Dict[str, int] = {}
+        self._selections: "OrderedDict[Tuple, Tuple[np.ndarray, faiss.IDSelector]]" = OrderedDict()
+        self._selections_lock = threading.Lock()
+        # name -> (perf_counter start, seconds, thread) of each loading step
+        self.load_times: Dict[str, Tuple[float, float, str]] = {}
+        # The FAISS file is read while the metadata and sparse index are opened.
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="faiss-load") as pool:
+            index = pool.submit(self._timed, "faiss", self._load_faiss)
+            self.metadata = self._timed("metadata", self._load_metadata)
+            self.sparse = self._timed("sparse", self._load_sparse)
+            self.index = index.result()
+        self.build_hash = self._build_hash()
+        finalizer = weakref.finalize(self, logger.info, "Released index version %s", self.version)
+        finalizer.atexit = False
+
+    def _build_hash(self) -> str:
+        """Identifies the loaded build; falls back to the index file's mtime/size."""
+        if self.info.get("build_hash"):
+            return self.info["build_hash"]
+        st = (self.index_dir / "faiss_index.bin").stat()
+        return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+    def _timed(self, name: str, load: Callable[[], Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return load()
+        finally:
+            self.load_times[name] = (start, time.perf_counter() - start,
+                                     threading.current_thread().name)
+
+    def _load_info(self) -> Dict[str, Any]:
+        info_path = self.index_dir / "info.json"
+        return json.loads(info_path.read_text(encoding="utf-8")) if info_path.exists() else {}
+
+    def get_chunk(self, idx: int) -> Optional[Dict[str, Any]]:
+        """Return the metadata for a FAISS search result id, if known."""
+        return self.metadata.get(idx)
+
+    def select(self, filters: Filters) -> Tuple[np.ndarray, "faiss.IDSelector"]:
+        """Return the metadata rows matching ``filters`` and a FAISS id
+        selector restricting a search to them.
+
+        Selections are cached, so repeated filters cost a dict lookup. Only
+        the selector is shared: :meth:`search` wraps it in fresh search
+        parameters on every call, because ``IndexIDMap`` swaps ``params.sel``
+        for a selector on its own stack while it searches.
+        """
+        key = filters_key(filters)
+        with self._selections_lock:
+            hit = self._selections.get(key)
+            if hit is not None:
+                self._selections.move_to_end(key)
+                return hit
+        index = getattr(self.metadata, "filters", None)
+        if index is None:
+            raise ValueError("This index has no filter index; rebuild it to use filters.")
+        import faiss
+        rows = index.rows(filters)
+        sel = faiss.IDSelectorBatch(index.ids(filters))
+        with self._selections_lock:
+            self._selections[key] = (rows, sel)
+            while len(self._selections) > self.MAX_CACHED_SELECTIONS:
+                self._selections.popitem(last=False)
+        logger.info("Filter %s matches %d chunks", dict(key), len(rows))
+        return rows, sel
+
+    def _search_params(self, sel: "faiss.IDSelector") -> "faiss.SearchParameters":
+        """Per-call parameters: the selector plus this index's nprobe/efSearch
+        (a SearchParameters object replaces the index-level settings)."""
+        import faiss
+        if "nprobe" in self.search_params:
+            params = faiss.SearchParametersIVF(sel=sel, nprobe=self.search_params["nprobe"])
+        elif "efSearch" in self.search_params:
+            params = faiss.SearchParametersHNSW(sel=sel, efSearch=self.search_params["efSearch"])
+        else:
+            params = faiss.SearchParameters(sel=sel)
+        params.selector_ref = sel  # SWIG does not keep the selector alive
+        return params
+
+    def search(
+        self, embs: np.ndarray, top_k: int, selection: Optional["Selection"] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """FAISS ``(distances, ids)`` of the ``top_k`` nearest chunks per row of ``embs``."""
+        if selection is None:
+            return self.index.search(embs, top_k)
+        return self.index.search(embs, top_k, params=self._search_params(selection[1]))
 
-    def _load_faiss(self) -> faiss.Index:
+    def search_sparse(
+        self, query: str, top_k: int, selection: Optional["Selection"] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25 ``(ids, scores)``, best first; empty for a build without postings."""
+        if self.sparse is None:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+        rows = selection[0] if selection is not None else None
+        return self.sparse.search(query, top_k, allowed_rows=rows)
+
+    def _load_faiss(self) -> "faiss.Index":
+        import faiss
         path = self.index_dir / "faiss_index.bin"
         if not path.exists():
             logger.error("FAISS index file missing: %s", path)
             raise IndexNotFoundError(f"Missing index file: {path}")
         logger.info("Loading FAISS index from %s", path)
-        idx = faiss.read_index(str(path))
+        # IVF indexes from streaming builds keep their inverted lists in faiss_index.ivfdata
+        idx = faiss.read_index(str(path), faiss.IO_FLAG_ONDISK_SAME_DIR)
+        self._apply_search_params(idx)
         logger.info("FAISS index loaded; total vectors=%d", idx.ntotal)
         return idx
 
-    def _load_metadata(self) -> List[Dict[str, Any]]:
-        path = self.index_dir / "metadata.pkl"
-        if not path.exists():
-            logger.error("Metadata file missing: %s", path)
-            raise IndexNotFoundError(f"Missing metadata file: {path}")
-        logger.info("Loading metadata from %s", path)
-        with open(path, 'rb') as f:
-            meta = pickle.load(f)
-        logger.info("Metadata loaded; total chunks=%d", len(meta))
+    def _apply_search_params(self, idx: "faiss.Index") -> None:
+        """Set nprobe/efSearch from info.json, overridable via FAISS_NPROBE / FAISS_EF_SEARCH."""
+        info = self.info
+        params = dict(info.get("search_params", {}))
+        for name, env in (("nprobe", "FAISS_NPROBE"), ("efSearch", "FAISS_EF_SEARCH")):
+            if os.getenv(env) and name in params:
+                params[name] = int(os.environ[env])
+        import faiss
+        for name, value in params.items():
+            faiss.ParameterSpace().set_index_parameter(idx, name, value)
+        self.search_params = params
+        logger.info("Index type=%s search params=%s", info.get("index_type", "flat"), params)
+
+    def _load_metadata(self) -> MetadataStore:
+        if not has_metadata(self.index_dir):
+            logger.error("Metadata missing in %s", self.index_dir)
+            raise IndexNotFoundError(f"Missing metadata in: {self.index_dir}")
+        logger.info("Opening metadata in %s", self.index_dir)
+        try:
+            meta = open_metadata(self.index_dir)
+        except MetadataStoreError as e:
+            raise IndexNotFoundError(str(e)) from e
+        logger.info("Metadata opened; total chunks=%d", len(meta))
         return meta
 
+    def _load_sparse(self) -> Optional[SparseIndex]:
+        try:
+            sparse = open_sparse_index(self.index_dir)
+        except SparseIndexError as e:
+            logger.warning("Ignoring unreadable sparse index: %s", e)
+            return None
+        if sparse is None:
+            logger.info("No sparse index in %s; rebuild to enable BM25/hybrid retrieval",
+                        self.index_dir)
+        else:
+            logger.info("Sparse index opened; terms=%d", len(sparse.vocab))
+        return sparse
+
+class _ShardedMetadata:
+    """Read-only view over the metadata stores of all shards."""
+
+    def __init__(self, shards: Sequence[IndexSnapshot]):
+        self._shards = shards
+
+    def __len__(self) -> int:
+        return sum(len(s.metadata) for s in self._shards)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for shard in self._shards:
+            yield from shard.metadata
+
+    def get(self, idx: int) -> Optional[Dict[str, Any]]:
+        for shard in self._shards:
+            chunk = shard.metadata.get(idx)
+            if chunk is not None:
+                return chunk
+        return None
+
+class ShardRouter:
+    """A sharded index version, searched by scatter-gather over its shards.
+
+    Each shard (see shards.py) is loaded as its own :class:`IndexSnapshot`,
+    in parallel. Searches run on every shard at once in a thread pool (FAISS
+    and the numpy BM25 kernels release the GIL), and the per-shard top-k
+    lists are merged into the global top-k: L2 distances come from the same
+    embedding space, and BM25 scores were computed with corpus-wide
+    statistics at build time, so both compare across shards as they are.
+    With exact (flat) shards the merged result equals an unsharded search.
+
+    A router offers the same ``select``/``search``/``search_sparse``/
+    ``get_chunk`` interface as a snapshot, and only calls that interface
+    on its shards, so it can stand in for an :class:`IndexSnapshot`.
+    """
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        self.version = index_dir.name
+        self.info = read_info(index_dir)
+        self.load_times: Dict[str, Tuple[float, float, str]] = {}
+        dirs = shard_dirs(index_dir)
+        self._pool = ThreadPoolExecutor(max_workers=len(dirs), thread_name_prefix="shard")
+        start = time.perf_counter()
+        try:
+            self.shards: List[IndexSnapshot] = list(self._pool.map(IndexSnapshot, dirs))
+        except BaseException:
+            self._pool.shutdown(wait=False)
+            raise
+        for shard in self.shards:
+            for name, timing in shard.load_times.items():
+                self.load_times[f"{shard.version} {name}"] = timing
+        self.metadata = _ShardedMetadata(self.shards)
+        # Non-None only when every shard has postings, like IndexSnapshot.sparse
+        self.sparse = [s.sparse for s in self.shards] \
+            if all(s.sparse is not None for s in self.shards) else None
+        self.build_hash = self.info.get("build_hash") or self.shards[0].build_hash
+        self._descending = self._similarity_metric()
+        logger.info("Loaded %d shards of %s (%s) in %.2fs", len(self.shards), self.version,
+                    self.info.get("shard_by", "doc"), time.perf_counter() - start)
+        finalizer = weakref.finalize(self, self._pool.shutdown, wait=False)
+        finalizer.atexit = False
+
+    def _similarity_metric(self) -> bool:
+        """True when larger FAISS scores are better (inner product), False for L2."""
+        import faiss
+        metrics = {getattr(s.index, "metric_type", faiss.METRIC_L2) for s in self.shards}
+        if len(metrics) > 1:
+            raise IndexNotFoundError(f"Shards of {self.index_dir} use different distance metrics")
+        return metrics.pop() == faiss.METRIC_INNER_PRODUCT
+
+    def get_chunk(self, idx: int) -> Optional[Dict[str, Any]]:
+        return self.metadata.get(idx)
+
+    def select(self, filters: Filters) -> Tuple[np.ndarray, List[Optional["Selection"]]]:
+        """Per-shard selections for ``filters``.
+
+        Returns the matching metadata rows of all shards concatenated (only
+        their count means anything across shards) and each shard's
+        selection, None for shards without matches, which searches skip.
+        """
+        selections = [s.select(filters) for s in self.shards]
+        return (np.concatenate([sel[0] for sel in selections]),
+                [sel if len(sel[0]) else None for sel in selections])
+
+    def _scatter(self, fn: Callable[[IndexSnapshot, Any], Any],
+                 selection: Optional[Tuple[np.ndarray, List[Optional["Selection"]]]]) -> List[Any]:
+        if selection is None:
+            targets = [(shard, None) for shard in self.shards]
+        else:
+            targets = [(shard, sel) for shard, sel in zip(self.shards, selection[1])
+                       if sel is not None]
+        if len(targets) == 1:
+            return [fn(*targets[0])]
+        return list(self._pool.map(lambda target: fn(*target), targets))
+
+    @instrumented("retrieve.shards")
+    def search(self, embs: np.ndarray, top_k: int,
+               selection: Optional[Tuple[np.ndarray, List[Optional["Selection"]]]] = None
+               ) -> Tuple[np.ndarray, np.ndarray]:
+        parts = self._scatter(lambda shard, sel: shard.search(embs, top_k, sel), selection)
+        if not parts:
+            return (np.full((len(embs), top_k), np.inf, dtype="float32"),
+                    np.full((len(embs), top_k), -1, dtype="int64"))
+        distances = np.hstack([d for d, _ in parts])
+        ids = np.hstack([i for _, i in parts])
+        # Missing results (-1) sort last whatever the metric
+        keys = np.where(ids == -1, np.inf, -distances if self._descending else distances)
+        order = np.argsort(keys, axis=1, kind="stable")[:, :top_k]
+        return np.take_along_axis(distances, order, 1), np.take_along_axis(ids, order, 1)
+
+    def search_sparse(self, query: str, top_k: int,
+                      selection: Optional[Tuple[np.ndarray, List[Optional["Selection"]]]] = None
+                      ) -> Tuple[np.ndarray, np.ndarray]:
+        parts = self._scatter(lambda shard, sel: shard.search_sparse(query, top_k, sel), selection)
+        ids = np.concatenate([i for i, _ in parts]) if parts else np.empty(0, dtype="int64")
+        scores = np.concatenate([s for _, s in parts]) if parts else np.empty(0, dtype="float32")
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return ids[order], scores[order]
+
+def open_snapshot(index_dir: Path) -> Union[IndexSnapshot, ShardRouter]:
+    """Load an index version: a :class:`ShardRouter` for sharded builds."""
+    return ShardRouter(index_dir) if is_sharded(index_dir) else IndexSnapshot(index_dir)
+
+class IndexStore:
+    """Serves the live :class:`IndexSnapshot` and hot-swaps new builds.
+
+    Reloading follows read-copy-update: the new version is loaded completely
+    on the side, then published by replacing one reference. Readers take
+    :meth:`snapshot` once per request and use it throughout, so in-flight
+    searches finish on the version they started with, and an old snapshot
+    (its FAISS index and mmaps) is freed when the last of them drops it.
+
+    ``index_dir`` is the directory ``build_index.py`` writes to; the live
+    version is the one its ``CURRENT`` pointer names (see index_versions.py).
+    Sharded versions are served through a :class:`ShardRouter`.
+    """
+    def __init__(self, index_dir: Path):
+        self.index_dir = index_dir
+        self._snapshot = open_snapshot(resolve_index_dir(index_dir))
+        self._reload_lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+        self.reloads = 0
+        self.last_reload_error: Optional[str] = None
+        self._failed_version: Optional[str] = None
+
+    def snapshot(self) -> Union[IndexSnapshot, ShardRouter]:
+        """The live snapshot; hold on to it for the duration of one request."""
+        return self._snapshot
+
+    # Convenience views of the live snapshot, for single-step callers.
+    @property
+    def version(self) -> str:
+        return self._snapshot.version
+
+    @property
+    def info(self) -> Dict[str, Any]:
+        return self._snapshot.info
+
+    @property
+    def index(self) -> "faiss.Index":
+        return self._snapshot.index
+
+    @property
+    def metadata(self) -> MetadataStore:
+        return self._snapshot.metadata
+
+    @property
+    def sparse(self) -> Optional[SparseIndex]:
+        return self._snapshot.sparse
+
+    @property
+    def build_hash(self) -> str:
+        return self._snapshot.build_hash
+
+    @property
+    def load_times(self) -> Dict[str, Tuple[float, float, str]]:
+        return self._snapshot.load_times
+
+    def get_chunk(self, idx: int) -> Optional[Dict[str, Any]]:
+        return self._snapshot.get_chunk(idx)
+
+    def reload(self) -> bool:
+        """Load and swap in the version ``CURRENT`` points at, if it is new.
+
+        Returns True when a new version was swapped in. If loading fails,
+        the live snapshot keeps serving and the error is raised.
+        """
+        with self._reload_lock:
+            target = resolve_index_dir(self.index_dir)
+            old = self._snapshot
+            if target == old.index_dir:
+                return False
+            start = time.perf_counter()
+            logger.info("Loading index version %s", target.name)
+            try:
+                new = open_snapshot(target)
+            except Exception as e:
+                self.last_reload_error = f"{type(e).__name__}: {e}"
+                self._failed_version = target.name
+                logger.error("Index reload failed; still serving %s: %s", old.version, e)
+                raise
+            if old.sparse is not None and new.sparse is None:
+                logger.warning("Index version %s has no sparse index; BM25 results will be empty",
+                               new.version)
+            self._snapshot = new
+            self.reloads += 1
+            self.last_reload_error = self._failed_version = None
+            logger.info("Swapped index %s -> %s (%d chunks) after %.2fs",
+                        old.version, new.version, len(new.metadata), time.perf_counter() - start)
+            return True
+
+    def start_watching(self, interval: float) -> None:
+        """Poll ``CURRENT`` every ``interval`` seconds and reload when it changes."""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name="index-watcher", daemon=True)
+        self._watcher.start()
+        logger.info("Watching %s for new index versions every %gs", self.index_dir, interval)
+
+    def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop_watching.wait(interval):
+            if current_version(self.index_dir) in (None, self._snapshot.version,
+                                                   self._failed_version):
+                continue
+            try:
+                self.reload()
+            except Exception:
+                pass  # logged by reload(); a later build or /admin/reload retries
+
+RETRIEVAL_MODES = ("dense", "sparse", "hybrid")
+
+Hit = Tuple[int, Dict[str, float]]
+Selection = Tuple[np.ndarray, "faiss.IDSelector"]
+
 class RetrievalService:
-    """Performs semantic search over the FAISS index."""
-    def __init__(self, embed_model: EmbeddingModel, store: IndexStore):
+    """Performs dense (FAISS), sparse (BM25) or hybrid search over the index.
+
+    Hybrid mode takes ``candidates`` hits from each retriever and fuses the
+    two rankings with reciprocal rank fusion. The default is dense, even
+    when the index has BM25 postings, so rebuilding an index does not change
+    ranking by itself.
+
+    With ``batch_size`` > 1, concurrent ``embed``/``retrieve`` calls are
+    micro-batched: requests arriving within ``batch_wait_ms`` of each other
+    share one encoder forward pass and one multi-row FAISS search.
+    """
+    def __init__(
+        self,
+        embed_model: EmbeddingModel,
+        store: IndexStore,
+        mode: Optional[str] = None,
+        candidates: int = 20,
+        rrf_k: int = 60,
+        batch_size: int = 0,
+        batch_wait_ms: float = 2.0,
+    ):
         self.embed_model = embed_model
         self.store = store
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        if not mode:
+            mode = "dense"
+            if store.sparse is not None:
+                logger.info("Index has BM25 postings; set RETRIEVAL_MODE=hybrid (or sparse) "
+                            "to use them")
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode {mode!r}; expected one of {RETRIEVAL_MODES}")
+        if mode != "dense" and store.sparse is None:
+            logger.warning("No sparse index in %s; falling back to dense retrieval", store.index_dir)
+            mode = "dense"
+        self.mode = mode
+        self._embed_batcher: Optional[MicroBatcher] = None
+        self._search_batcher: Optional[MicroBatcher] = None
+        if batch_size > 1:
+            self._embed_batcher = MicroBatcher(
+                self._embed_many, batch_size, batch_wait_ms, name="embed-batcher")
+            self._search_batcher = MicroBatcher(
+                self._search_many, batch_size, batch_wait_ms, name="search-batcher")
+        logger.info("Retrieval mode: %s (micro-batching %s)", self.mode,
+                    f"up to {batch_size} within {batch_wait_ms}ms" if batch_size > 1 else "off")
+
+    def embed(self, query: str) -> np.ndarray:
+        """Return the query embedding as a (1, dim) float32 array."""
+        with timed("retrieve.embed"):
+            if self._embed_batcher is not None:
+                return self._embed_batcher.submit(query)
+            return self.embed_batch([query])
+
+    @instrumented("retrieve.embed_batch")
+    def embed_batch(self, queries: Sequence[str]) -> np.ndarray:
+        """Return the embeddings of ``queries`` as an (n, dim) float32 array."""
+        return np.asarray(self.embed_model.encode(list(queries)), dtype='float32')
+
+    @instrumented("retrieve")
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 5,
+        embedding: Optional[np.ndarray] = None,
+        filters: Optional[Filters] = None,
+        snapshot: Optional[Union[IndexSnapshot, ShardRouter]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Search the index; ``filters`` (e.g. ``{"category": "security"}``) is
+        applied inside the FAISS and BM25 searches, not to their results.
+        Pass ``snapshot`` to search a version the caller already holds.
+        """
+        # one index version for the whole request
+        snap = snapshot if snapshot is not None else self.store.snapshot()
+        selection = snap.select(filters) if filters else None
+        if selection is not None and not len(selection[0]):
+            return []
+        dense = None
+        if self.mode != "sparse":
+            # Convert query to embedding, unless the caller already has it
+            emb = embedding if embedding is not None else self.embed(query)
+            dense = self._search(snap, emb, self._dense_k(top_k), filters, selection)
+        return self._results(snap, query, top_k, dense, selection)
+
+    @instrumented("retrieve.batch")
+    def retrieve_batch(
+        self,
+        queries: Sequence[str],
+        top_k: int = 5,
+        filters: Optional[Filters] = None,
+        embeddings: Optional[np.ndarray] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Like :meth:`retrieve` for many queries at once: the whole batch is
+        encoded in one forward pass and searched with one FAISS call.
+        """
+        queries = list(queries)
+        snap = self.store.snapshot()
+        selection = snap.select(filters) if filters else None
+        if not queries or (selection is not None and not len(selection[0])):
+            return [[] for _ in queries]
+        dense: List[Optional[List[Hit]]] = [None] * len(queries)
+        if self.mode != "sparse":
+            embs = embeddings if embeddings is not None else self.embed_batch(queries)
+            dense = self._dense_batch(snap, embs, self._dense_k(top_k), selection)
+        return [self._results(snap, q, top_k, d, selection) for q, d in zip(queries, dense)]
+
+    def close(self) -> None:
+        """Stop the micro-batching threads, if any."""
+        for batcher in (self._embed_batcher, self._search_batcher):
+            if batcher is not None:
+                batcher.close()
+
+    def batch_stats(self) -> Dict[str, Dict[str, float]]:
+        return {b.name: b.stats() for b in (self._embed_batcher, self._search_batcher)
+                if b is not None}
 
-    def retrieve(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        # Convert query to embedding
-        emb = self.embed_model.encode([query]).astype('float32')
-        distances, indices = self.store.index.search(emb, top_k)
+    def _dense_k(self, top_k: int) -> int:
+        return top_k if self.mode == "dense" else max(top_k, self.candidates)
+
+    def _results(
+        self, snap: IndexSnapshot, query: str, top_k: int, dense: Optional[List[Hit]],
+        selection: Optional[Selection],
+    ) -> List[Dict[str, Any]]:
+        if self.mode == "dense":
+            hits = dense[:top_k]
+        elif self.mode == "sparse":
+            hits = self._sparse(snap, query, top_k, selection)
+        else:
+            hits = self._fuse(dense, self._sparse(snap, query, self._dense_k(top_k), selection),
+                              top_k)
         results = []
-        for rank, (dist, idx) in enumerate(zip(distances[0], indices[0]), start=1):
-            if 0 <= idx < len(self.store.metadata):
-                chunk = dict(self.store.metadata[idx])
-                chunk.update(distance=float(dist), rank=rank)
+        for idx, scores in hits:
+            meta = snap.get_chunk(idx)
+            if meta is not None:
+                chunk = dict(meta)
+                chunk.update(scores, rank=len(results) + 1)
                 results.append(chunk)
         return results
 
+    @instrumented("retrieve.dense")
+    def _dense_batch(
+        self, snap: IndexSnapshot, embs: np.ndarray, top_k: int, selection: Optional[Selection]
+    ) -> List[List[Hit]]:
+        distances, indices = snap.search(embs, top_k, selection)
+        return [[(int(idx), {"distance": float(dist)}) for dist, idx in zip(d_row, i_row) if idx != -1]
+                for d_row, i_row in zip(distances, indices)]
+
+    def _search(
+        self, snap: IndexSnapshot, emb: np.ndarray, top_k: int, filters: Optional[Filters],
+        selection: Optional[Selection],
+    ) -> List[Hit]:
+        if self._search_batcher is not None:
+            return self._search_batcher.submit((snap, emb, top_k, filters_key(filters), selection))
+        return self._dense_batch(snap, emb, top_k, selection)[0]
+
+    def _embed_many(self, queries: List[str]) -> List[np.ndarray]:
+        embs = self.embed_batch(queries)
+        return [embs[i:i + 1] for i in range(len(queries))]
+
+    def _search_many(
+        self, requests: List[Tuple[IndexSnapshot, np.ndarray, int, Tuple, Optional[Selection]]]
+    ) -> List[List[Hit]]:
+        # One FAISS call per index version and distinct filter, searching to
+        # the largest k asked for.
+        groups: Dict[Tuple, List[int]] = {}
+        for i, (snap, _, _, key, _) in enumerate(requests):
+            groups.setdefault((id(snap), key), []).append(i)
+        out: List[List[Hit]] = [[] for _ in requests]
+        for members in groups.values():
+            snap, _, _, _, selection = requests[members[0]]
+            k = max(requests[i][2] for i in members)
+            embs = np.vstack([requests[i][1] for i in members])
+            for i, hits in zip(members, self._dense_batch(snap, embs, k, selection)):
+                out[i] = hits[:requests[i][2]]
+        return out
+
+    @instrumented("retrieve.sparse")
+    def _sparse(
+        self, snap: IndexSnapshot, query: str, top_k: int, selection: Optional[Selection] = None
+    ) -> List[Hit]:
+        # Empty for a reloaded version built without BM25 postings
+        ids, scores = snap.search_sparse(query, top_k, selection)
+        return [(int(idx), {"bm25": float(score)}) for idx, score in zip(ids, scores)]
+
+    @instrumented("retrieve.fuse")
+    def _fuse(self, dense: List[Hit], sparse: List[Hit], top_k: int) -> List[Hit]:
+        scores: Dict[int, Dict[str, float]] = {}
+        for idx, s in dense + sparse:
+            scores.setdefault(idx, {}).update(s)
+        fused = reciprocal_rank_fusion(
+            [[idx for idx, _ in dense], [idx for idx, _ in sparse]], k=self.rrf_k)
+        return [(idx, {**scores[idx], "rrf": score}) for idx, score in fused[:top_k]]
+
+def _chunk_id(chunk: Dict[str, Any]) -> Any:
+    """FAISS id of a retrieved chunk, or (filename, section) for legacy metadata."""
+    return chunk.get("id", (chunk.get("filename"), chunk.get("section_id")))
+
+def _text_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+
+class CrossEncoderReranker:
+    """Re-scores retrieved chunks with a cross-encoder and keeps the best ones.
+
+    The model is loaded on first use. Scores are cached per (normalised
+    query, chunk, chunk text digest), so a repeated or re-ranked question
+    only pays for the candidates it has not seen before. The digest keeps
+    an edited section (same FAISS id) from reusing its old score after a
+    reload.
+    """
+    def __init__(
+        self,
+        model_name: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        batch_size: int = 32,
+        cache_size: int = 50_000,
+    ):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._model: Any = None
+        self._lock = threading.Lock()
+        self._scores: "OrderedDict[Tuple[str, Any, bytes], float]" = OrderedDict()
+
+    @property
+    def model(self) -> Any:
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                logger.info("Loading cross-encoder model: %s", self.model_name)
+                self._model = CrossEncoder(self.model_name)
+            return self._model
+
+    @instrumented("rag.rerank")
+    def rerank(
+        self, query: str, chunks: List[Dict[str, Any]], top_k: int
+    ) -> List[Dict[str, Any]]:
+        """Return the ``top_k`` best of ``chunks`` by cross-encoder score."""
+        if not chunks:
+            return []
+        norm = normalize_query(query)
+        keys = [(norm, _chunk_id(c), _text_digest(c["text"])) for c in chunks]
+        scores: List[Optional[float]] = []
+        with self._lock:
+            for key in keys:
+                score = self._scores.get(key)
+                if score is not None:
+                    self._scores.move_to_end(key)
+                scores.append(score)
+            missing = [i for i, score in enumerate(scores) if score is None]
+            self.hits += len(chunks) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            pairs = [(query, chunks[i]["text"]) for i in missing]
+            fresh = self.model.predict(pairs, batch_size=self.batch_size)
+            with self._lock:
+                for i, score in zip(missing, fresh):
+                    scores[i] = float(score)
+                    self._scores[keys[i]] = float(score)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+        order = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)[:top_k]
+        results = []
+        for rank, i in enumerate(order, start=1):
+            chunk = dict(chunks[i])
+            chunk.update(rerank=scores[i], rank=rank)
+            results.append(chunk)
+        return results
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+async def _run_in(executor: Optional[ThreadPoolExecutor], fn: Callable[..., Any], *args: Any) -> Any:
+    """``await fn(*args)`` on ``executor``, carrying over the caller's context (trace span)."""
+    call = functools.partial(contextvars.copy_context().run, fn, *args)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+async def _aiter_in_thread(make_iter: Callable[[], Iterator[Any]],
+                           executor: Optional[ThreadPoolExecutor] = None) -> AsyncIterator[Any]:
+    """Drive a blocking iterator from a worker thread without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    def pump() -> None:
+        try:
+            for item in make_iter():
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, pump))
+    while True:
+        item = await queue.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+# -----------------------------------------------------------------------------
+# Context Assembly
+# -----------------------------------------------------------------------------
+def load_llm_token_counter(model_name: Optional[str]) -> Callable[[str], int]:
+    """Count tokens the way the target LLM does.
+
+    Uses tiktoken for OpenAI models and a Hugging Face tokenizer otherwise
+    (``model_name`` must then be a hub id or local path); falls back to an
+    estimate when neither can be loaded.
+    """
+    if not model_name:
+        return approx_token_count
+    try:
+        if model_name.startswith(("gpt-", "o1", "o3", "text-")):
+            import tiktoken
+            encoding = tiktoken.encoding_for_model(model_name)
+            return lambda text: len(encoding.encode(text))
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        logger.warning("Tokenizer for %s unavailable (%s); approximating token counts",
+                       model_name, e)
+        return approx_token_count
+
+def _shingles(text: str, n: int = 3) -> set:
+    words = text.lower().split()
+    return {tuple(words[i:i + n]) for i in range(max(1, len(words) - n + 1))}
+
+def _join_overlapping(head: str, tail: str, max_words: int = 256) -> str:
+    """Concatenate two neighbouring sub-chunks, dropping the text they share."""
+    a = head.split()
+    b = list(re.finditer(r"\S+", tail))
+    words = [w.group() for w in b]
+    for m in range(min(len(a), len(b), max_words), 0, -1):
+        if a[-m:] == words[:m]:
+            rest = tail[b[m - 1].end():].strip()
+            return f"{head.rstrip()} {rest}" if rest else head
+    return head.rstrip() + "\n\n" + tail.lstrip()
+
+class ContextBuilder:
+    """Assembles the prompt context from ranked chunks within a token budget.
+
+    Near-duplicate chunks (word-trigram Jaccard >= ``dedup_threshold``) are
+    dropped in favour of the better-ranked one, neighbouring sub-chunks of
+    the same section (same ``doc_id``, consecutive ``chunk_index``) are
+    merged with their overlap removed, and chunks are then added best-rank
+    first until ``max_tokens`` would be exceeded. If even the best chunk is
+    too long, it is truncated to fit.
+    """
+    SEPARATOR = "\n\n---\n\n"
+
+    def __init__(
+        self,
+        max_tokens: int = 2048,
+        count_tokens: Callable[[str], int] = approx_token_count,
+        dedup_threshold: float = 0.8,
+    ):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.dedup_threshold = dedup_threshold
+
+    def build(self, chunks: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, Any]], Dict[str, int]]:
+        """Return ``(context, chunks_used, stats)``."""
+        ranked = sorted(chunks, key=lambda c: c.get("rank", 0))
+        unique = self._dedup(ranked)
+        merged = self._merge(unique)
+        blocks: List[str] = []
+        used: List[Dict[str, Any]] = []
+        tokens = 0
+        sep_tokens = self.count_tokens(self.SEPARATOR)
+        for chunk in merged:
+            block = self._format(chunk)
+            cost = self.count_tokens(block) + (sep_tokens if blocks else 0)
+            if tokens + cost > self.max_tokens:
+                if not blocks:
+                    block = self._truncate(block, self.max_tokens)
+                    cost = self.count_tokens(block)
+                else:
+                    break
+            blocks.append(block)
+            used.append(chunk)
+            tokens += cost
+        stats = {
+            "retrieved": len(chunks),
+            "duplicates": len(ranked) - len(unique),
+            "merged": len(unique) - len(merged),
+            "used": len(used),
+            "dropped": len(merged) - len(used),
+            "context_tokens": tokens,
+        }
+        return self.SEPARATOR.join(blocks), used, stats
+
+    @staticmethod
+    def _format(chunk: Dict[str, Any]) -> str:
+        return f"[{chunk['filename']} - {chunk['section_title']}]\n{chunk['text']}"
+
+    def _dedup(self, ranked: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        kept: List[Tuple[Dict[str, Any], set]] = []
+        for chunk in ranked:
+            sh = _shingles(chunk["text"])
+            if any(len(sh & other) / (len(sh | other) or 1) >= self.dedup_threshold
+                   for _, other in kept):
+                continue
+            kept.append((chunk, sh))
+        return [c for c, _ in kept]
+
+    @staticmethod
+    def _merge(unique: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        groups: Dict[Tuple[Any, Any], List[Dict[str, Any]]] = {}
+        for chunk in unique:
+            groups.setdefault((chunk.get("doc_id"), chunk.get("section_id")), []).append(chunk)
+        merged: List[Dict[str, Any]] = []
+        for group in groups.values():
+            group.sort(key=lambda c: c.get("chunk_index", 0))
+            run = [group[0]]
+            for chunk in group[1:]:
+                if chunk.get("chunk_index", 0) == run[-1].get("chunk_index", 0) + 1:
+                    run.append(chunk)
+                    continue
+                merged.append(ContextBuilder._combine(run))
+                run = [chunk]
+            merged.append(ContextBuilder._combine(run))
+        return sorted(merged, key=lambda c: c.get("rank", 0))
+
+    @staticmethod
+    def _combine(run: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if len(run) == 1:
+            return run[0]
+        best = min(run, key=lambda c: c.get("rank", 0))
+        text = run[0]["text"]
+        for chunk in run[1:]:
+            text = _join_overlapping(text, chunk["text"])
+        return {**best, "text": text, "merged_chunks": [c.get("chunk_id") for c in run]}
+
+    def _truncate(self, block: str, budget: int) -> str:
+        words = block.split(" ")
+        lo, hi = 0, len(words)
+        while lo < hi:  # longest word prefix that fits
+            mid = (lo + hi + 1) // 2
+            if self.count_tokens(" ".join(words[:mid])) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        return " ".join(words[:lo])
+
+# -----------------------------------------------------------------------------
+# Concurrency Limits
+# -----------------------------------------------------------------------------
+class StageLimiter:
+    """Caps the requests inside one pipeline stage; the rest wait their turn.
+
+    Time spent waiting is recorded as the ``<name>.queue`` stage, and
+    ``active``/``waiting`` are exported as gauges. The semaphore is created
+    for the running event loop on first use (like LocalLLMClient's async
+    client), so a system built in a warm-up thread can serve any loop.
+    """
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.active = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.limit)
+            self._loop = loop
+        return self._semaphore
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        semaphore = self._get_semaphore()
+        start = time.perf_counter()
+        self.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        instrumentation.observe(f"{self.name}.queue", time.perf_counter() - start)
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            semaphore.release()
+
+    def stats(self) -> Dict[str, int]:
+        return {"limit": self.limit, "active": self.active, "waiting": self.waiting}
+
 # -----------------------------------------------------------------------------
 # RAG System Orchestrator
 # -----------------------------------------------------------------------------
 class RAGSystem:
-    """Coordinates retrieval and LLM synthesis for user queries."""
+    """Coordinates retrieval and LLM synthesis for user queries.
+
+    ``astream_response`` admits at most ``retrieval_concurrency`` requests
+    to retrieval (query encoding, search, re-ranking and context assembly,
+    run on a pool of ``retrieval_threads`` workers) and ``llm_concurrency``
+    to the LLM, so cheap retrievals never queue behind slow generations.
+    """
     def __init__(
         self,
         index_dir: Path,
         embedding_model: EmbeddingModel,
         retrieval_service: RetrievalService,
         llm_client: LLMClient,
+        answer_cache: Optional[AnswerCache] = None,
+        reranker: Optional[CrossEncoderReranker] = None,
+        rerank_candidates: int = 20,
+        context_builder: Optional[ContextBuilder] = None,
+        retrieval_concurrency: int = 32,
+        llm_concurrency: int = 10,
+        retrieval_threads: Optional[int] = None,
     ):
         self.store = retrieval_service.store
         self.retrieval = retrieval_service
         self.llm = llm_client
+        self.answer_cache = answer_cache
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+        self.context_builder = context_builder or ContextBuilder()
+        self.ttft_seconds: Deque[float] = deque(maxlen=1000)
+        self.retrieval_limit = StageLimiter("retrieval", retrieval_concurrency)
+        self.llm_limit = StageLimiter("llm", llm_concurrency)
+        # Own pools rather than the loop's default executor, whose size
+        # (min(32, cpus + 4)) would silently cap both stages.
+        self._retrieval_pool = ThreadPoolExecutor(
+            max_workers=retrieval_threads or self.retrieval_limit.limit,
+            thread_name_prefix="retrieval")
+        self._llm_pool = ThreadPoolExecutor(max_workers=self.llm_limit.limit,
+                                            thread_name_prefix="llm")
+        weakref.finalize(self, self._retrieval_pool.shutdown, wait=False)
+        weakref.finalize(self, self._llm_pool.shutdown, wait=False)
         logger.info("RAGSystem initialized with backend=%s", type(llm_client).__name__)
 
+    SYSTEM_PROMPT = (
+        "You are a helpful assistant that answers questions about design documents. "
+        "Use the provided context... Always cite sources."
+    )
+
+    @instrumented("rag.context")
+    def _build_prompts(self, query: str, chunks: List[Dict[str, Any]]) -> Tuple[str, str]:
+        # Assemble context within the token budget
+        builder = self.context_builder
+        context, _, stats = builder.build(chunks)
+        user_prompt = f"Context:\n{context}\n\nQuestion: {query}"  # concise prompt
+        prompt_tokens = builder.count_tokens(self.SYSTEM_PROMPT) + builder.count_tokens(user_prompt)
+        logger.info("Prompt: %d tokens (context %d/%d; %d of %d chunks used, "
+                    "%d duplicates dropped, %d merged, %d trimmed)",
+                    prompt_tokens, stats["context_tokens"], builder.max_tokens, stats["used"],
+                    stats["retrieved"], stats["duplicates"], stats["merged"], stats["dropped"])
+        return self.SYSTEM_PROMPT, user_prompt
+
+    @staticmethod
+    def _chunk_ids(chunks: List[Dict[str, Any]]) -> List[Any]:
+        return [_chunk_id(c) for c in chunks]
+
+    def _retrieve(
+        self, query: str, top_k: int, filters: Optional[Filters] = None
+    ) -> Tuple[Optional[str], List[Dict[str, Any]], Optional[np.ndarray], str]:
+        """Retrieve context for ``query``, consulting the answer cache on the way.
+
+        Returns ``(cached_answer, chunks, query_embedding, build_hash)``;
+        ``cached_answer`` is None on a cache miss, and the embedding is None
+        on an exact hit. ``build_hash`` names the index version the chunks
+        came from; pass it to :meth:`_remember` so an answer is never cached
+        under a version swapped in while it was generated.
+        """
+        snap = self.store.snapshot()  # one index version for the whole request
+        cache = self.answer_cache
+        scope = (top_k, filters_key(filters))
+        if cache is not None:
+            hit = cache.get_exact(query, scope, snap.build_hash)
+            if hit is not None:
+                return hit.answer, hit.chunks, None, snap.build_hash
+        emb = self.retrieval.embed(query)
+        if self.reranker is None:
+            chunks = self.retrieval.retrieve(query, top_k, embedding=emb, filters=filters,
+                                             snapshot=snap)
+        else:
+            # Over-fetch candidates and let the cross-encoder pick the final top_k.
+            candidates = self.retrieval.retrieve(
+                query, max(top_k, self.rerank_candidates), embedding=emb, filters=filters,
+                snapshot=snap)
+            chunks = self.reranker.rerank(query, candidates, top_k)
+        if cache is not None and chunks:
+            hit = cache.get_semantic(emb, self._chunk_ids(chunks), scope, snap.build_hash)
+            if hit is not None:
+                return hit.answer, chunks, emb, snap.build_hash
+        return None, chunks, emb, snap.build_hash
+
+    def _remember(
+        self, query: str, top_k: int, filters: Optional[Filters], answer: str,
+        chunks: List[Dict[str, Any]], emb: Optional[np.ndarray], build_hash: str,
+    ) -> None:
+        if self.answer_cache is not None and emb is not None:
+            self.answer_cache.put(query, (top_k, filters_key(filters)), answer, chunks,
+                                  self._chunk_ids(chunks), emb, build_hash)
+
+    @instrumented("rag.request")
     def generate_response(
-        self, query: str, top_k: int = 5
+        self, query: str, top_k: int = 5, filters: Optional[Filters] = None
     ) -> Tuple[str, List[Dict[str, Any]]]:
         # Validate input
         if not query or not query.strip():
             raise ValueError("Query must be a non-empty string.")
 
-        # Retrieve relevant chunks
-        chunks = self.retrieval.retrieve(query, top_k)
+        # Retrieve relevant chunks, or a cached answer
+        cached, chunks, emb, build_hash = self._retrieve(query, top_k, filters)
+        if cached is not None:
+            return cached, chunks
         if not chunks:
             return "No relevant documents found for your query.", []
 
-        # Assemble context
-        context = "\n\n---\n\n".join(
-            f"[{c['filename']} - {c['section_title']}]\n{c['text']}" for c in chunks
-        )
-
-        system_prompt = (
-            "You are a helpful assistant that answers questions about design documents. "
-            "Use the provided context... Always cite sources."
-        )
-        user_prompt = f"Context:\n{context}\n\nQuestion: {query}"  # concise prompt
+        system_prompt, user_prompt = self._build_prompts(query, chunks)
 
         # Generate answer
         try:
             answer = self.llm.generate(system_prompt, user_prompt)
         except LLMClientError as e:
             logger.error("LLM generation failed: %s", e)
-            answer = f"Error generating response: {e}"
+            return f"Error generating response: {e}", chunks
 
+        self._remember(query, top_k, filters, answer, chunks, emb, build_hash)
         return answer, chunks
 
+    @instrumented("rag.request")
+    def stream_response(
+        self, query: str, top_k: int = 5, filters: Optional[Filters] = None
+    ) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Like generate_response, but yield ``(answer_so_far, chunks)`` as tokens arrive.
+
+        The first item is yielded right after retrieval with an empty answer,
+        so callers can show the retrieved context before the LLM responds.
+        """
+        if not query or not query.strip():
+            raise ValueError("Query must be a non-empty string.")
+
+        start = time.perf_counter()
+        cached, chunks, emb, build_hash = self._retrieve(query, top_k, filters)
+        if cached is not None:
+            yield cached, chunks
+            return
+        if not chunks:
+            yield "No relevant documents found for your query.", []
+            return
+        yield "", chunks
+
+        system_prompt, user_prompt = self._build_prompts(query, chunks)
+        stream = getattr(self.llm, "stream", None)
+        answer = ""
+        first_token: Optional[float] = None
+        try:
+            if stream is None:
+                deltas: Iterator[str] = iter([self.llm.generate(system_prompt, user_prompt)])
+            else:
+                deltas = stream(system_prompt, user_prompt)
+            for delta in deltas:
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                    self.ttft_seconds.append(first_token)
+                    instrumentation.observe("llm.first_token", first_token)
+                answer += delta
+                yield answer, chunks
+        except LLMClientError as e:
+            logger.error("LLM generation failed: %s", e)
+            answer = f"{answer}\n\nError generating response: {e}" if answer \
+                else f"Error generating response: {e}"
+            yield answer, chunks
+            return
+        self._remember(query, top_k, filters, answer, chunks, emb, build_hash)
+        if first_token is not None:
+            logger.info("Streamed response: ttft=%.3fs total=%.3fs",
+                        first_token, time.perf_counter() - start)
+
+    @instrumented("rag.request")
+    async def astream_response(
+        self, query: str, top_k: int = 5, filters: Optional[Filters] = None
+    ) -> AsyncIterator[Tuple[str, List[Dict[str, Any]]]]:
+        """Async counterpart of stream_response for event-loop based servers.
+
+        Retrieval and prompt assembly run on the retrieval pool; the LLM is
+        driven through the client's ``astream`` when it has one, otherwise
+        its blocking ``stream``/``generate`` is pumped from the LLM pool.
+        Each stage first waits for a slot under its concurrency limit.
+        """
+        if not query or not query.strip():
+            raise ValueError("Query must be a non-empty string.")
+
+        start = time.perf_counter()
+        async with self.retrieval_limit.slot():
+            cached, chunks, emb, build_hash = await _run_in(
+                self._retrieval_pool, self._retrieve, query, top_k, filters)
+            if cached is None and chunks:
+                system_prompt, user_prompt = await _run_in(self._retrieval_pool,
+                                                           self._build_prompts, query, chunks)
+        if cached is not None:
+            yield cached, chunks
+            return
+        if not chunks:
+            yield "No relevant documents found for your query.", []
+            return
+        yield "", chunks
+
+        answer = ""
+        first_token: Optional[float] = None
+        async with self.llm_limit.slot():
+            if hasattr(self.llm, "astream"):
+                deltas = self.llm.astream(system_prompt, user_prompt)
+            elif hasattr(self.llm, "stream"):
+                deltas = _aiter_in_thread(lambda: self.llm.stream(system_prompt, user_prompt),
+                                          self._llm_pool)
+            else:
+                deltas = _aiter_in_thread(
+                    lambda: iter([self.llm.generate(system_prompt, user_prompt)]), self._llm_pool)
+            try:
+                async for delta in deltas:
+                    if first_token is None:
+                        first_token = time.perf_counter() - start
+                        self.ttft_seconds.append(first_token)
+                        instrumentation.observe("llm.first_token", first_token)
+                    answer += delta
+                    yield answer, chunks
+            except LLMClientError as e:
+                logger.error("LLM generation failed: %s", e)
+                answer = f"{answer}\n\nError generating response: {e}" if answer \
+                    else f"Error generating response: {e}"
+                yield answer, chunks
+                return
+        self._remember(query, top_k, filters, answer, chunks, emb, build_hash)
+        if first_token is not None:
+            logger.info("Streamed response: ttft=%.3fs total=%.3fs",
+                        first_token, time.perf_counter() - start)
+
+    def ttft_summary(self) -> Dict[str, float]:
+        """Percentiles of recent time-to-first-token samples, in seconds."""
+        samples = sorted(self.ttft_seconds)
+        if not samples:
+            return {"count": 0}
+
+        def pct(q: float) -> float:
+            return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+        return {"count": len(samples), "p50": pct(0.50), "p95": pct(0.95), "max": samples[-1]}
+
 # -----------------------------------------------------------------------------
 # Gradio Interface
 # -----------------------------------------------------------------------------
 class GradioInterface:
-    """Web UI for interacting with the RAG system via Gradio."""
-    def __init__(self, rag: RAGSystem):
+    """Web UI for interacting with the RAG system via Gradio.
+
+    ``rag`` may be attached after the UI is built, once warm-up finishes.
+    Each browser session keeps its own history (a ``gr.State``) of at most
+    ``history_size`` questions. Up to ``concurrency_limit`` questions are
+    processed at once across sessions, further ones wait in Gradio's queue
+    (at most ``max_queue``, then they are turned away); the RAG system's
+    stage limits decide how many of them retrieve or generate at a time.
+    """
+    def __init__(self, rag: Optional[RAGSystem] = None, history_size: int = 20,
+                 concurrency_limit: int = 64, max_queue: Optional[int] = 256):
         self.rag = rag
-        self.chat_history: List[Dict[str, Any]] = []
+        self.history_size = max(0, history_size)
+        self.concurrency_limit = max(1, concurrency_limit)
+        self.max_queue = max_queue
 
-    def process(self, query: str, top_k: int) -> Tuple[str, str, str]:
+    def _remember(self, history: Optional[List[Dict[str, Any]]],
+                  entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        history = list(history or []) + [entry]
+        return history[-self.history_size:] if self.history_size else []
+
+    async def process(
+        self, query: str, top_k: int, filters: str = "",
+        history: Optional[List[Dict[str, Any]]] = None,
+    ) -> AsyncIterator[Tuple[str, str, str, List[Dict[str, Any]]]]:
+        history = history or []
         if not query.strip():
-            return "Please enter a question.", "", ""
+            yield "Please enter a question.", "", "", history
+            return
+        if self.rag is None:
+            yield "The model and index are still loading; please retry shortly.", "", "", history
+            return
         try:
-            response, chunks = self.rag.generate_response(query, top_k)
-            self.chat_history.append({"query": query, "chunks": len(chunks)})
-            return response, self._format_context(chunks), self._format_details(chunks)
+            chunks: List[Dict[str, Any]] = []
+            response = context = details = ""
+            parsed = parse_filters(filters) if filters else None
+            async for response, chunks in self.rag.astream_response(query, top_k, parsed):
+                if not context:
+                    context = self._format_context(chunks)
+                    details = self._format_details(chunks)
+                yield response, context, details, history
+            yield response, context, details, self._remember(
+                history, {"query": query, "chunks": len(chunks)})
         except Exception as e:
             logger.error("Processing error: %s", e)
-            return f"Error: {e}", "", ""
+            yield f"Error: {e}", "", "", history
 
     def _format_context(self, chunks: List[Dict[str, Any]]) -> str:
         if not chunks:
@@ -239,43 +1613,61 @@ class GradioInterface:
             return ""
         parts = []
         for i, c in enumerate(chunks, start=1):
+            scores = ", ".join(
+                f"{label}: {c[key]:.3f}"
+                for key, label in (("distance", "Distance"), ("bm25", "BM25"), ("rrf", "RRF"),
+                                   ("rerank", "Rerank"))
+                if key in c
+            )
             parts.append(
                 f"**Chunk {i}:** {c['filename']} ({c['section_title']}) - "
-                f"Score: {c['distance']:.3f}\n{c['text'][:150]}..."
+                f"{scores}\n{c['text'][:150]}..."
             )
         return "\n\n".join(parts)
 
-    def launch(self) -> None:
-        """Build and start the Gradio app."""
+    def build(self) -> Any:
+        """Build the Gradio Blocks app."""
+        import gradio as gr
         with gr.Blocks(title="RAG Design Document Chat") as demo:
             gr.Markdown("# 🔍 RAG Design Document Chat")
             # Input components
             query = gr.Textbox(label="Your Question", lines=2)
             top_k = gr.Slider(minimum=1, maximum=10, step=1, value=5, label="Top K")
+            filters = gr.Textbox(label="Filters", placeholder="category=security; keywords=gnmi,evpn")
             submit = gr.Button("Ask")
+            history = gr.State([])  # per browser session
 
             # Output components
             response = gr.Textbox(label="AI Response", interactive=False)
             context = gr.Markdown(label="Retrieved Context")
             details = gr.Markdown(label="Retrieval Details")
 
-            submit.click(self.process, [query, top_k], [response, context, details])
-            query.submit(self.process, [query, top_k], [response, context, details])
+            # Both triggers share one concurrency pool
+            for trigger in (submit.click, query.submit):
+                trigger(self.process, [query, top_k, filters, history],
+                        [response, context, details, history],
+                        concurrency_limit=self.concurrency_limit, concurrency_id="ask")
+        return demo.queue(max_size=self.max_queue)
 
-        demo.launch(server_name="0.0.0.0", server_port=7860, debug=False)
+    def launch(self) -> None:
+        """Build and start a standalone Gradio app."""
+        self.build().launch(server_name="0.0.0.0", server_port=7860, debug=False)
 
 # -----------------------------------------------------------------------------
-# Entry Point
+# Startup & Serving
 # -----------------------------------------------------------------------------
-def main():
-    index_dir = Path("index")
-    if not index_dir.exists():
-        raise IndexNotFoundError("Index directory does not exist.")
+_MODULE_START = time.perf_counter()
 
-    # Initialize components with dependency injection
-    embed_model = EmbeddingModel(model_name=os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"))
-    store = IndexStore(index_dir)
-    retrieval = RetrievalService(embed_model, store)
+def build_rag_system(index_dir: Path, embed_model: EmbeddingModel, store: IndexStore) -> RAGSystem:
+    """Compose the RAG system around a loaded model and index, configured from the environment."""
+    retrieval = RetrievalService(
+        embed_model,
+        store,
+        mode=os.getenv("RETRIEVAL_MODE") or None,
+        candidates=int(os.getenv("HYBRID_CANDIDATES", "20")),
+        batch_size=int(os.getenv("RETRIEVAL_BATCH_SIZE", "32")),
+        batch_wait_ms=float(os.getenv("RETRIEVAL_BATCH_WAIT_MS", "2")),
+    )
 
     # Choose LLM client based on environment
     api_key = os.getenv("OPENAI_API_KEY")
@@ -284,11 +1676,343 @@ def main():
     else:
         local_url = os.getenv("LOCAL_LLM_URL", "http://localhost:11434/v1")
         local_model = os.getenv("LOCAL_LLM_MODEL", "llama2")
-        llm_client = LocalLLMClient(local_url, local_model)
+        llm_client = LocalLLMClient(
+            local_url,
+            local_model,
+            pool_size=int(os.getenv("LOCAL_LLM_POOL_SIZE", "10")),
+            connect_timeout=float(os.getenv("LOCAL_LLM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("LOCAL_LLM_READ_TIMEOUT", "30")),
+            max_retries=int(os.getenv("LOCAL_LLM_MAX_RETRIES", "2")),
+            backoff_factor=float(os.getenv("LOCAL_LLM_BACKOFF", "0.5")),
+        )
+
+    cache_size = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+    answer_cache = AnswerCache(
+        max_entries=cache_size,
+        ttl=float(os.getenv("ANSWER_CACHE_TTL", "3600")),
+        threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+    ) if cache_size > 0 else None
+    rerank_model = os.getenv("RERANK_MODEL")
+    reranker = CrossEncoderReranker(
+        rerank_model,
+        batch_size=int(os.getenv("RERANK_BATCH_SIZE", "32")),
+    ) if rerank_model else None
+    context_builder = ContextBuilder(
+        max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "2048")),
+        count_tokens=load_llm_token_counter(
+            os.getenv("CONTEXT_TOKENIZER") or getattr(llm_client, "model", None)),
+    )
+    return RAGSystem(
+        index_dir, embed_model, retrieval, llm_client, answer_cache,
+        reranker=reranker,
+        rerank_candidates=int(os.getenv("RERANK_CANDIDATES", "20")),
+        context_builder=context_builder,
+        retrieval_concurrency=int(os.getenv("RETRIEVAL_CONCURRENCY", "32")),
+        llm_concurrency=int(os.getenv("LLM_CONCURRENCY") or getattr(llm_client, "pool_size", 10)),
+        retrieval_threads=int(os.getenv("RETRIEVAL_THREADS", "0")) or None,
+    )
+
+def register_gauges(rag: RAGSystem) -> None:
+    """Export index, cache and batching state alongside the stage histograms."""
+    registry = instrumentation.REGISTRY
+    registry.gauge("rag_index_chunks", "Chunks in the live index version.",
+                   lambda: len(rag.store.metadata))
+    registry.gauge("rag_index_reloads", "Index versions swapped in since startup.",
+                   lambda: rag.store.reloads)
+    if rag.answer_cache is not None:
+        registry.gauge("rag_answer_cache", "Answer cache statistics.",
+                       lambda: {(k,): v for k, v in rag.answer_cache.stats().items()},
+                       labels=("stat",))
+    registry.gauge("rag_stage_concurrency", "Requests running in and waiting for each stage.",
+                   lambda: {(limiter.name, state): limiter.stats()[state]
+                            for limiter in (rag.retrieval_limit, rag.llm_limit)
+                            for state in ("active", "waiting")},
+                   labels=("stage", "state"))
+    registry.gauge("rag_micro_batch_mean_size", "Mean micro-batch size per batcher.",
+                   lambda: {(name, ): st["mean_batch_size"]
+                            for name, st in rag.retrieval.batch_stats().items()} or None,
+                   labels=("batcher",))
+
+class Startup:
+    """Loads the model, index and UI in background threads and tracks readiness.
+
+    Every stage is timed (start offset from process import, duration and
+    thread) for the startup profile. ``ready`` is set once the RAG system is
+    composed, one warm-up retrieval (query encode + search) has run and, when
+    serving, the UI is mounted.
+    """
+    def __init__(self, index_dir: Path, with_ui: bool = True):
+        self.index_dir = index_dir
+        self.with_ui = with_ui
+        self.rag: Optional[RAGSystem] = None
+        self.interface = GradioInterface(
+            history_size=int(os.getenv("CHAT_HISTORY_SIZE", "20")),
+            concurrency_limit=int(os.getenv("UI_CONCURRENCY", "64")),
+            max_queue=int(os.getenv("UI_QUEUE_SIZE", "256")) or None,
+        )
+        self.ui_app: Any = None
+        self.ui_live = False
+        self.error: Optional[str] = None
+        self.ready = threading.Event()
+        self.done = threading.Event()
+        self.stages: List[Dict[str, Any]] = [
+            {"stage": "import rag_chat", "start": 0.0,
+             "seconds": time.perf_counter() - _MODULE_START, "thread": "MainThread"}
+        ]
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, name="warm-up", daemon=True).start()
+
+    def uptime(self) -> float:
+        return time.perf_counter() - _MODULE_START
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, start, time.perf_counter() - start, threading.current_thread().name)
+
+    def _record(self, name: str, start: float, seconds: float, thread: str) -> None:
+        with self._lock:
+            self.stages.append({"stage": name, "start": round(start - _MODULE_START, 4),
+                                "seconds": round(seconds, 4), "thread": thread})
+
+    def status(self) -> Dict[str, Any]:
+        """Readiness of each component plus the profile so far."""
+        return {
+            "ready": self.ready.is_set(),
+            "error": self.error,
+            "components": {
+                "rag": self.rag is not None,
+                "ui": self.ui_live if self.with_ui else None,
+            },
+            "index_version": self.rag.store.version if self.rag is not None else None,
+            "uptime_s": round(self.uptime(), 3),
+            "profile": sorted(self.stages, key=lambda s: s["start"]),
+        }
+
+    def report(self) -> str:
+        """Human-readable startup profile, one stage per line in start order."""
+        lines = [f"Startup profile ({'ready' if self.ready.is_set() else 'not ready'} "
+                 f"after {self.uptime():.2f}s):",
+                 f"  {'start':>8} {'seconds':>8}  {'thread':<16} stage"]
+        for s in sorted(self.stages, key=lambda s: s["start"]):
+            lines.append(f"  {s['start']:>8.3f} {s['seconds']:>8.3f}  {s['thread']:<16} {s['stage']}")
+        if self.error:
+            lines.append(f"  failed: {self.error}")
+        return "\n".join(lines)
+
+    def mark_ui_live(self) -> None:
+        self.ui_live = True
+        self._check_ready()
+
+    def _check_ready(self) -> None:
+        if self.rag is not None and (self.ui_live or not self.with_ui) and not self.ready.is_set():
+            with self.stage("ready"):
+                self.ready.set()
+            if self.with_ui:  # --startup-profile prints the report itself
+                logger.info("%s", self.report())
+
+    def _import(self, name: str) -> Any:
+        with self.stage(f"import {name}"):
+            return importlib.import_module(name)
+
+    def _load_model(self) -> EmbeddingModel:
+        backend = os.getenv("EMBED_BACKEND", "torch")
+        self._import("onnxruntime" if backend == "onnx" else "sentence_transformers")
+        cache_dir = os.getenv("EMBED_CACHE_DIR")
+        threads = os.getenv("EMBED_THREADS")
+        with self.stage("load embedding model"):
+            return EmbeddingModel(
+                model_name=os.getenv("EMBED_MODEL", "all-MiniLM-L6-v2"),
+                cache_dir=Path(cache_dir) if cache_dir else None,
+                cache_size=int(os.getenv("EMBED_CACHE_SIZE", "200000")),
+                backend=backend,
+                quantize=os.getenv("EMBED_ONNX_INT8", "0") != "0",
+                threads=int(threads) if threads else None,
+                onnx_dir=Path(os.getenv("EMBED_ONNX_DIR", str(DEFAULT_ONNX_DIR))),
+            )
+
+    def _load_index(self) -> IndexStore:
+        self._import("faiss")
+        with self.stage("load index"):
+            store = IndexStore(self.index_dir)
+        for name, (start, seconds, thread) in store.load_times.items():
+            self._record(f"load index: {name}", start, seconds, thread)
+        return store
+
+    def _build_ui(self) -> None:
+        gr = self._import("gradio")
+        from fastapi import FastAPI
+        with self.stage("build ui"):
+            blocks = self.interface.build()
+            self.ui_app = gr.mount_gradio_app(FastAPI(), blocks, path="")
+
+    def _run(self) -> None:
+        try:
+            with ThreadPoolExecutor(max_workers=3, thread_name_prefix="warm-up") as pool:
+                model = pool.submit(self._load_model)
+                store = pool.submit(self._load_index)
+                ui = pool.submit(self._build_ui) if self.with_ui else None
+                embed_model, index_store = model.result(), store.result()
+                with self.stage("compose rag system"):
+                    rag = build_rag_system(self.index_dir, embed_model, index_store)
+                with self.stage("warm-up retrieval"):
+                    rag.retrieval.retrieve("warm-up", 1)
+                index_store.start_watching(float(os.getenv("INDEX_WATCH_INTERVAL", "30")))
+                if ui is not None:
+                    ui.result()
+            register_gauges(rag)
+            self.interface.rag = rag
+            self.rag = rag
+            self._check_ready()
+        except Exception as e:
+            logger.exception("Startup failed")
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.done.set()
+
+def _is_loopback(host: Optional[str]) -> bool:
+    try:
+        return ipaddress.ip_address(host or "").is_loopback
+    except ValueError:
+        return False
+
+class ServerApp:
+    """ASGI app that binds before the UI exists.
+
+    Health, readiness, metrics and admin routes are served by a small FastAPI app
+    from the first request; everything else goes to the Gradio app once warm-up has
+    finished, and gets a 503 with ``Retry-After`` until then. Gradio's own
+    startup events run when its app becomes available (see ``_serve_ui``).
+    """
+    def __init__(self, startup: Startup):
+        from fastapi import FastAPI, Header, Request
+        from fastapi.responses import JSONResponse, PlainTextResponse
+
+        self.startup = startup
+        self.api = FastAPI(title="RAG Design Document Chat", docs_url=None,
+                           redoc_url=None, openapi_url=None)
+        self._stop: Optional[asyncio.Event] = None
+        self._ui_task: Optional["asyncio.Task[None]"] = None
+
+        @self.api.get("/healthz")
+        def healthz() -> Dict[str, Any]:
+            return {"status": "ok", "uptime_s": round(startup.uptime(), 3)}
+
+        @self.api.get("/readyz")
+        def readyz() -> Any:
+            return JSONResponse(startup.status(), status_code=200 if startup.ready.is_set() else 503)
+
+        @self.api.get("/metrics")
+        def metrics() -> Any:
+            if not instrumentation.metrics_enabled():
+                return PlainTextResponse("metrics are disabled (METRICS=0)\n", status_code=404)
+            return PlainTextResponse(instrumentation.REGISTRY.render(),
+                                     media_type="text/plain; version=0.0.4")
+
+        @self.api.post("/admin/reload")
+        def admin_reload(request: Request, authorization: str = Header(default="")) -> Any:
+            """Swap in the index version CURRENT points at (runs in a worker thread).
+
+            Needs ``Authorization: Bearer $ADMIN_TOKEN``; without ADMIN_TOKEN only
+            loopback clients may call it, since the server binds to all interfaces.
+            """
+            token = os.getenv("ADMIN_TOKEN")
+            if token:
+                if not hmac.compare_digest(authorization, f"Bearer {token}"):
+                    return JSONResponse({"error": "unauthorized"}, status_code=401)
+            elif not _is_loopback(request.client.host if request.client else None):
+                return JSONResponse({"error": "set ADMIN_TOKEN to allow remote reloads"},
+                                    status_code=403)
+            if startup.rag is None:
+                return JSONResponse({"error": "still starting up"}, status_code=503)
+            store = startup.rag.store
+            try:
+                reloaded = store.reload()
+            except Exception as e:
+                return JSONResponse({"reloaded": False, "version": store.version,
+                                     "error": f"{type(e).__name__}: {e}"}, status_code=500)
+            return {"reloaded": reloaded, "version": store.version,
+                    "build_hash": store.build_hash, "chunks": len(store.metadata)}
+
+    def _is_api_path(self, path: str) -> bool:
+        return any(getattr(route, "path", None) == path for route in self.api.routes)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif self._is_api_path(scope.get("path", "")):
+            await self.api(scope, receive, send)
+        elif self.startup.ready.is_set():
+            await self.startup.ui_app(scope, receive, send)
+        elif scope["type"] == "http":
+            from starlette.responses import PlainTextResponse
+            msg = f"Starting up; see /readyz.{' Failed: ' + self.startup.error if self.startup.error else ''}"
+            await PlainTextResponse(msg, status_code=503, headers={"Retry-After": "2"})(
+                scope, receive, send)
+        else:
+            await send({"type": "websocket.close", "code": 1013})
+
+    async def _lifespan(self, receive: Callable, send: Callable) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._stop = asyncio.Event()
+                self._ui_task = asyncio.create_task(self._serve_ui())
+                logger.info("Server bound after %.2fs", self.startup.uptime())
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self._stop is not None:
+                    self._stop.set()
+                if self._ui_task is not None:
+                    await self._ui_task
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _serve_ui(self) -> None:
+        """Run the Gradio app's lifespan once it exists, until shutdown."""
+        while self.startup.ui_app is None and not self.startup.error:
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=0.05)
+                return
+            except asyncio.TimeoutError:
+                pass
+        if self.startup.ui_app is None:
+            return
+        ui_app = self.startup.ui_app
+        async with ui_app.router.lifespan_context(ui_app):
+            self.startup.mark_ui_live()
+            await self._stop.wait()
+
+# -----------------------------------------------------------------------------
+# Entry Point
+# -----------------------------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="RAG design document chat server")
+    parser.add_argument("--startup-profile", action="store_true",
+                        help="Load everything without serving, print the startup profile and exit")
+    args = parser.parse_args()
+
+    index_dir = Path("index")
+    if not index_dir.exists():
+        raise IndexNotFoundError("Index directory does not exist.")
+
+    instrumentation.configure(metrics=os.getenv("METRICS", "1") != "0",
+                              tracing=os.getenv("TRACING") or None)
+    startup = Startup(index_dir, with_ui=not args.startup_profile)
+    startup.start()
+    if args.startup_profile:
+        startup.done.wait()
+        print(startup.report())
+        raise SystemExit(0 if startup.ready.is_set() else 1)
 
-    # Compose RAG system and launch UI
-    rag_system = RAGSystem(index_dir, embed_model, retrieval, llm_client)
-    GradioInterface(rag_system).launch()
+    import uvicorn
+    uvicorn.run(ServerApp(startup), host=os.getenv("HOST", "0.0.0.0"),
+                port=int(os.getenv("PORT", "7860")), log_level="info")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Sharded index layout.
+
+``build_index.py --shards N`` splits a build into N shards, each written as
+a complete index directory of its own (FAISS index, metadata, sparse
+postings, ``info.json``), so any one of them can be opened on its own, e.g.
+by a search process on another host:
+
+    <version>/
+      info.json        totals, "shard_by" and one entry per shard
+      manifest.json
+      shards/
+        shard-000/     faiss_index.bin  metadata/  sparse/  info.json
+        shard-001/     ...
+
+Chunks are assigned per document, so a document never spans shards:
+
+* ``doc`` hashes the ``doc_id`` (stable across processes and builds, so a
+  document stays in its shard as the corpus grows);
+* ``category`` keeps each category (compared case-insensitively, like the
+  metadata filters) in one shard, placing the largest categories first on
+  the least loaded shard. A category-filtered search then only finds hits
+  in one shard, and the chat server skips the others.
+
+BM25 scores of every shard are computed with corpus-wide statistics (see
+:func:`sparse_index.collection_stats`), so they can be compared across
+shards as they are.
+"""
+import hashlib
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Mapping, Sequence
+
+from metadata_store import filter_key
+
+DIRNAME = 'shards'
+SHARD_BY = ('doc', 'category')
+
+
+def shard_name(shard: int) -> str:
+    return f'shard-{shard:03d}'
+
+
+def doc_shard(doc_id: str, shards: int) -> int:
+    """Shard of a document under ``--shard-by doc``."""
+    digest = hashlib.sha1(str(doc_id).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shards
+
+
+def category_shards(counts: Mapping[str, int], shards: int) -> Dict[str, int]:
+    """Shard of each category under ``--shard-by category``, from chunk counts per category."""
+    load = [0] * shards
+    target: Dict[str, int] = {}
+    for category, count in sorted(counts.items(), key=lambda kv: (-kv[1], kv[0])):
+        shard = min(range(shards), key=lambda s: (load[s], s))
+        target[category] = shard
+        load[shard] += count
+    return target
+
+
+def assign_shards(rows: Sequence[Dict[str, Any]], shards: int, by: str = 'doc') -> List[int]:
+    """Shard number of every chunk in ``rows``."""
+    if by not in SHARD_BY:
+        raise ValueError(f"Unknown shard key {by!r}; expected one of {SHARD_BY}")
+    if by == 'doc':
+        return [doc_shard(r['doc_id'], shards) for r in rows]
+    keys = [filter_key(r.get('category', '')) for r in rows]
+    target = category_shards(Counter(keys), shards)
+    return [target[k] for k in keys]
+
+
+def read_info(index_dir: Path) -> Dict[str, Any]:
+    path = index_dir / 'info.json'
+    return json.loads(path.read_text(encoding='utf-8')) if path.is_file() else {}
+
+
+def is_sharded(index_dir: Path) -> bool:
+    return bool(read_info(index_dir).get('shards'))
+
+
+def shard_dirs(index_dir: Path) -> List[Path]:
+    """Directories of a sharded build's shards, in shard order."""
+    return [index_dir / DIRNAME / s['name'] for s in read_info(index_dir).get('shards', [])]
+
+
+def index_parts(index_dir: Path) -> List[Path]:
+    """Directories holding FAISS/metadata/sparse files: the shards, or the build itself."""
+    return shard_dirs(index_dir) if is_sharded(index_dir) else [index_dir]
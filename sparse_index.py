@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+BM25 inverted index over chunk text, stored as memory-mapped postings.
+
+Dense embeddings blur exact tokens that matter in network documentation:
+interface names (``xe-0/0/1``), RFC numbers, CLI keywords, VNIs and
+addresses. This index keeps those tokens intact and scores them with BM25,
+so ``rag_chat.py`` can fuse its ranking with the FAISS one.
+
+Layout, written next to the FAISS index by ``build_index.py``:
+
+    sparse/
+      meta.json        format version, BM25 parameters, row count
+      vocab.txt        one term per line; line number = term id
+      offsets.npy      uint64 start of each term's postings (n_terms + 1)
+      rows.npy         int32 metadata row of each posting, grouped by term
+      impacts.npy      float16 precomputed BM25 contribution of each posting
+      max_impacts.npy  float32 largest impact of each term, for query pruning
+      ids.npy          int64 FAISS id of each metadata row
+
+Because the whole BM25 formula is evaluated at build time, a query only
+gathers and sums the impacts of its terms.
+"""
+import itertools
+import json
+import logging
+import re
+import shutil
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+DIRNAME = 'sparse'
+
+# Words joined by '-', '/', '.', ':' or '_' stay one token, so interface names,
+# prefixes, versions and CLI paths match exactly; their parts are indexed too.
+_TOKEN = re.compile(r'[a-z0-9]+(?:[-/.:_][a-z0-9]+)*')
+_PART = re.compile(r'[a-z0-9]+')
+_RFC = re.compile(r'\brfc[\s-]*(\d+)')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from how i in is it of on or that the this to '
+    'was what when where which with do does can you your we our'.split()
+)
+
+
+class SparseIndexError(Exception):
+    """Raised when a sparse index is missing or unreadable."""
+    pass
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-case, network-aware tokens: compound tokens plus their parts."""
+    text = _RFC.sub(r'rfc\1', text.lower())
+    tokens: List[str] = []
+    for match in _TOKEN.finditer(text):
+        token = match.group()
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(p for p in _PART.findall(token) if p not in STOPWORDS)
+    return tokens
+
+
+# -----------------------------------------------------------------------------
+# Writing
+# -----------------------------------------------------------------------------
+def _row_terms(chunk: Dict[str, Any]) -> Counter:
+    return Counter(tokenize(f"{chunk.get('section_title', '')}\n{chunk.get('text', '')}"))
+
+
+def collection_stats(rows: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Row count, mean length and document frequencies of a whole corpus.
+
+    Passed to :func:`write_sparse_index` for each shard of a sharded build,
+    so every shard scores with the same IDF and length normalisation and
+    their BM25 scores can be merged directly.
+    """
+    df: Counter = Counter()
+    total = 0
+    n = 0
+    for n, chunk in enumerate(rows, start=1):
+        counts = _row_terms(chunk)
+        total += sum(counts.values())
+        df.update(counts.keys())
+    return {'rows': n, 'avgdl': total / n if n else 1.0, 'df': df}
+
+
+def _sorted_run(vocab: Dict[str, int], rows: Iterable[Dict[str, Any]], first_row: int,
+                doc_len: array, ids: array) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(term, row, tf) postings of ``rows``, sorted by term then row."""
+    post_terms, post_rows, post_tf = array('q'), array('i'), array('i')
+    for row, chunk in enumerate(rows, start=first_row):
+        counts = _row_terms(chunk)
+        doc_len.append(sum(counts.values()))
+        ids.append(chunk.get('id', row))
+        for term, tf in counts.items():
+            post_terms.append(vocab.setdefault(term, len(vocab)))
+            post_rows.append(row)
+            post_tf.append(tf)
+    terms = np.array(post_terms, dtype='int64')
+    order = np.lexsort((np.array(post_rows, dtype='int64'), terms))
+    return (terms[order], np.array(post_rows, dtype='int32')[order],
+            np.array(post_tf, dtype='float32')[order])
+
+
+def write_sparse_index(
+    index_dir: Path,
+    rows: Iterable[Dict[str, Any]],
+    k1: float = 1.2,
+    b: float = 0.75,
+    stats: Optional[Dict[str, Any]] = None,
+    batch_rows: int = 0,
+) -> None:
+    """Build the BM25 postings for ``rows`` (metadata dicts) under ``index_dir/sparse``.
+
+    Each row is indexed by its section title and text; rows without an
+    ``id`` are keyed by position, as in the metadata store. ``stats`` (from
+    :func:`collection_stats`) replaces the statistics of ``rows`` when they
+    are one shard of a larger corpus.
+
+    ``rows`` is consumed once. With ``batch_rows`` > 0 it is read in runs
+    of that many rows; each run's sorted postings are spilled to disk and
+    finally copied into their place in the term-ordered arrays, so memory
+    holds one run plus the per-row and per-term arrays rather than every
+    posting.
+    """
+    target = index_dir / DIRNAME
+    staging = index_dir / f'{DIRNAME}.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    vocab: Dict[str, int] = {}
+    doc_len, row_ids = array('f'), array('q')
+    runs: List[Any] = []
+    df = np.zeros(0, dtype='int64')
+    rows = iter(rows)
+    while True:
+        batch = itertools.islice(rows, batch_rows) if batch_rows else rows
+        first = len(doc_len)
+        run = _sorted_run(vocab, batch, first, doc_len, row_ids)
+        if len(doc_len) == first and runs:
+            break
+        df = np.concatenate([df, np.zeros(len(vocab) - len(df), dtype='int64')])
+        df += np.bincount(run[0], minlength=len(vocab))
+        if batch_rows:
+            path = staging / f'run-{len(runs):05d}.npz'
+            np.savez(path, *run)
+            runs.append(path)
+        else:
+            runs.append(run)
+        if not batch_rows or len(doc_len) - first < batch_rows:
+            break
+
+    doc_lengths = np.array(doc_len, dtype='float32')
+    n_rows = len(doc_lengths)
+    if stats is None:
+        n = max(1, n_rows)
+        term_df = df.astype('float32')
+        avgdl = float(doc_lengths.mean()) if n_rows else 1.0
+    else:
+        n = max(1, stats['rows'])
+        term_df = np.array([stats['df'][t] for t in vocab], dtype='float32')
+        avgdl = float(stats['avgdl'])
+    idf = np.log1p((n - term_df + 0.5) / (term_df + 0.5))
+
+    offsets = np.zeros(len(vocab) + 1, dtype='<u8')
+    np.cumsum(df, out=offsets[1:])
+    total = int(offsets[-1])
+    out_rows = np.lib.format.open_memmap(staging / 'rows.npy', mode='w+', dtype='int32',
+                                         shape=(total,))
+    impacts = np.lib.format.open_memmap(staging / 'impacts.npy', mode='w+', dtype='float16',
+                                        shape=(total,))
+    # Runs hold consecutive rows, so appending each run's postings of a term
+    # after the previous runs' keeps every term's postings in row order.
+    starts = offsets[:-1].astype('int64')
+    for run in runs:
+        if isinstance(run, Path):
+            with np.load(run) as data:
+                terms, post_rows, tf = data['arr_0'], data['arr_1'], data['arr_2']
+            run.unlink()
+        else:
+            terms, post_rows, tf = run
+        norm = k1 * (1.0 - b + b * doc_lengths[post_rows] / max(avgdl, 1e-9))
+        # terms is sorted: find where each term's postings begin
+        first_pos = np.flatnonzero(np.diff(terms, prepend=-1))
+        counts = np.diff(first_pos, append=len(terms))
+        uniq = terms[first_pos]
+        pos = starts[terms] + np.arange(len(terms)) - np.repeat(first_pos, counts)
+        out_rows[pos] = post_rows
+        impacts[pos] = (idf[terms] * tf * (k1 + 1.0) / (tf + norm)).astype('float16')
+        starts[uniq] += counts
+    out_rows.flush()
+    impacts.flush()
+
+    (staging / 'vocab.txt').write_text('\n'.join(vocab), encoding='utf-8')
+    np.save(staging / 'offsets.npy', offsets)
+    np.save(staging / 'max_impacts.npy',
+            np.maximum.reduceat(impacts, offsets[:-1].astype('int64')).astype('float32')
+            if len(vocab) else np.zeros(0, dtype='float32'))
+    del out_rows, impacts
+    np.save(staging / 'ids.npy', np.array(row_ids, dtype='int64'))
+    (staging / 'meta.json').write_text(json.dumps({
+        'version': FORMAT_VERSION, 'rows': n_rows, 'terms': len(vocab),
+        'postings': total, 'k1': k1, 'b': b, 'avgdl': avgdl,
+    }), encoding='utf-8')
+
+    old = index_dir / f'{DIRNAME}.old'
+    shutil.rmtree(old, ignore_errors=True)
+    if target.exists():
+        target.rename(old)
+    staging.rename(target)
+    shutil.rmtree(old, ignore_errors=True)
+    logger.info("Sparse index written: %d terms, %d postings", len(vocab), total)
+
+
+# -----------------------------------------------------------------------------
+# Reading
+# -----------------------------------------------------------------------------
+class SparseIndex:
+    """Read-only BM25 index written by :func:`write_sparse_index`."""
+
+    COMMON_RATIO = 0.1
+
+    def __init__(self, index_dir: Path):
+        self.directory = index_dir / DIRNAME
+        try:
+            meta = json.loads((self.directory / 'meta.json').read_text(encoding='utf-8'))
+            if meta.get('version') != FORMAT_VERSION:
+                raise SparseIndexError(f"Unsupported sparse index format: {meta.get('version')}")
+            self.meta = meta
+            vocab = (self.directory / 'vocab.txt').read_text(encoding='utf-8')
+            self.vocab = {t: i for i, t in enumerate(vocab.split('\n'))} if vocab else {}
+            self.offsets = np.load(self.directory / 'offsets.npy', mmap_mode='r')
+            self.rows = np.load(self.directory / 'rows.npy', mmap_mode='r')
+            self.impacts = np.load(self.directory / 'impacts.npy', mmap_mode='r')
+            self.ids = np.load(self.directory / 'ids.npy', mmap_mode='r')
+            self.max_impacts = np.load(self.directory / 'max_impacts.npy')
+        except (OSError, ValueError, KeyError) as e:
+            raise SparseIndexError(f"Cannot open sparse index {self.directory}: {e}") from e
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(
+        self, query: str, top_k: int = 5, allowed_rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(ids, scores)`` of the best ``top_k`` rows, best first.
+
+        ``allowed_rows`` restricts the result to those row numbers, which
+        line up with the metadata store's rows (both are written from the
+        same list by ``build_index.py``).
+
+        Terms that occur in more than ``COMMON_RATIO`` of the rows are only
+        probed for rows the rarer terms already matched (MaxScore): unless
+        their summed maximum impact could still lift an unmatched row into
+        the top ``top_k``, in which case everything is accumulated.
+        """
+        n = len(self.ids)
+        terms = {self.vocab[t] for t in tokenize(query) if t in self.vocab}
+        if not terms or top_k <= 0:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float32')
+        df = {t: int(self.offsets[t + 1] - self.offsets[t]) for t in terms}
+        rare = [t for t in terms if df[t] <= n * self.COMMON_RATIO]
+        common = [t for t in terms if t not in rare]
+
+        allowed = None
+        if allowed_rows is not None:
+            allowed = np.zeros(n, dtype=bool)
+            allowed[allowed_rows] = True
+        scores = np.zeros(n, dtype='float32')
+        for tid in rare:
+            rows, impacts = self._postings(tid)
+            # A term's postings hold each row at most once, so fancy += is safe.
+            scores[rows] += impacts
+        if rare and common:
+            hits = np.flatnonzero(scores)
+            if allowed is not None:
+                hits = hits[allowed[hits]]
+            for tid in common:
+                rows, impacts = self._postings(tid)
+                pos = np.minimum(np.searchsorted(rows, hits), len(rows) - 1)
+                found = rows[pos] == hits
+                scores[hits[found]] += impacts[pos[found]]
+            hits = self._top(hits, scores, top_k)
+            bound = float(sum(self.max_impacts[t] for t in common))
+            if len(hits) == top_k and scores[hits[-1]] >= bound:
+                return np.asarray(self.ids[hits], dtype='int64'), scores[hits]
+            scores[:] = 0
+            common = list(terms)
+        for tid in common:
+            rows, impacts = self._postings(tid)
+            scores[rows] += impacts
+        if allowed is not None:
+            scores[~allowed] = 0
+        hits = np.argpartition(-scores, min(top_k, n) - 1)[:top_k] if common \
+            else np.flatnonzero(scores)
+        hits = self._top(hits[scores[hits] > 0], scores, top_k)
+        return np.asarray(self.ids[hits], dtype='int64'), scores[hits]
+
+    def _postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = int(self.offsets[tid]), int(self.offsets[tid + 1])
+        return self.rows[start:end], self.impacts[start:end]
+
+    @staticmethod
+    def _top(hits: np.ndarray, scores: np.ndarray, top_k: int) -> np.ndarray:
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        return hits[np.argsort(-scores[hits], kind='stable')]
+
+
+def has_sparse_index(index_dir: Path) -> bool:
+    return (index_dir / DIRNAME / 'meta.json').is_file()
+
+
+def open_sparse_index(index_dir: Path) -> Optional[SparseIndex]:
+    """Open ``index_dir/sparse`` if the build produced one."""
+    if not has_sparse_index(index_dir):
+        return None
+    return SparseIndex(index_dir)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Any]], k: int = 60) -> List[Tuple[Any, float]]:
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (k + rank)."""
+    fused: Dict[Any, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Append-only spill files for streaming index builds.
+
+``build_index.py --streaming`` does not keep the corpus in memory: every
+embedded batch is appended here, and the index is built from these files
+once all documents are embedded:
+
+    spill/
+      checkpoint.json   build settings, committed row count and file sizes
+      vectors.f32       float32 vector of every chunk, row after row
+      ids.i64           int64 FAISS id of every chunk
+      chunks.jsonl      metadata row of every chunk
+      files.jsonl       manifest entry of every completed source file
+
+A batch becomes durable with :meth:`SpillStore.commit`, which fsyncs the
+data files and then atomically replaces ``checkpoint.json``. Reopening the
+store truncates whatever was written after the last commit, so a build
+that was interrupted resumes after its last committed batch. A checkpoint
+written with different settings (model, dimension, chunking) is discarded.
+"""
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+class SpillStore:
+    """Checkpointed, append-only vectors and metadata of one streaming build."""
+
+    CHECKPOINT = 'checkpoint.json'
+    VECTORS = 'vectors.f32'
+    IDS = 'ids.i64'
+    CHUNKS = 'chunks.jsonl'
+    FILES = 'files.jsonl'
+    DATA = (VECTORS, IDS, CHUNKS, FILES)
+
+    def __init__(self, directory: Path, dim: int, settings: Dict[str, Any]):
+        self.directory = Path(directory)
+        self.dim = dim
+        self.settings = settings
+        self.rows = 0
+        # Committed source files and their sha256
+        self.files: Dict[str, str] = {}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sizes: Dict[str, int] = {}
+        self.resumed = self._restore()
+        self._handles = {name: open(self.directory / name, 'ab') for name in self.DATA}
+
+    # ------------------------------------------------------------------
+    # Writing
+    # ------------------------------------------------------------------
+    def append(self, rows: List[Dict[str, Any]], vectors: np.ndarray) -> None:
+        """Append chunk rows (each with its ``id``) and their vectors, uncommitted."""
+        self._handles[self.VECTORS].write(np.ascontiguousarray(vectors, dtype='<f4').tobytes())
+        self._handles[self.IDS].write(np.array([r['id'] for r in rows], dtype='<i8').tobytes())
+        chunks = self._handles[self.CHUNKS]
+        for r in rows:
+            chunks.write(json.dumps(r, ensure_ascii=False).encode('utf-8') + b'\n')
+        self.rows += len(rows)
+
+    def add_file(self, filename: str, entry: Dict[str, Any]) -> None:
+        """Record a source file's manifest entry, uncommitted."""
+        self._handles[self.FILES].write(
+            json.dumps([filename, entry], ensure_ascii=False).encode('utf-8') + b'\n')
+        self.files[filename] = entry['sha256']
+
+    def commit(self) -> None:
+        """Make everything appended so far survive a crash."""
+        for f in self._handles.values():
+            f.flush()
+            os.fsync(f.fileno())
+        self._sizes = {name: f.tell() for name, f in self._handles.items()}
+        checkpoint = {'version': FORMAT_VERSION, 'settings': self.settings, 'rows': self.rows,
+                      'sizes': self._sizes}
+        tmp = self.directory / f'{self.CHECKPOINT}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.directory / self.CHECKPOINT)
+
+    def rollback(self) -> None:
+        """Drop everything appended since the last commit."""
+        for name, f in self._handles.items():
+            f.flush()
+            f.truncate(self._sizes.get(name, 0))
+        self.rows = self._count_rows()
+        self.files = {name: entry['sha256'] for name, entry in self.iter_files()}
+
+    def reset(self) -> None:
+        """Discard all spilled data and start an empty store."""
+        for f in self._handles.values():
+            f.truncate(0)
+        (self.directory / self.CHECKPOINT).unlink(missing_ok=True)
+        self.rows = 0
+        self.files = {}
+        self._sizes = {}
+
+    def close(self) -> None:
+        for f in self._handles.values():
+            f.close()
+
+    def remove(self) -> None:
+        """Close and delete the spill directory (after the index has been saved)."""
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    # ------------------------------------------------------------------
+    # Reading (committed data only)
+    # ------------------------------------------------------------------
+    def vectors(self) -> np.ndarray:
+        """Read-only (rows, dim) memmap of the spilled vectors."""
+        if not self.rows:
+            return np.zeros((0, self.dim), dtype='float32')
+        return np.memmap(self.directory / self.VECTORS, dtype='<f4', mode='r',
+                         shape=(self.rows, self.dim))
+
+    def ids(self) -> np.ndarray:
+        if not self.rows:
+            return np.zeros(0, dtype='int64')
+        return np.memmap(self.directory / self.IDS, dtype='<i8', mode='r', shape=(self.rows,))
+
+    def iter_rows(self, mask: Optional[np.ndarray] = None) -> Iterator[Dict[str, Any]]:
+        """Spilled metadata rows in order; only rows where ``mask`` is True, if given."""
+        with open(self.directory / self.CHUNKS, 'rb') as f:
+            for pos in range(self.rows):
+                line = f.readline()
+                if mask is None or mask[pos]:
+                    yield json.loads(line)
+
+    def iter_files(self, sort: bool = False) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """``(filename, manifest entry)`` of committed files, in build order or by name."""
+        path = self.directory / self.FILES
+        size = self._sizes.get(self.FILES, 0)
+        with open(path, 'rb') as f:
+            if not sort:
+                while f.tell() < size:
+                    name, entry = json.loads(f.readline())
+                    yield name, entry
+                return
+            offsets: List[Tuple[str, int]] = []
+            while f.tell() < size:
+                offset = f.tell()
+                offsets.append((json.loads(f.readline())[0], offset))
+            for _, offset in sorted(offsets):
+                f.seek(offset)
+                name, entry = json.loads(f.readline())
+                yield name, entry
+
+    # ------------------------------------------------------------------
+    # Internals
+    # ------------------------------------------------------------------
+    def _count_rows(self) -> int:
+        return self._sizes.get(self.IDS, 0) // 8
+
+    def _restore(self) -> bool:
+        """Resume from the last checkpoint if it matches; otherwise start empty."""
+        path = self.directory / self.CHECKPOINT
+        try:
+            checkpoint = json.loads(path.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            checkpoint = None
+        except ValueError as e:
+            logger.warning("Unreadable spill checkpoint %s (%s); starting over", path, e)
+            checkpoint = None
+        if checkpoint is not None and (checkpoint.get('version') != FORMAT_VERSION or
+                                       checkpoint.get('settings') != self.settings):
+            logger.info("Spill files in %s were written with other settings; starting over",
+                        self.directory)
+            checkpoint = None
+        if checkpoint is None:
+            return self._restore_empty()
+        sizes = checkpoint['sizes']
+        rows = checkpoint['rows']
+        for name in self.DATA:
+            file = self.directory / name
+            if not file.is_file() or file.stat().st_size < sizes.get(name, 0):
+                logger.warning("Spill file %s is shorter than its checkpoint; starting over", file)
+                return self._restore_empty()
+        if sizes.get(self.IDS, 0) != rows * 8 or sizes.get(self.VECTORS, 0) != rows * self.dim * 4:
+            logger.warning("Spill checkpoint in %s is inconsistent; starting over", self.directory)
+            return self._restore_empty()
+        for name in self.DATA:
+            # Drop whatever was appended after the checkpoint
+            with open(self.directory / name, 'ab') as f:
+                f.truncate(sizes[name])
+        self._sizes = sizes
+        self.rows = rows
+        self.files = {name: entry['sha256'] for name, entry in self.iter_files()}
+        return True
+
+    def _restore_empty(self) -> bool:
+        for name in self.DATA:
+            with open(self.directory / name, 'wb'):
+                pass
+        (self.directory / self.CHECKPOINT).unlink(missing_ok=True)
+        self._sizes = {}
+        self.rows = 0
+        self.files = {}
+        return False
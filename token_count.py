@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+"""
+Token-count estimate shared by the build and the chat server.
+
+build_index.py sizes chunks with it when the embedding model's tokenizer
+cannot be loaded, and rag_chat.py budgets the LLM context with it when the
+LLM's tokenizer cannot. Both must estimate the same way, so it lives here.
+"""
+import re
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def approx_token_count(text: str) -> int:
+    """Rough word-piece estimate used when no tokenizer can be loaded."""
+    return len(_TOKEN_RE.findall(text))